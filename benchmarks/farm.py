@@ -0,0 +1,169 @@
+"""
+Generate a synthetic farm of git repositories to benchmark against.
+
+Everything is local: each repository gets its own bare remote on disk, and
+some of those remotes are moved ahead of their clones so that there's
+something for ``report`` and ``update`` to find. A few large, clean
+repositories are kept apart under ``large/``, for what scales with the size
+of a worktree rather than with the number of repositories.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import os
+import pathlib
+import random
+import subprocess
+from collections.abc import Sequence
+
+GIT_ENV = {
+    "GIT_CONFIG_GLOBAL": os.devnull,
+    "GIT_CONFIG_NOSYSTEM": "1",
+    "GIT_AUTHOR_NAME": "git-meta",
+    "GIT_AUTHOR_EMAIL": "git-meta@example.com",
+    "GIT_COMMITTER_NAME": "git-meta",
+    "GIT_COMMITTER_EMAIL": "git-meta@example.com",
+}
+
+
+@dataclasses.dataclass
+class FarmSpec:
+    repos: int = 100
+    max_depth: int = 3
+    min_files: int = 1
+    max_files: int = 50
+    untracked_ratio: float = 0.2
+    dirty_ratio: float = 0.2
+    behind_ratio: float = 0.3
+    noise_dirs: int = 50
+    large_repos: int = 1
+    large_files: int = 20_000
+    seed: int = 0
+
+    @classmethod
+    def from_json(cls, doc: dict) -> FarmSpec:
+        return cls(**doc)
+
+
+def _git(*args: str | pathlib.Path, cwd: pathlib.Path | None = None) -> str:
+    return subprocess.run(
+        args=("git", *map(str, args)),
+        cwd=cwd,
+        env={**os.environ, **GIT_ENV},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def _write_files(
+    directory: pathlib.Path, count: int, prefix: str, dirs: int = 5
+) -> None:
+    for i in range(count):
+        path = directory / f"dir-{i % dirs}" / f"{prefix}-{i}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"{prefix} {i}\n")
+
+
+def _advance_remote(remote: pathlib.Path, commits: int) -> None:
+    """
+    Add empty commits to the bare remote's default branch without needing
+    a worktree.
+    """
+
+    for i in range(commits):
+        tree = _git("rev-parse", "main^{tree}", cwd=remote)
+        commit = _git(
+            "commit-tree", tree, "-p", "main", "-m", f"Remote {i}", cwd=remote
+        )
+        _git("update-ref", "refs/heads/main", commit, cwd=remote)
+
+
+def _make_repo(
+    repo: pathlib.Path, remote: pathlib.Path, files: int, dirs: int = 5
+) -> None:
+    """
+    Create a repository with a commit of the given number of files, tracking
+    a bare clone of itself as its remote.
+    """
+
+    _git("init", "--quiet", "--initial-branch", "main", repo)
+    _write_files(repo, files, "file", dirs)
+    _git("add", "--all", cwd=repo)
+    _git("commit", "--quiet", "--message", "Initial commit", cwd=repo)
+    _git("clone", "--quiet", "--bare", repo, remote)
+    _git("remote", "add", "origin", remote, cwd=repo)
+    _git("fetch", "--quiet", "origin", cwd=repo)
+    _git("branch", "--quiet", "--set-upstream-to", "origin/main", cwd=repo)
+
+
+def make_farm(root: pathlib.Path, spec: FarmSpec) -> list[pathlib.Path]:
+    """
+    Create the farm described by the spec under the root directory and
+    return the paths of its repositories.
+    """
+
+    rng = random.Random(spec.seed)  # noqa: S311
+    workspace = root / "workspace"
+    remotes = root / "remotes"
+    remotes.mkdir(parents=True, exist_ok=True)
+
+    # Plain directories for discovery to walk through and prune
+    for i in range(spec.noise_dirs):
+        noise = workspace / f"noise-{i}" / "node_modules" / "package"
+        noise.mkdir(parents=True, exist_ok=True)
+        (noise / "index.js").write_text("\n")
+
+    repos = []
+    for i in range(spec.repos):
+        nesting = [
+            f"group-{rng.randrange(10)}"
+            for _ in range(rng.randint(0, spec.max_depth))
+        ]
+        repo = workspace.joinpath(*nesting, f"repo-{i}")
+        remote = remotes / f"repo-{i}.git"
+
+        _make_repo(repo, remote, rng.randint(spec.min_files, spec.max_files))
+        if rng.random() < spec.behind_ratio:
+            _advance_remote(remote, rng.randint(1, 3))
+        if rng.random() < spec.untracked_ratio:
+            _write_files(repo, rng.randint(1, 10), "untracked")
+        if rng.random() < spec.dirty_ratio:
+            (repo / "dir-0" / "file-0.txt").write_text("dirty\n")
+
+        repos.append(repo)
+
+    for i in range(spec.large_repos):
+        repo = workspace / "large" / f"repo-{i}"
+        remote = remotes / f"large-{i}.git"
+        # Around a hundred files per directory, like a real source tree
+        _make_repo(
+            repo, remote, spec.large_files, max(spec.large_files // 100, 1)
+        )
+        repos.append(repo)
+
+    return repos
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("root", type=pathlib.Path)
+    for field in dataclasses.fields(FarmSpec):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(field.default),
+            default=field.default,
+        )
+    args = vars(parser.parse_args(argv))
+    root = args.pop("root")
+
+    repos = make_farm(root, FarmSpec(**args))
+    print(json.dumps({"root": str(root), "repos": len(repos)}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
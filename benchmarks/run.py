@@ -0,0 +1,232 @@
+"""
+Time discovery, ``report`` and ``update`` end to end against a synthetic
+farm of repositories, and write the timings as JSON.
+
+The farm is generated once and copied afresh for each repeat, so that
+fetching and fast-forwarding in one repeat doesn't change what the next
+one has to do. Pass ``--compare`` with the results of an earlier run to see
+how the timings have moved.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import importlib.metadata
+import json
+import os
+import pathlib
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import AsyncIterable, Awaitable, Callable, Sequence
+from typing import Any
+
+import git_meta
+from benchmarks.farm import GIT_ENV, FarmSpec, make_farm
+from git_meta.cache import ReportCache
+from git_meta.main import DEFAULT_JOBS
+
+
+async def _drain(results: AsyncIterable[Any]) -> int:
+    count = 0
+    async for _ in results:
+        count += 1
+
+    return count
+
+
+async def _time(run: Callable[[], Awaitable[int]]) -> tuple[float, int]:
+    start = time.perf_counter()
+    count = await run()
+    return time.perf_counter() - start, count
+
+
+async def _run_once(
+    workspace: pathlib.Path,
+    scratch: pathlib.Path,
+    jobs: int,
+) -> dict[str, tuple[float, int]]:
+    """
+    Run each benchmark once, in order, against the workspace.
+    """
+
+    index_filepath = scratch / "discovery.json"
+    report_cache = ReportCache(filepath=scratch / "reports.json")
+    large_report_cache = ReportCache(filepath=scratch / "large-reports.json")
+
+    def discover(rescan: bool) -> Callable[[], Awaitable[int]]:
+        async def run() -> int:
+            repos = git_meta.get_git_repos(
+                workspace,
+                select="",
+                exclude="^$",
+                rescan=rescan,
+                index_filepath=index_filepath,
+            )
+            return len(repos)
+
+        return run
+
+    repos = git_meta.get_git_repos(
+        workspace, select="", exclude="^$", index_filepath=index_filepath
+    )
+    large_repos = [
+        repo for repo in repos if workspace / "large" in repo.parents
+    ]
+
+    def report(
+        fetch: bool,
+        cache: ReportCache | None = None,
+        repos: list[pathlib.Path] = repos,
+    ) -> Callable[[], Awaitable[int]]:
+        async def run() -> int:
+            return await _drain(
+                git_meta.git_report(
+                    repos, fetch=fetch, jobs=jobs, report_cache=cache
+                )
+            )
+
+        return run
+
+    async def update() -> int:
+        return await _drain(git_meta.pull_repo_main_branches(repos, jobs=jobs))
+
+    benchmarks = {
+        "discovery-cold": discover(rescan=True),
+        "discovery-warm": discover(rescan=False),
+        "report": report(fetch=False),
+        "report-cache-cold": report(fetch=False, cache=report_cache),
+        "report-cache-warm": report(fetch=False, cache=report_cache),
+        "report-large": report(fetch=False, repos=large_repos),
+        "report-large-cache-cold": report(
+            fetch=False, cache=large_report_cache, repos=large_repos
+        ),
+        "report-large-cache-warm": report(
+            fetch=False, cache=large_report_cache, repos=large_repos
+        ),
+        "report-fetch": report(fetch=True),
+        "update": update,
+    }
+    return {name: await _time(run) for name, run in benchmarks.items()}
+
+
+def _git_version() -> str:
+    return subprocess.run(
+        args=("git", "--version"),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.strip()
+
+
+def run(spec: FarmSpec, repeat: int, jobs: int) -> dict:
+    """
+    Generate the farm and return the timings of each benchmark.
+    """
+
+    os.environ.update(GIT_ENV)
+    timings: dict[str, list[float]] = {}
+    counts: dict[str, int] = {}
+    with tempfile.TemporaryDirectory(prefix="git-meta-bench-") as tmp:
+        root = pathlib.Path(tmp)
+        make_farm(root / "farm", spec)
+        for i in range(repeat):
+            workspace = root / f"run-{i}"
+            scratch = root / f"scratch-{i}"
+            shutil.copytree(root / "farm" / "workspace", workspace)
+            scratch.mkdir()
+            results = asyncio.run(_run_once(workspace, scratch, jobs))
+            for name, (seconds, count) in results.items():
+                timings.setdefault(name, []).append(seconds)
+                counts[name] = count
+            shutil.rmtree(workspace)
+
+    return {
+        "git_meta": importlib.metadata.version("git-meta"),
+        "git": _git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "farm": dataclasses.asdict(spec),
+        "jobs": jobs,
+        "repeat": repeat,
+        "benchmarks": {
+            name: {
+                "results": counts[name],
+                "seconds": seconds,
+                "min": min(seconds),
+                "median": statistics.median(seconds),
+            }
+            for name, seconds in timings.items()
+        },
+    }
+
+
+def compare(baseline: dict, results: dict) -> str:
+    """
+    Return a table of the median timings against the baseline's.
+    """
+
+    lines = [f"{'benchmark':<20} {'baseline':>10} {'current':>10} {'ratio':>7}"]
+    for name, current in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before is None:
+            lines.append(f"{name:<20} {'-':>10} {current['median']:>10.3f}")
+            continue
+        ratio = current["median"] / before["median"]
+        lines.append(
+            f"{name:<20} {before['median']:>10.3f}"
+            f" {current['median']:>10.3f} {ratio:>7.2f}"
+        )
+
+    return "\n".join(lines)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    for field in dataclasses.fields(FarmSpec):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(field.default),
+            default=field.default,
+        )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="the file to write the results to. defaults to stdout",
+        type=pathlib.Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--compare",
+        help="the results of an earlier run to compare against",
+        type=pathlib.Path,
+        default=None,
+    )
+    args = vars(parser.parse_args(argv))
+    repeat, jobs = args.pop("repeat"), args.pop("jobs")
+    output, baseline = args.pop("output"), args.pop("compare")
+
+    results = run(FarmSpec(**args), repeat=repeat, jobs=jobs)
+    if output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        output.write_text(json.dumps(results, indent=2) + "\n")
+    if baseline is not None:
+        print(
+            compare(json.loads(baseline.read_text()), results), file=sys.stderr
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,27 @@
 from git_meta.main import (
     get_git_repos,
+    get_repo_state,
     git_report,
+    maintain_repos,
     pull_repo_main_branches,
+    report_states,
+    report_states_in_processes,
+    revert_tuning,
+    stream_git_repos,
+    tune_repos,
+    update_states,
 )
 
 __all__ = [
     "get_git_repos",
+    "get_repo_state",
     "git_report",
+    "maintain_repos",
     "pull_repo_main_branches",
+    "report_states",
+    "report_states_in_processes",
+    "revert_tuning",
+    "stream_git_repos",
+    "tune_repos",
+    "update_states",
 ]
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import array
+import collections
+import dataclasses
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+from git_meta.constants import CACHE_HOME, PROGRAM
+from git_meta.metadata import GitMetadata
+from git_meta.status import GitStatus, RepoStatus
+
+DEFAULT_CACHE_FILEPATH = CACHE_HOME / PROGRAM / "reports.json"
+DEFAULT_MAX_ENTRIES = 10_000
+
+type Fingerprint = list[int]
+
+# Files modified this recently may be modified again within the same mtime
+# tick, without their stat data changing (like git's "racy" index entries)
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+def _stat_fingerprint(path: pathlib.Path | bytes | None) -> tuple[int, int]:
+    if path is None:
+        return 0, 0
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return 0, 0
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _worktree_stats(
+    repo_dir: pathlib.Path, tracked_paths: list[bytes], racy_after_ns: int
+) -> bytes | None:
+    """
+    Return the stat data of the tracked files (in the index's order), of the
+    directories they're in and of the untracked directories within those, or
+    ``None`` if any of them was modified after ``racy_after_ns``.
+    """
+
+    root = os.fsencode(repo_dir) + b"/"
+    lstat = os.lstat
+    stats = array.array("q")
+    tracked_dirs = {b""}
+    last_dir = b""
+    for path in tracked_paths:
+        try:
+            stat = lstat(root + path)
+        except OSError:
+            stats.extend((0, 0))
+        else:
+            if stat.st_mtime_ns > racy_after_ns:
+                return None
+            stats.extend((stat.st_mtime_ns, stat.st_size))
+        parent = path.rpartition(b"/")[0]
+        if parent == last_dir:
+            continue
+        last_dir = parent
+        while parent not in tracked_dirs:
+            tracked_dirs.add(parent)
+            parent = parent.rpartition(b"/")[0]
+
+    untracked_dirs = []
+    for tracked_dir in sorted(tracked_dirs):
+        directory = root + tracked_dir
+        try:
+            with os.scandir(directory) as entries:
+                names = sorted(
+                    entry.name
+                    for entry in entries
+                    if entry.is_dir(follow_symlinks=False)
+                )
+        except OSError:
+            continue
+        prefix = tracked_dir + b"/" if tracked_dir else b""
+        untracked_dirs.extend(
+            path
+            for name in names
+            if (path := prefix + name) not in tracked_dirs and path != b".git"
+        )
+
+    untracked_dirs_start = len(stats)
+    for path in [*sorted(tracked_dirs), *untracked_dirs]:
+        mtime_ns, size = _stat_fingerprint(root + path)
+        if mtime_ns > racy_after_ns:
+            return None
+        stats.extend((mtime_ns, size))
+
+    # The index covers which files are tracked, but not which directories
+    # are untracked
+    return b"\0".join(
+        [stats.tobytes(), str(untracked_dirs_start).encode(), *untracked_dirs]
+    )
+
+
+def fingerprint(repo_dir: pathlib.Path) -> Fingerprint | None:
+    """
+    Return a fingerprint of the repository's state, built from the mtimes
+    and sizes of the files that change when its status could have: its refs,
+    its index and, like ``git status`` itself, the tracked files in its
+    worktree (plus their directories, where untracked files would appear).
+
+    Returns ``None`` when the fingerprint can't be trusted, so nothing should
+    be cached: when the index can't be read (see
+    ``GitMetadata.tracked_paths``), or when something was modified so
+    recently that it could be modified again without its mtime changing.
+    An untracked file added deep within untracked directories isn't noticed,
+    but it doesn't change what's reported either, unless those directories
+    were all empty.
+    """
+
+    metadata = GitMetadata(repo_dir)
+    git_dir, common_dir = metadata.git_dir, metadata.common_dir
+    if git_dir is None or common_dir is None:
+        return None
+    if (tracked_paths := metadata.tracked_paths) is None:
+        return None
+
+    paths = [
+        git_dir / "index",
+        git_dir / "HEAD",
+        common_dir / "config",
+        common_dir / "info" / "exclude",
+        common_dir / "packed-refs",
+        common_dir / "refs" / "heads",
+    ]
+    if (branch := metadata.current_branch) is not None:
+        paths.append(common_dir / "refs" / "heads" / branch)
+        if (upstream := metadata.upstream_ref(branch)) is not None:
+            paths.append(common_dir / upstream)
+
+    stats = [_stat_fingerprint(path) for path in paths]
+    racy_after_ns = time.time_ns() - _RACY_WINDOW_NS
+    worktree = _worktree_stats(repo_dir, tracked_paths, racy_after_ns)
+    if worktree is None:
+        return None
+    if any(mtime_ns > racy_after_ns for mtime_ns, _ in stats):
+        return None
+
+    return [
+        *(value for stat in stats for value in stat),
+        int.from_bytes(hashlib.blake2b(worktree, digest_size=8).digest()),
+    ]
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    fingerprint: Fingerprint
+    status: GitStatus
+    flags: RepoStatus
+
+    @classmethod
+    def from_json(cls, doc: dict) -> CacheEntry:
+        return cls(
+            fingerprint=doc["fingerprint"],
+            status=GitStatus(**doc["status"]),
+            flags=RepoStatus(doc["flags"]),
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "status": dataclasses.asdict(self.status),
+            "flags": self.flags.value,
+        }
+
+
+class ReportCache:
+    """
+    The last status of each repository, keyed by its path, which is reused
+    while the repository's fingerprint hasn't changed.
+
+    The least recently used entries are evicted once there are more than
+    ``max_entries`` of them.
+    """
+
+    def __init__(
+        self,
+        filepath: pathlib.Path | None = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.filepath = (
+            filepath if filepath is not None else DEFAULT_CACHE_FILEPATH
+        )
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict[str, CacheEntry] = (
+            collections.OrderedDict()
+        )
+
+    @classmethod
+    def load(
+        cls,
+        filepath: pathlib.Path | None = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> ReportCache:
+        cache = cls(filepath=filepath, max_entries=max_entries)
+        try:
+            with open(cache.filepath) as f:
+                doc = json.load(f)
+            for repo, entry in doc.get("entries", {}).items():
+                cache.entries[repo] = CacheEntry.from_json(entry)
+        except (OSError, ValueError, TypeError, KeyError):
+            # A missing or corrupt cache just means recomputing everything
+            cache.entries.clear()
+
+        return cache
+
+    def save(self) -> None:
+        """
+        Write the cache, keeping the entries that other processes (like the
+        other shards of a report) have saved since it was loaded.
+        """
+
+        saved = ReportCache.load(self.filepath, self.max_entries).entries
+        entries = collections.OrderedDict(
+            (repo, entry)
+            for repo, entry in saved.items()
+            if repo not in self.entries
+        )
+        entries.update(self.entries)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        _tmp_path = self.filepath.with_suffix(f".{os.getpid()}.tmp")
+        with open(_tmp_path, "w+") as f:
+            json.dump(
+                {
+                    "entries": {
+                        repo: entry.to_json() for repo, entry in entries.items()
+                    }
+                },
+                f,
+            )
+
+        os.replace(_tmp_path, self.filepath)
+
+    def get(
+        self,
+        repo_dir: pathlib.Path,
+        fingerprint_: Fingerprint,
+    ) -> tuple[GitStatus, RepoStatus] | None:
+        """
+        Return the cached status of the repository if its fingerprint matches.
+        """
+
+        repo = str(repo_dir)
+        entry = self.entries.get(repo)
+        if entry is None or entry.fingerprint != fingerprint_:
+            return None
+
+        self.entries.move_to_end(repo)
+        return entry.status, entry.flags
+
+    def put(
+        self,
+        repo_dir: pathlib.Path,
+        fingerprint_: Fingerprint,
+        status: GitStatus,
+        flags: RepoStatus,
+    ) -> None:
+        repo = str(repo_dir)
+        self.entries[repo] = CacheEntry(fingerprint_, status, flags)
+        self.entries.move_to_end(repo)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
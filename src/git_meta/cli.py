@@ -2,16 +2,36 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import functools
+import contextlib
 import importlib.metadata
+import json
 import pathlib
+import signal
+import sys
 import textwrap
-from collections.abc import Sequence
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable, Sequence
 
 import git_meta
+from git_meta import (
+    cache,
+    concurrency,
+    daemon,
+    discovery,
+    fetcher,
+    git,
+    history,
+    maintain,
+    schedule,
+    shard,
+    timings,
+    tune,
+)
+from git_meta.status import RepoState
 
 SUCCESS = 0
 FAILURE = 1
+INTERRUPTED = 130  # 128 + SIGINT, like shells
 
 RED = "\033[1;31m"
 GREEN = "\033[1;32m"
@@ -47,70 +67,492 @@ def _print_multiline(
     )
 
 
-async def _update(args: argparse.Namespace) -> int:
-    root_directory = pathlib.Path(getattr(args, "root-dir"))
-    print(
-        f"Updating git repositories at '{root_directory.resolve()}'", flush=True
+def _fetcher(args: argparse.Namespace) -> fetcher.Fetcher:
+    return fetcher.Fetcher(
+        jobs_per_host=args.fetch_jobs_per_host,
+        max_age=args.fetch_max_age,
+        precheck=args.fetch_precheck,
+        ssh_multiplex=args.ssh_multiplex,
+        mode=args.fetch_mode,
     )
 
-    repositories = git_meta.get_git_repos(
+
+def _jobs(text: str) -> git_meta.main.Jobs:
+    if text == concurrency.AUTO:
+        return concurrency.AUTO
+    return int(text)
+
+
+def _recorder(args: argparse.Namespace) -> timings.Recorder | None:
+    if args.timings or args.timings_file is not None:
+        return timings.Recorder()
+    return None
+
+
+def _print_timings(
+    args: argparse.Namespace,
+    recorder: timings.Recorder | None,
+) -> None:
+    if recorder is None:
+        return
+    if args.timings_file is not None:
+        recorder.export(args.timings_file, format_=args.timings_format)
+    if args.timings:
+        # Keep structured output on stdout parseable
+        file = (
+            sys.stdout
+            if getattr(args, "format", "text") == "text"
+            else sys.stderr
+        )
+        print(recorder.summary(), file=file, flush=True)
+
+
+def _print_state(
+    args: argparse.Namespace, state: RepoState, count: int
+) -> None:
+    """
+    Print the state of the ``count``-th repository as soon as it's known.
+
+    Structured formats print every repository, one record per line: JSON
+    writes them as the elements of an array, which ``_end_states`` closes.
+    """
+
+    if args.format == "text":
+        rc, header, summary = git_meta.main.format_report(
+            state=state,
+            print_all=args.print_all,
+            quiet_level=args.quiet,
+        )
+        if rc != -1:
+            _print_multiline(header=header, text=summary, text_prefix="\t")
+        return
+
+    _print_record(args, state.to_record(), count)
+
+
+def _print_record(args: argparse.Namespace, record: dict, count: int) -> None:
+    text = json.dumps(record)
+    if args.format == "ndjson":
+        sys.stdout.write(text + "\n")
+    else:
+        sys.stdout.write(("[\n" if count == 0 else ",\n") + text)
+    sys.stdout.flush()
+
+
+def _end_states(args: argparse.Namespace, count: int) -> None:
+    if args.format == "json":
+        sys.stdout.write("\n]\n" if count else "[]\n")
+        sys.stdout.flush()
+
+
+def _print_states(args: argparse.Namespace, states: list[RepoState]) -> None:
+    for count, state in enumerate(states):
+        _print_state(args, state, count)
+    _end_states(args, len(states))
+
+
+def _sharded(args: argparse.Namespace) -> str:
+    return f" (shard {args.shard})" if args.shard is not None else ""
+
+
+async def _discover(
+    args: argparse.Namespace,
+    root_directory: pathlib.Path,
+    found: list[pathlib.Path],
+) -> AsyncGenerator[pathlib.Path]:
+    """
+    Stream the repositories to work on, collecting them into ``found``.
+    """
+
+    prune = set(args.prune)
+    if args.default_prune:
+        prune |= discovery.DEFAULT_PRUNE
+
+    async for repo_dir in git_meta.stream_git_repos(
         directory=root_directory,
         select=args.select,
         exclude=args.exclude,
-    )
-    print(f"Found {len(repositories)} git repositories", flush=True)
+        rescan=args.rescan,
+        max_depth=args.max_depth,
+        prune=prune,
+        nested=args.nested,
+        shard=getattr(args, "shard", None),
+    ):
+        found.append(repo_dir)
+        yield repo_dir
+
 
-    report_results = git_meta.pull_repo_main_branches(
-        repositories=repositories,
+async def _update(args: argparse.Namespace) -> int:
+    root_directory = pathlib.Path(getattr(args, "root-dir"))
+    text = args.format == "text"
+    if text:
+        print(
+            f"Updating git repositories at '{root_directory.resolve()}'"
+            + _sharded(args),
+            flush=True,
+        )
+
+    repositories: list[pathlib.Path] = []
+    recorder = _recorder(args)
+
+    states = git_meta.update_states(
+        repositories=_discover(args, root_directory, repositories),
         fetch=args.fetch,
+        jobs=args.jobs,
+        fetcher=_fetcher(args),
+        repo_timeout=args.repo_timeout,
+        durations=schedule.Durations.load(),
+        schedule=args.schedule,
     )
-    async for report_result in report_results:
-        rc, header, summary = report_result
-        if rc != -1:
-            _print_multiline(header=header, text=summary, text_prefix="\t")
+    with contextlib.ExitStack() as stack:
+        results_file = (
+            stack.enter_context(open(args.results, "w"))
+            if args.results is not None
+            else None
+        )
+        stack.enter_context(timings.recording(recorder))
+        count = 0
+        async for state in states:
+            if results_file is not None:
+                shard.write_result(state, results_file)
+            if not text:
+                _print_record(args, state.to_record(), count)
+                count += 1
+                continue
+            rc, header, summary = git_meta.main.format_update(
+                state, quiet_level=args.quiet
+            )
+            if rc != -1:
+                _print_multiline(header=header, text=summary, text_prefix="\t")
+    _end_states(args, count)
+
+    if text:
+        print(f"Found {len(repositories)} git repositories", flush=True)
+    _print_timings(args, recorder)
+    if text:
+        print(colour("All repositories updated!", GREEN), flush=True)
+    return SUCCESS
+
+
+async def _report_from_daemon(args: argparse.Namespace) -> int:
+    root_directory = pathlib.Path(getattr(args, "root-dir")).resolve()
+    try:
+        states = [
+            state
+            async for state in daemon.query(args.socket)
+            if pathlib.Path(state.repo_dir).is_relative_to(root_directory)
+        ]
+    except daemon.DaemonError as e:
+        print(colour(str(e), RED), flush=True)
+        return FAILURE
+
+    states.sort(key=lambda state: state.repo_dir)
+    _print_states(args, states)
+
+    return SUCCESS
+
+
+async def _merge(args: argparse.Namespace) -> int:
+    try:
+        states = shard.load_results(args.results_files)
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        print(colour(f"Couldn't read the results: {e}", RED), flush=True)
+        return FAILURE
+
+    _print_states(args, states)
+    if args.format == "text":
+        print(
+            f"Merged {len(states)} git repositories"
+            f" from {len(args.results_files)} files",
+            flush=True,
+        )
 
-    print(colour("All repositories updated!", GREEN), flush=True)
     return SUCCESS
 
 
 async def _report(args: argparse.Namespace) -> int:
+    if args.from_daemon:
+        return await _report_from_daemon(args)
+
+    root_directory = pathlib.Path(getattr(args, "root-dir"))
+    text = args.format == "text"
+    # Repositories that became clean are news too
+    args.print_all = args.print_all or args.changed_since_last
+    if text:
+        print(
+            f"Reporting on git repositories at '{root_directory.resolve()}'"
+            + _sharded(args),
+            flush=True,
+        )
+
+    repositories: list[pathlib.Path] = []
+    recorder = _recorder(args)
+
+    report_kwargs = {
+        "fetch": args.fetch,
+        "jobs": args.jobs,
+        "fetcher": _fetcher(args),
+        "report_cache": cache.ReportCache.load() if args.cache else None,
+        "repo_timeout": args.repo_timeout,
+        "status_timeout": args.status_timeout,
+        "max_paths": None if args.all_paths else args.max_paths,
+        "branches": args.branches,
+        "durations": schedule.Durations.load(),
+        "schedule": args.schedule,
+    }
+    discovered = _discover(args, root_directory, repositories)
+    if args.processes > 1:
+        states = git_meta.main.report_states_in_processes(
+            discovered, root_directory, args.processes, **report_kwargs
+        )
+    else:
+        states = git_meta.report_states(discovered, **report_kwargs)
+    with contextlib.ExitStack() as stack:
+        results_file = (
+            stack.enter_context(open(args.results, "w"))
+            if args.results is not None
+            else None
+        )
+        history_ = (
+            stack.enter_context(history.History.open())
+            if args.history or args.changed_since_last
+            else None
+        )
+        if args.history and history_ is not None:
+            history_.start(root_directory.resolve())
+        stack.enter_context(timings.recording(recorder))
+        count = 0
+        async for state in states:
+            if results_file is not None:
+                shard.write_result(state, results_file)
+            changed = history_ is None or history_.changed(state)
+            if args.history and history_ is not None:
+                history_.record(state)
+            if args.changed_since_last and not changed:
+                continue
+            _print_state(args, state, count)
+            count += 1
+        if history_ is not None:
+            history_.finish()
+    _end_states(args, count)
+
+    if text:
+        if args.changed_since_last:
+            print(
+                f"{count} changed since the last report",
+                flush=True,
+            )
+        print(f"Found {len(repositories)} git repositories", flush=True)
+    _print_timings(args, recorder)
+    return SUCCESS
+
+
+def _format_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+async def _history(args: argparse.Namespace) -> int:
+    with history.History.open() as history_:
+        if args.repo_dir is not None:
+            repo_dir = str(args.repo_dir.resolve())
+            records = history_.entries(repo_dir, limit=args.limit)
+            lines = [
+                f"{_format_time(entry.started_at)}"
+                f"  {entry.duration or 0:8.3f}s"
+                f"  {entry.flags}"
+                + (f"  {colour(entry.error, RED)}" if entry.error else "")
+                for entry in records
+            ]
+            empty = f"No history for '{repo_dir}'"
+        else:
+            records = history_.slowing(window=args.window, limit=args.limit)
+            lines = [
+                f"{trend.recent:8.3f}s  (was {trend.before:.3f}s,"
+                f" x{trend.ratio:.2f})  {trend.repo_dir}"
+                for trend in records
+            ]
+            empty = "Not enough history to compare yet"
+
+    if args.format == "ndjson":
+        for record in records:
+            print(json.dumps(record.to_json()), flush=True)
+    elif not lines:
+        print(empty, flush=True)
+    else:
+        print("\n".join(lines), flush=True)
+
+    return SUCCESS
+
+
+async def _tune(args: argparse.Namespace) -> int:
+    root_directory = pathlib.Path(getattr(args, "root-dir"))
+    print(
+        f"Tuning git repositories at '{root_directory.resolve()}'", flush=True
+    )
+
+    repositories: list[pathlib.Path] = []
+    if args.revert:
+        results = git_meta.revert_tuning(
+            _discover(args, root_directory, repositories),
+            jobs=args.jobs,
+        )
+    else:
+        results = git_meta.tune_repos(
+            _discover(args, root_directory, repositories),
+            apply=args.apply,
+            accelerators=frozenset(args.accelerator or tune.ACCELERATORS),
+            min_files=args.min_files,
+            jobs=args.jobs,
+        )
+
+    rc = SUCCESS
+    async for result in results:
+        if result.error:
+            rc = FAILURE
+            summary = colour(result.error, RED)
+        elif args.revert:
+            if not result.changed:
+                continue
+            summary = "Restored " + ", ".join(result.changed)
+        elif result.recommended:
+            summary = (
+                f"{'Enabled' if args.apply else 'Recommended'}: "
+                + ", ".join(result.recommended)
+                + f"  ({result.entries or 0} files)"
+            )
+        else:
+            continue
+        _print_multiline(
+            header=colour(str(result.repo_dir), BOLD + BLUE),
+            text=summary,
+            text_prefix="\t",
+        )
+
+    print(f"Found {len(repositories)} git repositories", flush=True)
+    if not (args.apply or args.revert):
+        print("Run with --apply to enable the recommendations", flush=True)
+    return rc
+
+
+def _format_size(size: int) -> str:
+    scaled = float(size)
+    for unit in ("B", "KiB", "MiB"):
+        if abs(scaled) < 1024:  # noqa: PLR2004
+            return f"{size} B" if unit == "B" else f"{scaled:.1f} {unit}"
+        scaled /= 1024
+    return f"{scaled:.1f} GiB"
+
+
+async def _maintain(args: argparse.Namespace) -> int:
     root_directory = pathlib.Path(getattr(args, "root-dir"))
     print(
-        f"Reporting on git repositories at '{root_directory.resolve()}'",
+        f"Maintaining git repositories at '{root_directory.resolve()}'",
         flush=True,
     )
 
-    repositories = git_meta.get_git_repos(
-        directory=root_directory,
-        select=args.select,
-        exclude=args.exclude,
+    repositories: list[pathlib.Path] = []
+    results = git_meta.maintain_repos(
+        _discover(args, root_directory, repositories),
+        tasks=frozenset(args.task or maintain.TASKS),
+        jobs=args.jobs,
+        min_interval=0 if args.force else args.min_interval,
+        io_budget=args.io_budget,
+        measure=args.measure,
     )
+
+    rc = SUCCESS
+    count = skipped = reclaimed_bytes = 0
+    reclaimed_seconds = 0.0
+    probe = f"`git {' '.join(maintain.PROBE_ARGS)}`"
+    async for result in results:
+        if result.skipped:
+            skipped += 1
+            continue
+        count += 1
+        reclaimed_bytes += result.reclaimed_bytes
+        reclaimed_seconds += result.reclaimed_seconds
+        summary = (
+            f"Ran {', '.join(result.tasks) or 'nothing'}"
+            f" in {result.duration:.2f}s,"
+            f" reclaiming {_format_size(result.reclaimed_bytes)}"
+        )
+        if result.probe_before is not None and result.probe_after is not None:
+            summary += (
+                f" ({probe}: {result.probe_before:.2f}s"
+                f" -> {result.probe_after:.2f}s)"
+            )
+        if result.error:
+            rc = FAILURE
+            summary += "\n" + colour(result.error, RED)
+        _print_multiline(
+            header=colour(str(result.repo_dir), BOLD + BLUE),
+            text=summary,
+            text_prefix="\t",
+        )
+
     print(f"Found {len(repositories)} git repositories", flush=True)
+    summary = (
+        f"Maintained {count} of them (skipped {skipped}),"
+        f" reclaiming {_format_size(reclaimed_bytes)}"
+    )
+    if args.measure:
+        summary += f" and {reclaimed_seconds:.2f}s of {probe}"
+    print(summary, flush=True)
+    return rc
 
-    report_results = git_meta.git_report(
-        repositories=repositories,
-        fetch=args.fetch,
-        print_all=args.print_all,
-        quiet_level=args.quiet,
+
+async def _daemon(args: argparse.Namespace) -> int:
+    root_directory = pathlib.Path(getattr(args, "root-dir"))
+    print(
+        f"Watching git repositories at '{root_directory.resolve()}'"
+        f" on '{args.socket}'",
+        flush=True,
     )
-    async for report_result in report_results:
-        rc, header, summary = report_result
-        if rc != -1:
-            _print_multiline(header=header, text=summary, text_prefix="\t")
+
+    daemon_ = daemon.Daemon(
+        repositories=lambda: _discover(args, root_directory, []),
+        socket_path=args.socket,
+        jobs=args.jobs,
+        poll_interval=args.poll_interval,
+        refresh_interval=args.refresh_interval,
+        use_inotify=args.inotify,
+    )
+    serving = asyncio.create_task(daemon_.serve())
+    with contextlib.suppress(NotImplementedError):  # Windows
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
 
     return SUCCESS
 
 
-def _add_shared_arguments(parser: argparse.ArgumentParser) -> None:
+_COMMANDS: dict[str, Callable[[argparse.Namespace], Awaitable[int]]] = {
+    "update": _update,
+    "report": _report,
+    "merge": _merge,
+    "history": _history,
+    "tune": _tune,
+    "maintain": _maintain,
+    "daemon": _daemon,
+}
+
+
+def _add_socket_argument(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
-        "root-dir",
-        help="the root directory to discover git repositories from",
+        "--socket",
+        help="the path of the daemon's Unix socket",
+        type=pathlib.Path,
+        default=daemon.DEFAULT_SOCKET_PATH,
     )
+
+
+def _add_discovery_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
-        "--fetch",
-        help="whether to fetch updates from the remote",
-        action=argparse.BooleanOptionalAction,
-        default=True,
+        "root-dir",
+        help="the root directory to discover git repositories from",
     )
     parser.add_argument(
         "--select",
@@ -122,6 +564,178 @@ def _add_shared_arguments(parser: argparse.ArgumentParser) -> None:
         help="regex pattern to exclude repositories, matches full file path",
         default="^$",
     )
+    parser.add_argument(
+        "--max-depth",
+        help="how many directories deep to look for git repositories",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--prune",
+        help="directory name to skip when looking for git repositories (repeatable)",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--default-prune",
+        help="whether to skip common dependency and build directories, like node_modules",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--nested",
+        help="also look for git repositories (and submodules) inside git repositories",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--rescan",
+        help="walk the whole root directory instead of using the discovery index",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="the maximum number of repositories to process concurrently, or 'auto' to adapt the number of git commands run at once to the disk and network",
+        type=_jobs,
+        default=git_meta.main.DEFAULT_JOBS,
+    )
+
+
+def _add_shared_arguments(parser: argparse.ArgumentParser) -> None:
+    _add_discovery_arguments(parser)
+    parser.add_argument(
+        "--fetch",
+        help="whether to fetch updates from the remote",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--fetch-jobs-per-host",
+        help="the maximum number of concurrent fetches against each remote host",
+        type=int,
+        default=fetcher.DEFAULT_JOBS_PER_HOST,
+    )
+    parser.add_argument(
+        "--fetch-max-age",
+        help="skip fetching repositories that were fetched less than this many seconds ago",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--fetch-mode",
+        help="what to fetch from every remote: only the default branch without tags, or everything. defaults to each repository's fetch_mode config, then full",
+        choices=fetcher.FETCH_MODES,
+        default=None,
+    )
+    parser.add_argument(
+        "--fetch-precheck",
+        help="whether to skip fetching when `git ls-remote` shows that the tracked branches are up to date",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--ssh-multiplex",
+        help="whether to share one SSH connection per host across fetches",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--shard",
+        help="only work on this shard of the repositories, like 1/4, split by a stable hash of their paths under the root directory",
+        type=shard.Shard.parse,
+        default=None,
+    )
+    parser.add_argument(
+        "--schedule",
+        help="the order to start the repositories in: as they're found, or longest-running first (by how long they took before). repositories still start as they're found, so lpt only reorders the ones waiting for a free job",
+        choices=schedule.SCHEDULES,
+        default="lpt",
+    )
+    parser.add_argument(
+        "--command-timeout",
+        help="kill any git command that takes longer than this many seconds",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--repo-timeout",
+        help="give up on any repository that takes longer than this many seconds",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--timings",
+        help="print the slowest repositories and git commands at the end",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--timings-file",
+        help="the file to write the timings of every repository and git command to",
+        type=pathlib.Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--timings-format",
+        help="the format of the timings file: NDJSON, or a Chrome trace (for chrome://tracing or Perfetto)",
+        choices=["ndjson", "chrome"],
+        default="ndjson",
+    )
+
+
+def _add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--format",
+        help="how to print the results: coloured text, or a JSON array or newline-delimited JSON with a record for every repository",
+        choices=["text", "json", "ndjson"],
+        default="text",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        help="reduce the verbosity level",
+        action="count",
+        default=0,
+    )
+
+
+def _add_maintain_arguments(parser: argparse.ArgumentParser) -> None:
+    _add_discovery_arguments(parser)
+    # Maintenance rewrites packs, so it has its own (smaller) concurrency
+    parser.set_defaults(jobs=maintain.DEFAULT_JOBS)
+    parser.add_argument(
+        "--task",
+        help="a maintenance task to run (repeatable). defaults to all of them",
+        action="append",
+        choices=list(maintain.TASKS),
+        default=None,
+    )
+    parser.add_argument(
+        "--min-interval",
+        help="skip repositories that were maintained less than this many seconds ago",
+        type=float,
+        default=maintain.DEFAULT_MIN_INTERVAL,
+    )
+    parser.add_argument(
+        "--force",
+        help="maintain repositories however recently they were maintained",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--io-budget",
+        help="stop starting repositories once the ones started have this many bytes of objects between them",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--measure",
+        help="time a history walk before and after the tasks, to show what they save",
+        action="store_true",
+        default=False,
+    )
 
 
 async def main(argv: Sequence[str] | None = None) -> int:
@@ -140,6 +754,13 @@ async def main(argv: Sequence[str] | None = None) -> int:
 
     parser__update = subparsers.add_parser("update")
     _add_shared_arguments(parser__update)
+    parser__update.add_argument(
+        "--results",
+        help="the file to write the full result of every repository to, one JSON object per line",
+        type=pathlib.Path,
+        default=None,
+    )
+    _add_output_arguments(parser__update)
 
     parser__report = subparsers.add_parser("report")
     _add_shared_arguments(parser__report)
@@ -150,24 +771,198 @@ async def main(argv: Sequence[str] | None = None) -> int:
         default=False,
     )
     parser__report.add_argument(
-        "-q",
-        "--quiet",
-        help="reduce the verbosity level",
-        action="count",
-        default=0,
+        "--cache",
+        help="whether to reuse the last status of repositories whose git files haven't changed",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser__report.add_argument(
+        "--from-daemon",
+        help="report the statuses held by a running `git-meta daemon` instead of checking the repositories",
+        action="store_true",
+        default=False,
+    )
+    parser__report.add_argument(
+        "--status-timeout",
+        help="retry `git status` without looking for untracked files if it takes longer than this many seconds, and flag the result as partial",
+        type=float,
+        default=git_meta.main.DEFAULT_STATUS_TIMEOUT,
+    )
+    parser__report.add_argument(
+        "--max-paths",
+        help="how many paths of each kind (staged, untracked, ...) to list for each repository. every path is still counted",
+        type=int,
+        default=git_meta.main.DEFAULT_MAX_PATHS,
+    )
+    parser__report.add_argument(
+        "--all-paths",
+        help="list every path, however many there are",
+        action="store_true",
+        default=False,
+    )
+    parser__report.add_argument(
+        "--branches",
+        help="compare every local branch with its upstream, not just the checked-out one",
+        action="store_true",
+        default=False,
+    )
+    parser__report.add_argument(
+        "--history",
+        help="whether to record the results in the history database, for --changed-since-last and `git-meta history`",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser__report.add_argument(
+        "--changed-since-last",
+        help="only report the repositories whose status has changed since they were last recorded",
+        action="store_true",
+        default=False,
+    )
+    parser__report.add_argument(
+        "--processes",
+        help="split the repositories between this many worker processes",
+        type=int,
+        default=1,
+    )
+    parser__report.add_argument(
+        "--results",
+        help="the file to write the full state of every repository to, for `git-meta merge`",
+        type=pathlib.Path,
+        default=None,
+    )
+    _add_socket_argument(parser__report)
+    _add_output_arguments(parser__report)
+
+    parser__merge = subparsers.add_parser("merge")
+    parser__merge.add_argument(
+        "results_files",
+        help="the files written by `git-meta report --results`, say by each shard",
+        metavar="results-file",
+        type=pathlib.Path,
+        nargs="+",
+    )
+    _add_output_arguments(parser__merge)
+    parser__merge.add_argument(
+        "--print-all",
+        help="whether to report on all the git repositories. defaults to only dirty repos",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+
+    parser__history = subparsers.add_parser("history")
+    parser__history.add_argument(
+        "repo_dir",
+        help="the repository to show the recorded results of. defaults to showing the repositories that have slowed down the most",
+        metavar="repo-dir",
+        type=pathlib.Path,
+        nargs="?",
+        default=None,
+    )
+    parser__history.add_argument(
+        "--limit",
+        help="how many results (or repositories) to show",
+        type=int,
+        default=20,
+    )
+    parser__history.add_argument(
+        "--window",
+        help="how many of the latest reports to compare against the same number before them",
+        type=int,
+        default=history.DEFAULT_WINDOW,
+    )
+    parser__history.add_argument(
+        "--format",
+        help="how to print the history: text, or newline-delimited JSON",
+        choices=["text", "ndjson"],
+        default="text",
     )
 
+    parser__daemon = subparsers.add_parser("daemon")
+    _add_discovery_arguments(parser__daemon)
+    _add_socket_argument(parser__daemon)
+    parser__daemon.add_argument(
+        "--inotify",
+        help="whether to watch the repositories with inotify (Linux only), rather than polling them",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser__daemon.add_argument(
+        "--poll-interval",
+        help="how often to poll the repositories that aren't watched with inotify, in seconds",
+        type=float,
+        default=daemon.DEFAULT_POLL_INTERVAL,
+    )
+    parser__daemon.add_argument(
+        "--refresh-interval",
+        help="how often to re-discover and refresh all repositories, in seconds",
+        type=float,
+        default=daemon.DEFAULT_REFRESH_INTERVAL,
+    )
+
+    parser__tune = subparsers.add_parser("tune")
+    _add_discovery_arguments(parser__tune)
+    parser__tune.add_argument(
+        "--apply",
+        help="enable the recommended accelerators, rather than only listing them",
+        action="store_true",
+        default=False,
+    )
+    parser__tune.add_argument(
+        "--revert",
+        help="restore the settings that were changed by an earlier --apply",
+        action="store_true",
+        default=False,
+    )
+    parser__tune.add_argument(
+        "--accelerator",
+        help="an accelerator to consider (repeatable). defaults to all of them",
+        action="append",
+        choices=list(tune.ACCELERATORS),
+        default=None,
+    )
+    parser__tune.add_argument(
+        "--min-files",
+        help="how many files a worktree needs for the fsmonitor and many-files accelerators to be recommended",
+        type=int,
+        default=tune.DEFAULT_MIN_FILES,
+    )
+
+    _add_maintain_arguments(subparsers.add_parser("maintain"))
+
     args = parser.parse_args(argv)
     # print(args)  # for debugging
-    if args.command == "update":
-        return await _update(args)
-    if args.command == "report":
-        return await _report(args)
+    with git.command_timeout(getattr(args, "command_timeout", None)):
+        if (command := _COMMANDS.get(args.command)) is not None:
+            return await command(args)
 
     parser.print_help()
     return SUCCESS
 
 
-async_main = functools.partial(asyncio.run, main())  # pragma: no cover
+async def _main_until_terminated() -> int:  # pragma: no cover
+    # Treat SIGTERM like Ctrl-C, since git runs in its own process groups
+    # and so won't get the signal itself
+    task = asyncio.current_task()
+    with contextlib.suppress(NotImplementedError):  # Windows
+        loop = asyncio.get_running_loop()
+        if task is not None:
+            loop.add_signal_handler(signal.SIGTERM, task.cancel)
+
+    return await main()
+
+
+def async_main() -> int:  # pragma: no cover
+    """
+    Run the CLI. On Ctrl-C or SIGTERM, the in-flight work is cancelled
+    (killing its git processes) before exiting.
+    """
+
+    try:
+        return asyncio.run(_main_until_terminated())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print(colour("Interrupted", RED), file=sys.stderr, flush=True)
+        return INTERRUPTED
+
+
 if __name__ == "__main__":
     raise SystemExit(async_main())  # pragma: no cover
@@ -0,0 +1,204 @@
+"""
+Adapt how many git commands run at once to how well the machine (and the
+network) copes with them, rather than running a fixed number.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import os
+import time
+from collections.abc import AsyncIterator, Iterator, Sequence
+
+from git_meta import timings
+
+AUTO = "auto"
+# How many repositories can be in flight when it's the git commands that are
+# limited, adaptively, rather than the repositories
+AUTO_MAX_JOBS = 256
+# Commands that wait on the network rather than on the disk
+NETWORK_COMMANDS = frozenset({"fetch", "ls-remote"})
+
+# The fewest operations to judge a limit by
+_MIN_WINDOW = 4
+# How quickly the lowest latency seen is forgotten, per window, so that the
+# limit can recover once whatever was competing for the disk has finished
+_BASELINE_DRIFT = 0.01
+
+# The limiters that git commands run under, if they're being limited
+_LIMITERS: contextvars.ContextVar[Limiters | None] = contextvars.ContextVar(
+    "limiters", default=None
+)
+
+
+class AdaptiveLimiter:
+    """
+    Limit how many operations run at once, adjusting the limit from their
+    latency and throughput with AIMD (additive increase, multiplicative
+    decrease), like TCP's congestion control.
+
+    The limit is reconsidered after each window of ``limit`` completed
+    operations. It's cut by ``backoff`` when their mean latency is more than
+    ``tolerance`` times the baseline (the lowest mean latency seen), held
+    when raising it last time didn't raise the throughput, and raised by one
+    otherwise.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        tolerance: float = 2.0,
+        backoff: float = 0.75,
+    ) -> None:
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.in_flight = 0
+        self._waiters: collections.deque[asyncio.Future[None]] = (
+            collections.deque()
+        )
+        self._latencies: list[float] = []
+        self._window_start = time.perf_counter()
+        self._baseline: float | None = None
+        self._throughput: float | None = None
+        self._raised = False
+
+    def _wake(self) -> None:
+        free = self.limit - self.in_flight
+        for waiter in self._waiters:
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _acquire(self) -> None:
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # pass the slot on to someone else
+                raise
+            finally:
+                self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def _adjust(self, latency: float, throughput: float) -> None:
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            self._baseline *= 1 + _BASELINE_DRIFT
+
+        if latency > self.tolerance * self._baseline:
+            self.limit = max(self.min_limit, int(self.limit * self.backoff))
+            self._raised = False
+        elif self._raised and throughput <= (self._throughput or 0):
+            self._raised = False  # more at once didn't get more done
+        elif self.limit < self.max_limit:
+            self.limit += 1
+            self._raised = True
+        self._throughput = throughput
+
+    def _observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        if len(self._latencies) < max(self.limit, _MIN_WINDOW):
+            return
+
+        now = time.perf_counter()
+        elapsed = max(now - self._window_start, 1e-9)
+        self._adjust(
+            latency=sum(self._latencies) / len(self._latencies),
+            throughput=len(self._latencies) / elapsed,
+        )
+        self._latencies.clear()
+        self._window_start = now
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Wait for a free slot, and time the operation in the context.
+        """
+
+        await self._acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._observe(time.perf_counter() - start)
+            self._wake()
+
+
+def _cpu_count() -> int:
+    return os.cpu_count() or 1
+
+
+@dataclasses.dataclass
+class Limiters:
+    """
+    Separate limiters for the git commands that wait on the network and for
+    those that wait on the disk, since they saturate at different points.
+    """
+
+    network: AdaptiveLimiter = dataclasses.field(
+        default_factory=lambda: AdaptiveLimiter(initial=8, max_limit=64)
+    )
+    disk: AdaptiveLimiter = dataclasses.field(
+        default_factory=lambda: AdaptiveLimiter(
+            initial=_cpu_count(), max_limit=4 * _cpu_count()
+        )
+    )
+
+    def for_command(self, args: Sequence[str]) -> AdaptiveLimiter:
+        command = timings.command_name(args).split(" ")[1:2]
+        if command and command[0] in NETWORK_COMMANDS:
+            return self.network
+        return self.disk
+
+
+def current_limiters() -> Limiters | None:
+    """
+    Return the limiters that git commands are running under, if any.
+    """
+
+    return _LIMITERS.get()
+
+
+@contextlib.contextmanager
+def limiting(limiters: Limiters) -> Iterator[Limiters]:
+    """
+    Run the git commands started in the context (including by tasks created
+    in it) under the limiters.
+    """
+
+    token = _LIMITERS.set(limiters)
+    try:
+        yield limiters
+    finally:
+        _LIMITERS.reset(token)
+
+
+@contextlib.asynccontextmanager
+async def slot(args: Sequence[str]) -> AsyncIterator[None]:
+    """
+    Wait for a slot to run the git command in, if git commands are being
+    limited.
+    """
+
+    if (limiters := current_limiters()) is None:
+        yield
+        return
+
+    async with limiters.for_command(args).slot():
+        yield
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import dataclasses
+import fnmatch
 import functools
 import json
 import pathlib
+import re
+from collections.abc import Callable, Iterable, Mapping
 from typing import Any
 
 from git_meta.constants import CONFIG_HOME, PROGRAM
@@ -17,18 +20,151 @@ DEFAULT_CONFIG_FILEPATH = CONFIG_HOME / PROGRAM / "config.json"
 
 @dataclasses.dataclass
 class RepoConfig:
-    default_branch_name: str = "main"
+    # Settings left as `None` fall back to the rules matching the repository
+    default_branch_name: str | None = None
+    fetch: bool | None = None
+    # What to fetch (see `fetcher.FetchProfile`): "minimal" is only the
+    # default branch, without tags, and "full" is what `git fetch` fetches
+    fetch_mode: str | None = None
+    fetch_tags: bool | None = None
+    # Only for repositories that are partial clones already, like "blob:none"
+    fetch_filter: str | None = None
+    # Makes the repository shallow, if it isn't already
+    fetch_depth: int | None = None
+    # The git settings changed by `git-meta tune`, and their previous values
+    tuned: dict[str, str | None] = dataclasses.field(default_factory=dict)
 
     @classmethod
     def from_json(cls, doc: dict) -> RepoConfig:
         return cls(**doc)
 
 
+# The settings that rules can set, as opposed to per-repository state
+_RULE_SETTINGS = (
+    "default_branch_name",
+    "fetch",
+    "fetch_mode",
+    "fetch_tags",
+    "fetch_filter",
+    "fetch_depth",
+)
+_GLOB_CHARS = frozenset("*?[")
+
+
+def _pattern_parts(pattern: str) -> tuple[str, ...]:
+    return pathlib.Path(pattern).expanduser().absolute().parts
+
+
+class _Node:
+    """
+    A node in the trie of pattern components.
+    """
+
+    def __init__(self, any_depth: bool = False) -> None:
+        self.literals: dict[str, _Node] = {}
+        # Keyed by the glob, so rules sharing a glob share its node, with
+        # the glob compiled once rather than on every path component
+        self.globs: dict[str, tuple[Callable[[str], Any], _Node]] = {}
+        # The node for a `**` component, which matches any number of them
+        self.any_depth_child: _Node | None = None
+        self.any_depth = any_depth
+        self.rules: list[int] = []
+
+    def child(self, part: str) -> _Node:
+        if part == "**":
+            if self.any_depth_child is None:
+                self.any_depth_child = _Node(any_depth=True)
+            return self.any_depth_child
+        if _GLOB_CHARS.intersection(part):
+            if part not in self.globs:
+                pattern = re.compile(fnmatch.translate(part))
+                self.globs[part] = (pattern.match, _Node())
+            return self.globs[part][1]
+        return self.literals.setdefault(part, _Node())
+
+    def step(self, part: str) -> Iterable[_Node]:
+        """
+        Yield the children that match the path component: the literal one
+        is looked up by name, but each distinct glob is tested in turn.
+        """
+
+        if (node := self.literals.get(part)) is not None:
+            yield node
+        for match, node in self.globs.values():
+            if match(part):
+                yield node
+        if self.any_depth:
+            yield self
+
+
+def _with_any_depth(nodes: Iterable[_Node]) -> list[_Node]:
+    # A `**` component can also match no components at all
+    closure: dict[int, _Node] = {}
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if id(node) in closure:
+            continue
+        closure[id(node)] = node
+        if node.any_depth_child is not None:
+            stack.append(node.any_depth_child)
+
+    return list(closure.values())
+
+
+class RuleMatcher[T]:
+    """
+    Match repository paths against the patterns of the config's rules,
+    returning the rules' values.
+
+    The patterns are compiled once into a trie of path components, so a
+    path is matched in a single walk down it, looking literal components up
+    by name and only testing the glob components (``*``, ``?``, ``[...]``
+    and ``**``) that branch off the nodes visited. Those are tested one by
+    one, so matching costs time in the number of distinct globs at the
+    nodes visited, rather than in the number of rules.
+
+    Like the patterns of a ``.gitignore``, a pattern matches a path if it
+    matches the path or any of the directories above it.
+    """
+
+    def __init__(self, rules: Mapping[str, T]) -> None:
+        self._root = _Node()
+        self._values = list(rules.values())
+        for i, pattern in enumerate(rules):
+            node = self._root
+            for part in _pattern_parts(pattern):
+                node = node.child(part)
+            node.rules.append(i)
+
+    def match(self, path: pathlib.Path | str) -> list[T]:
+        """
+        Return the values of the rules whose patterns match the path, in
+        the order of the rules.
+        """
+
+        matched: set[int] = set()
+        nodes = _with_any_depth([self._root])
+        for part in pathlib.Path(path).absolute().parts:
+            nodes = _with_any_depth(
+                child for node in nodes for child in node.step(part)
+            )
+            if not nodes:
+                break
+            for node in nodes:
+                matched.update(node.rules)
+
+        return [self._values[i] for i in sorted(matched)]
+
+
 @dataclasses.dataclass
 class Config:
     repositories: dict[str, RepoConfig] = dataclasses.field(
         default_factory=dict
     )
+    # Settings for every repository matching a path pattern, like
+    # `~/work/legacy/*`. Later rules take precedence over earlier ones
+    rules: dict[str, RepoConfig] = dataclasses.field(default_factory=dict)
 
     @classmethod
     def from_json(cls, doc: dict) -> Config:
@@ -36,9 +172,36 @@ class Config:
             repositories={
                 k: RepoConfig.from_json(v)
                 for k, v in doc.get("repositories", {}).items()
-            }
+            },
+            rules={
+                k: RepoConfig.from_json(v)
+                for k, v in doc.get("rules", {}).items()
+            },
         )
 
+    @functools.cached_property
+    def _matcher(self) -> RuleMatcher[RepoConfig]:
+        return RuleMatcher(self.rules)
+
+    def repository_config(self, repository: pathlib.Path | str) -> RepoConfig:
+        """
+        Return the settings for the repository: those in its own entry, then
+        those of the rules matching it (later rules first), then the
+        defaults.
+        """
+
+        layers = self._matcher.match(repository)
+        if (own := self.repositories.get(str(repository))) is not None:
+            layers.append(own)
+
+        resolved = RepoConfig(tuned=own.tuned if own is not None else {})
+        for layer in layers:
+            for setting in _RULE_SETTINGS:
+                if (value := getattr(layer, setting)) is not None:
+                    setattr(resolved, setting, value)
+
+        return resolved
+
 
 @functools.cache
 def load_config(filepath: pathlib.Path | None = None) -> Config:
@@ -0,0 +1,523 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import ctypes
+import ctypes.util
+import json
+import os
+import pathlib
+import struct
+import sys
+from collections.abc import AsyncGenerator, Callable, Iterable
+
+from git_meta import cache, concurrency, discovery, main
+from git_meta.constants import PROGRAM, STATE_HOME
+from git_meta.metadata import GitMetadata
+from git_meta.status import RepoState
+
+_RUNTIME_DIR = pathlib.Path(os.environ.get("XDG_RUNTIME_DIR", STATE_HOME))
+DEFAULT_SOCKET_PATH = _RUNTIME_DIR / PROGRAM / "daemon.sock"
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_REFRESH_INTERVAL = 300.0
+DEFAULT_MAX_WATCHES_PER_REPO = 2_000
+
+# Changes usually come in bursts (a checkout touches many files), so wait
+# for the burst to settle before refreshing the repository
+_DEBOUNCE_SECONDS = 0.25
+
+type OnChange = Callable[[pathlib.Path, bool], None]
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonWarmingUpError(DaemonError):
+    """
+    The daemon is still refreshing the repositories for the first time.
+    """
+
+
+class _Inotify:
+    """
+    A minimal binding to the Linux inotify API.
+
+    https://man7.org/linux/man-pages/man7/inotify.7.html
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000  # the watch was removed
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    MASK = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+
+    _EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: pathlib.Path) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"can't watch {path}")
+
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        # Fails if the watch is already gone, like with its directory
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self) -> list[tuple[int, int, str]]:
+        """
+        Return the pending ``(wd, mask, name)`` events.
+        """
+
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = self._EVENT.unpack_from(buffer, offset)
+            offset += self._EVENT.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _InotifyWatcher:
+    """
+    Watch repositories' git directories and worktrees with inotify.
+    """
+
+    def __init__(
+        self,
+        on_change: OnChange,
+        max_watches_per_repo: int = DEFAULT_MAX_WATCHES_PER_REPO,
+    ) -> None:
+        self.on_change = on_change
+        self.max_watches_per_repo = max_watches_per_repo
+        self.inotify = _Inotify()
+        # Maps each watch descriptor to its directory, the repository that
+        # it belongs to, and whether it's part of the git directory
+        self.watches: dict[int, tuple[pathlib.Path, pathlib.Path, bool]] = {}
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.inotify.fd, self._on_readable)
+
+    def close(self) -> None:
+        with contextlib.suppress(RuntimeError):
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+        self.inotify.close()
+
+    def _worktree_dirs(self, repo_dir: pathlib.Path) -> Iterable[pathlib.Path]:
+        for dirpath, dirnames, _ in os.walk(repo_dir):
+            dirnames[:] = [
+                dirname
+                for dirname in dirnames
+                if dirname != ".git" and dirname not in discovery.DEFAULT_PRUNE
+            ]
+            yield pathlib.Path(dirpath)
+
+    def _git_dirs(self, metadata: GitMetadata) -> Iterable[pathlib.Path]:
+        if metadata.git_dir is not None:
+            yield metadata.git_dir
+        if metadata.common_dir is not None:
+            for dirpath, _, _ in os.walk(metadata.common_dir / "refs"):
+                yield pathlib.Path(dirpath)
+            if metadata.common_dir != metadata.git_dir:
+                yield metadata.common_dir
+
+    def _add(
+        self, path: pathlib.Path, repo_dir: pathlib.Path, in_git_dir: bool
+    ) -> None:
+        wd = self.inotify.add_watch(path)
+        self.watches[wd] = (path, repo_dir, in_git_dir)
+
+    def watch(self, repo_dir: pathlib.Path) -> bool:
+        """
+        Watch the repository, returning whether it could be watched.
+        """
+
+        metadata = GitMetadata(repo_dir)
+        git_dirs = list(self._git_dirs(metadata))
+        worktree_dirs = []
+        for worktree_dir in self._worktree_dirs(repo_dir):
+            worktree_dirs.append(worktree_dir)
+            if len(git_dirs) + len(worktree_dirs) > self.max_watches_per_repo:
+                return False
+
+        try:
+            for path in git_dirs:
+                self._add(path, repo_dir, True)
+            for path in worktree_dirs:
+                self._add(path, repo_dir, False)
+        except OSError:
+            # Most likely out of watches (fs.inotify.max_user_watches)
+            self.unwatch(repo_dir)
+            return False
+
+        return True
+
+    def unwatch(self, repo_dir: pathlib.Path) -> None:
+        """
+        Stop watching the repository, say because it's gone.
+        """
+
+        for wd, (_, repo, _) in list(self.watches.items()):
+            if repo == repo_dir:
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def _on_readable(self) -> None:
+        for wd, mask, name in self.inotify.read_events():
+            if mask & _Inotify.IN_Q_OVERFLOW:
+                # Events were dropped, so everything could have changed
+                for repo_dir in {repo for _, repo, _ in self.watches.values()}:
+                    self.on_change(repo_dir, False)
+                continue
+            if mask & _Inotify.IN_IGNORED:
+                # The directory was deleted (or unwatched), freeing the watch
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+
+            path, repo_dir, in_git_dir = self.watches[wd]
+            if name.endswith(".lock"):
+                continue
+            if (
+                mask & _Inotify.IN_ISDIR
+                and mask & (_Inotify.IN_CREATE | _Inotify.IN_MOVED_TO)
+                and name != ".git"
+                and name not in discovery.DEFAULT_PRUNE
+            ):
+                with contextlib.suppress(OSError):
+                    self._add(path / name, repo_dir, in_git_dir)
+
+            self.on_change(repo_dir, in_git_dir)
+
+
+class _PollingWatcher:
+    """
+    Watch repositories by polling their fingerprints (which cover their
+    worktrees too), for when inotify isn't available.
+
+    A repository without a fingerprint (see ``cache.fingerprint``) can't be
+    seen to be unchanged, so it's refreshed on every poll instead.
+    Fingerprinting stats the whole worktree, so it's done in a thread, one
+    repository at a time.
+    """
+
+    def __init__(
+        self,
+        on_change: OnChange,
+        interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        self.on_change = on_change
+        self.interval = interval
+        self.repos: set[pathlib.Path] = set()
+        self.fingerprints: dict[pathlib.Path, cache.Fingerprint | None] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._poll())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def watch(self, repo_dir: pathlib.Path) -> bool:
+        # Its first fingerprint is taken by the next poll, or by a refresh
+        # (see `seen`)
+        self.repos.add(repo_dir)
+        return True
+
+    def unwatch(self, repo_dir: pathlib.Path) -> None:
+        self.repos.discard(repo_dir)
+        self.fingerprints.pop(repo_dir, None)
+
+    def seen(
+        self, repo_dir: pathlib.Path, fingerprint: cache.Fingerprint | None
+    ) -> None:
+        """
+        Record the fingerprint that the repository was refreshed at, so that
+        it isn't polled as a change.
+        """
+
+        if repo_dir in self.repos:
+            self.fingerprints[repo_dir] = fingerprint
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for repo_dir in list(self.repos):
+                new = await asyncio.to_thread(cache.fingerprint, repo_dir)
+                if repo_dir not in self.repos:
+                    continue  # unwatched while it was fingerprinted
+                changed = repo_dir in self.fingerprints and (
+                    new is None or new != self.fingerprints[repo_dir]
+                )
+                self.fingerprints[repo_dir] = new
+                if changed:
+                    self.on_change(repo_dir, True)
+
+
+class Daemon:
+    """
+    Keep the statuses of the repositories under a directory up to date in
+    memory, and serve them over a Unix socket.
+
+    Repositories are refreshed when their files change: watched with inotify
+    on Linux, and by polling their fingerprints otherwise (or for any
+    repositories too large to watch). Everything is also re-discovered and
+    refreshed every ``refresh_interval`` seconds, to catch anything that the
+    watches missed.
+
+    The socket is served from the start, but reports are only given once
+    the repositories have all been refreshed for the first time: until
+    then, clients are told that the daemon is warming up.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        repositories: Callable[[], AsyncGenerator[pathlib.Path]],
+        *,
+        socket_path: pathlib.Path = DEFAULT_SOCKET_PATH,
+        jobs: main.Jobs = main.DEFAULT_JOBS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        use_inotify: bool = True,
+    ) -> None:
+        self.repositories = repositories
+        self.socket_path = socket_path
+        self.refresh_interval = refresh_interval
+        self.states: dict[str, RepoState] = {}
+        self.warmed_up = False
+        auto = jobs == concurrency.AUTO
+        self._limit = asyncio.Semaphore(
+            concurrency.AUTO_MAX_JOBS if auto else jobs
+        )
+        self._limiters = concurrency.Limiters() if auto else None
+        self._fingerprints: dict[pathlib.Path, cache.Fingerprint | None] = {}
+        self._pending: dict[pathlib.Path, asyncio.TimerHandle] = {}
+        # Repositories with pending changes outside their git directories
+        self._worktree_changes: set[pathlib.Path] = set()
+        self._refreshing: set[asyncio.Task[None]] = set()
+        self._poller = _PollingWatcher(self._on_change, poll_interval)
+        self._inotify: _InotifyWatcher | None = None
+        if use_inotify:
+            with contextlib.suppress(OSError, AttributeError, TypeError):
+                self._inotify = _InotifyWatcher(self._on_change)
+        self._watched: set[pathlib.Path] = set()
+
+    async def refresh(
+        self, repo_dir: pathlib.Path, *, if_changed: bool = False
+    ) -> None:
+        """
+        Refresh the repository's state, or with ``if_changed``, only if its
+        fingerprint changed since it was last refreshed.
+        """
+
+        async with self._limit:
+            # Taken before the status, so that changes made while it runs
+            # aren't mistaken for ones that it saw, and in a thread since it
+            # stats the whole worktree
+            fingerprint = await asyncio.to_thread(cache.fingerprint, repo_dir)
+            if (
+                if_changed
+                and fingerprint is not None
+                and fingerprint == self._fingerprints.get(repo_dir)
+            ):
+                return
+            with (
+                concurrency.limiting(self._limiters)
+                if self._limiters is not None
+                else contextlib.nullcontext()
+            ):
+                state = await main.get_repo_state(repo_dir)
+        if repo_dir not in self._watched:
+            return  # it's gone since
+        self.states[str(repo_dir)] = state
+        self._fingerprints[repo_dir] = fingerprint
+        self._poller.seen(repo_dir, fingerprint)
+
+    def _on_change(self, repo_dir: pathlib.Path, in_git_dir: bool) -> None:
+        if repo_dir not in self._watched:
+            return
+        if not in_git_dir:
+            self._worktree_changes.add(repo_dir)
+
+        if (handle := self._pending.pop(repo_dir, None)) is not None:
+            handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._pending[repo_dir] = loop.call_later(
+            _DEBOUNCE_SECONDS, self._schedule_refresh, repo_dir
+        )
+
+    def _schedule_refresh(self, repo_dir: pathlib.Path) -> None:
+        self._pending.pop(repo_dir, None)
+        # Our own `git status` can write to the git directory, so only react
+        # to git directory changes that the fingerprint can see
+        if_changed = repo_dir not in self._worktree_changes
+        self._worktree_changes.discard(repo_dir)
+        task = asyncio.create_task(
+            self.refresh(repo_dir, if_changed=if_changed)
+        )
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    def _watch(self, repo_dir: pathlib.Path) -> None:
+        if repo_dir in self._watched:
+            return
+        if self._inotify is None or not self._inotify.watch(repo_dir):
+            self._poller.watch(repo_dir)
+        self._watched.add(repo_dir)
+
+    def _forget(self, repo_dir: pathlib.Path) -> None:
+        if self._inotify is not None:
+            self._inotify.unwatch(repo_dir)
+        self._poller.unwatch(repo_dir)
+        self._watched.discard(repo_dir)
+        self._fingerprints.pop(repo_dir, None)
+        self._worktree_changes.discard(repo_dir)
+        self.states.pop(str(repo_dir), None)
+        if (handle := self._pending.pop(repo_dir, None)) is not None:
+            handle.cancel()
+
+    async def refresh_all(self) -> None:
+        """
+        Discover the repositories and refresh all of them.
+        """
+
+        found = set()
+        async with asyncio.TaskGroup() as tg:
+            async for repo_dir in self.repositories():
+                found.add(repo_dir)
+                self._watch(repo_dir)
+                tg.create_task(self.refresh(repo_dir))
+
+        for repo_dir in self._watched - found:
+            self._forget(repo_dir)
+        self.warmed_up = True
+
+    async def _handle_client(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        try:
+            request = json.loads(await reader.readline() or "{}")
+            if request.get("command") == "report" and not self.warmed_up:
+                warming_up = {"error": "warming up", "warming_up": True}
+                writer.write(json.dumps(warming_up).encode() + b"\n")
+            elif request.get("command") == "report":
+                for state in list(self.states.values()):
+                    writer.write(json.dumps(state.to_json()).encode() + b"\n")
+            else:
+                error = {"error": f"unknown command: {request.get('command')}"}
+                writer.write(json.dumps(error).encode() + b"\n")
+            await writer.drain()
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        """
+        Serve the repository statuses until cancelled.
+        """
+
+        self.socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.socket_path.unlink(missing_ok=True)
+
+        server = await asyncio.start_unix_server(
+            self._handle_client,
+            path=self.socket_path,
+        )
+        try:
+            async with server:
+                if self._inotify is not None:
+                    self._inotify.start()
+                self._poller.start()
+                while True:
+                    await self.refresh_all()
+                    await asyncio.sleep(self.refresh_interval)
+        finally:
+            self._poller.close()
+            if self._inotify is not None:
+                self._inotify.close()
+            self.socket_path.unlink(missing_ok=True)
+
+
+async def query(
+    socket_path: pathlib.Path = DEFAULT_SOCKET_PATH,
+) -> AsyncGenerator[RepoState]:
+    """
+    Yield the repository states held by the running daemon.
+    """
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(path=socket_path)
+    except (OSError, AttributeError) as e:
+        raise DaemonError(
+            f"can't connect to the daemon at {socket_path}"
+        ) from e
+
+    try:
+        writer.write(json.dumps({"command": "report"}).encode() + b"\n")
+        await writer.drain()
+        async for line in reader:
+            doc = json.loads(line)
+            if doc.get("warming_up"):
+                raise DaemonWarmingUpError(
+                    "the daemon is still warming up, try again shortly"
+                )
+            if "repo_dir" not in doc:
+                raise DaemonError(doc.get("error", "unexpected response"))
+            yield RepoState.from_json(doc)
+    finally:
+        writer.close()
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import os
+import pathlib
+import time
+from collections.abc import AsyncGenerator, Generator, Iterable
+
+from git_meta.constants import CACHE_HOME, PROGRAM
+
+DEFAULT_INDEX_FILEPATH = CACHE_HOME / PROGRAM / "discovery.json"
+
+# Directories that are never worth descending into to look for repositories
+DEFAULT_PRUNE = frozenset(
+    {
+        ".cargo",
+        ".gradle",
+        ".mypy_cache",
+        ".nox",
+        ".pytest_cache",
+        ".ruff_cache",
+        ".tox",
+        ".venv",
+        "__pycache__",
+        "node_modules",
+        "site-packages",
+        "target",
+        "venv",
+    }
+)
+
+# Directories modified this recently may be modified again within the same
+# mtime tick, so they're always re-scanned (like git's "racy" index entries)
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+@dataclasses.dataclass
+class DirectoryEntry:
+    mtime_ns: int
+    is_repo: bool
+    children: list[str]
+
+
+@dataclasses.dataclass
+class DiscoveryIndex:
+    """
+    The directories walked under each root directory, keyed by their paths.
+
+    A directory's mtime changes whenever an entry is added to, removed from,
+    or renamed within it, so an unchanged mtime means that its cached
+    children are still correct and it doesn't need to be listed again.
+    """
+
+    roots: dict[str, dict[str, DirectoryEntry]] = dataclasses.field(
+        default_factory=dict
+    )
+
+    @classmethod
+    def from_json(cls, doc: dict) -> DiscoveryIndex:
+        return cls(
+            roots={
+                root: {
+                    path: DirectoryEntry(*entry)
+                    for path, entry in directories.items()
+                }
+                for root, directories in doc.get("roots", {}).items()
+            }
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "roots": {
+                root: {
+                    path: dataclasses.astuple(entry)
+                    for path, entry in directories.items()
+                }
+                for root, directories in self.roots.items()
+            }
+        }
+
+
+def load_index(filepath: pathlib.Path | None = None) -> DiscoveryIndex:
+    _path = filepath if filepath is not None else DEFAULT_INDEX_FILEPATH
+    try:
+        with open(_path) as f:
+            return DiscoveryIndex.from_json(json.load(f))
+    except (OSError, ValueError, TypeError):
+        # A missing or corrupt index just means a full walk
+        return DiscoveryIndex()
+
+
+def save_index(
+    index: DiscoveryIndex,
+    filepath: pathlib.Path | None = None,
+) -> None:
+    _path = filepath if filepath is not None else DEFAULT_INDEX_FILEPATH
+    _path.parent.mkdir(parents=True, exist_ok=True)
+    _tmp_path = _path.with_suffix(f".{os.getpid()}.tmp")
+    with open(_tmp_path, "w+") as f:
+        json.dump(index.to_json(), f)
+
+    os.replace(_tmp_path, _path)
+
+
+def _scan_directory(path: str, nested: bool = False) -> tuple[bool, list[str]]:
+    """
+    Return whether the directory is a git repository and, if it's not (or
+    if ``nested`` is set), the names of its subdirectories.
+    """
+
+    is_repo = False
+    try:
+        with os.scandir(path) as entries:
+            children = []
+            for entry in entries:
+                if entry.name == ".git":
+                    if not nested:
+                        return True, []
+                    is_repo = True
+                elif entry.is_dir():
+                    children.append(entry.name)
+    except OSError:
+        return False, []
+
+    return is_repo, sorted(children)
+
+
+def walk_git_repos(  # noqa: PLR0913
+    directory: pathlib.Path,
+    index: DiscoveryIndex,
+    rescan: bool = False,
+    max_depth: int | None = None,
+    prune: Iterable[str] = DEFAULT_PRUNE,
+    *,
+    nested: bool = False,
+) -> Generator[pathlib.Path]:
+    """
+    Yield the git repositories under the directory and update the index
+    with the directories that were walked.
+
+    Directories whose mtimes haven't changed since they were indexed aren't
+    listed again unless ``rescan`` is set. Directories named in ``prune``,
+    and directories more than ``max_depth`` levels below the root, are not
+    walked at all.
+
+    Repositories aren't descended into unless ``nested`` is set, in which
+    case the repositories (and submodules) inside them are yielded too.
+    """
+
+    root = str(directory.resolve())
+    cached = {} if rescan else index.roots.get(root, {})
+    walked: dict[str, DirectoryEntry] = {}
+    visited: set[tuple[int, int]] = set()  # guards against symlink loops
+    racy_after_ns = time.time_ns() - _RACY_WINDOW_NS
+    pruned = frozenset(prune)
+    depth_limit = max_depth if max_depth is not None else float("inf")
+
+    def walk(path: str, depth: int) -> Generator[str]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if (stat.st_dev, stat.st_ino) in visited:
+            return
+        visited.add((stat.st_dev, stat.st_ino))
+        mtime_ns = stat.st_mtime_ns
+
+        entry = cached.get(path)
+        # Repositories are indexed without their children unless they were
+        # walked into, so they're always listed again when walking into them
+        if (
+            entry is None
+            or entry.mtime_ns != mtime_ns
+            or (nested and entry.is_repo)
+        ):
+            is_repo, children = _scan_directory(path, nested)
+            entry = DirectoryEntry(
+                mtime_ns=mtime_ns if mtime_ns < racy_after_ns else -1,
+                is_repo=is_repo,
+                children=children,
+            )
+        walked[path] = entry
+
+        if entry.is_repo:
+            yield path
+        if (nested or not entry.is_repo) and depth < depth_limit:
+            for child in entry.children:
+                if child not in pruned:
+                    yield from walk(os.path.join(path, child), depth + 1)
+
+    for path in walk(root, 0):
+        yield pathlib.Path(path)
+
+    index.roots[root] = walked
+
+
+async def stream_git_repos(  # noqa: PLR0913
+    directory: pathlib.Path,
+    index: DiscoveryIndex,
+    rescan: bool = False,
+    max_depth: int | None = None,
+    prune: Iterable[str] = DEFAULT_PRUNE,
+    *,
+    nested: bool = False,
+) -> AsyncGenerator[pathlib.Path]:
+    """
+    Yield the git repositories under the directory as they're found, walking
+    the directory in a worker thread so that the event loop is free to start
+    work on the repositories that have already been found.
+    """
+
+    loop = asyncio.get_running_loop()
+    found: asyncio.Queue[pathlib.Path | None] = asyncio.Queue()
+
+    def walk() -> None:
+        try:
+            for path in walk_git_repos(
+                directory=directory,
+                index=index,
+                rescan=rescan,
+                max_depth=max_depth,
+                prune=prune,
+                nested=nested,
+            ):
+                loop.call_soon_threadsafe(found.put_nowait, path)
+        finally:
+            loop.call_soon_threadsafe(found.put_nowait, None)
+
+    walker = asyncio.create_task(asyncio.to_thread(walk))
+    while (path := await found.get()) is not None:
+        yield path
+
+    await walker  # re-raise any error from the walk
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import functools
+import os
+import pathlib
+import re
+import time
+import urllib.parse
+from typing import Literal
+
+from git_meta import git
+from git_meta.constants import CACHE_HOME, PROGRAM
+from git_meta.metadata import GitMetadata
+
+DEFAULT_JOBS_PER_HOST = 8
+LOCAL_HOST = "localhost"
+SSH_CONTROL_DIR = CACHE_HOME / PROGRAM / "ssh"
+
+# "minimal" fetches only the default branch, without tags, and "full" fetches
+# what the remote is configured to
+type FetchMode = Literal["minimal", "full"]
+FETCH_MODES: tuple[FetchMode, ...] = ("minimal", "full")
+
+# https://git-scm.com/docs/git-fetch#_git_urls
+# The scp-like syntax is only recognised when there's no slash before the
+# first colon, and single letters are Windows drives rather than hosts
+_SCP_LIKE_URL = re.compile(r"^(?:[^@/]+@)?(?P<host>[^:/]{2,}):")
+
+
+def remote_host(url: str) -> str:
+    """
+    Return the host that the remote URL points at, or ``LOCAL_HOST`` for
+    local paths and ``file://`` URLs.
+    """
+
+    if "://" in url:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme == "file" or not parsed.hostname:
+            return LOCAL_HOST
+        return parsed.hostname.lower()
+    if match := _SCP_LIKE_URL.match(url):
+        return match["host"].lower()
+
+    return LOCAL_HOST
+
+
+@dataclasses.dataclass(frozen=True)
+class FetchProfile:
+    """
+    What to fetch from a remote. By default, that's what ``git fetch``
+    fetches: the remote's configured refspecs, and the tags that point into
+    them.
+
+    For remotes with many refs, advertising and updating the refs is most
+    of the fetch, so fetching only the ``refspecs`` wanted (and no ``tags``)
+    can save most of it. A ``filter`` (like ``blob:none``) only works for
+    repositories that are partial clones already, and a ``depth`` makes the
+    repository shallow.
+
+    https://git-scm.com/docs/git-fetch
+    """
+
+    refspecs: tuple[str, ...] = ()
+    tags: bool = True
+    filter: str | None = None
+    depth: int | None = None
+
+    @classmethod
+    def minimal(cls, remote: str, branch: str) -> FetchProfile:
+        """
+        Only the branch (updating its remote-tracking ref), without tags.
+        """
+
+        return cls(
+            refspecs=(f"+refs/heads/{branch}:refs/remotes/{remote}/{branch}",),
+            tags=False,
+        )
+
+    def args(self, remote: str) -> tuple[str, ...]:
+        # With refspecs, only the refs that they would update are pruned
+        args = [
+            "fetch",
+            remote,
+            "--no-recurse-submodules",
+            "--progress",
+            "--prune",
+        ]
+        if not self.tags:
+            args.append("--no-tags")
+        if self.filter is not None:
+            args.append(f"--filter={self.filter}")
+        if self.depth is not None:
+            args.append(f"--depth={self.depth}")
+
+        return (*args, *self.refspecs)
+
+
+@dataclasses.dataclass
+class _SharedFetch:
+    task: asyncio.Task[tuple[int, str, str] | None]
+    waiters: int = 0  # the worktrees waiting for the fetch
+
+
+@dataclasses.dataclass
+class Fetcher:
+    """
+    Fetch repositories from their remotes, with at most ``jobs_per_host``
+    fetches running against each remote host at once.
+
+    When ``ssh_multiplex`` is set, fetches over SSH to the same host share a
+    single connection (via OpenSSH's ControlMaster) rather than each paying
+    for their own handshake.
+
+    Fetches are skipped for repositories that were fetched less than
+    ``max_age`` seconds ago and, when ``precheck`` is set, for repositories
+    whose tracked branches are already up to date with the remote's (which
+    only costs a ``git ls-remote`` rather than a full fetch).
+
+    When ``mode`` is set, it's used for every repository rather than the
+    mode in each repository's config (see ``FetchProfile``).
+
+    Worktrees that share a git directory (see ``git worktree``) share their
+    objects and remote-tracking refs too, so each remote is only fetched
+    once for all of them: the first worktree to ask starts the fetch, and
+    the others wait for it rather than fetching again (and fighting over
+    the ref locks), or reuse its result if it's already finished. The fetch
+    is only cancelled (say, on a timeout) once every worktree waiting for
+    it has given up on it, and then it's forgotten so that the next
+    worktree to ask starts it again.
+    """
+
+    jobs_per_host: int = DEFAULT_JOBS_PER_HOST
+    max_age: float | None = None
+    precheck: bool = False
+    ssh_multiplex: bool = False
+    mode: FetchMode | None = None
+    ssh_control_persist: str = "60s"
+    ssh_control_dir: pathlib.Path = SSH_CONTROL_DIR
+    _limits: dict[str, asyncio.Semaphore] = dataclasses.field(
+        default_factory=dict,
+        init=False,
+        repr=False,
+    )
+    # The fetches for each common git directory and remote, which are kept
+    # (with their results) unless they're cancelled
+    _fetches: dict[tuple[str, str], _SharedFetch] = dataclasses.field(
+        default_factory=dict,
+        init=False,
+        repr=False,
+    )
+
+    def limit(self, host: str) -> asyncio.Semaphore:
+        """
+        Return the semaphore that limits the fetches against the host.
+        """
+
+        if host not in self._limits:
+            self._limits[host] = asyncio.Semaphore(self.jobs_per_host)
+
+        return self._limits[host]
+
+    @functools.cached_property
+    def env(self) -> dict[str, str] | None:
+        """
+        The environment variables to fetch with, if any.
+        """
+
+        if not self.ssh_multiplex:
+            return None
+
+        self.ssh_control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        ssh_command = os.environ.get("GIT_SSH_COMMAND", "ssh")
+        control_path = (self.ssh_control_dir / "%C").as_posix()
+        return {
+            "GIT_SSH_COMMAND": (
+                f"{ssh_command}"
+                f" -o ControlMaster=auto"
+                f" -o ControlPath='{control_path}'"
+                f" -o ControlPersist={self.ssh_control_persist}"
+            ),
+        }
+
+    def _is_fresh(self, metadata: GitMetadata) -> bool:
+        if self.max_age is None:
+            return False
+        if (fetched_at := metadata.fetch_head_mtime) is None:
+            return False
+
+        return time.time() - fetched_at < self.max_age
+
+    async def _is_unchanged(
+        self,
+        repo_dir: pathlib.Path,
+        remote: str,
+        metadata: GitMetadata,
+    ) -> bool:
+        """
+        Whether the remote advertises the same commits for the tracked
+        branches as the local remote-tracking refs point at.
+        """
+
+        if not (tracked_refs := metadata.tracked_refs(remote)):
+            return False
+
+        rc, out, _ = await git.run_git_cmd_async(
+            args=("ls-remote", remote, *tracked_refs),
+            git_dir=repo_dir,
+            env=self.env,
+        )
+        if rc != 0:
+            return False
+
+        advertised = {}
+        for line in out.splitlines():
+            sha, _, ref = line.partition("\t")
+            advertised[ref] = sha
+
+        return all(
+            advertised.get(ref) == metadata.resolve_ref(tracking_ref)
+            for ref, tracking_ref in tracked_refs.items()
+        )
+
+    async def fetch(
+        self,
+        repo_dir: pathlib.Path,
+        remote: str = "origin",
+        remote_url: str = "",
+        profile: FetchProfile | None = None,
+    ) -> tuple[int, str, str] | None:
+        """
+        Fetch the remote into the repository (all of it, unless a
+        ``profile`` says otherwise), waiting for a free slot on the remote's
+        host first, unless it's already been fetched through another
+        worktree of the repository.
+
+        Returns ``None`` if the fetch was skipped.
+        """
+
+        metadata = GitMetadata(repo_dir)
+        common_dir = metadata.common_dir or repo_dir
+        key = (os.path.realpath(common_dir), remote)
+        shared = self._fetches.get(key)
+        if (
+            shared is None
+            or shared.task.get_loop() is not asyncio.get_running_loop()
+        ):
+            task = asyncio.create_task(
+                self._fetch(
+                    repo_dir,
+                    remote,
+                    remote_url,
+                    metadata,
+                    profile or FetchProfile(),
+                )
+            )
+            shared = _SharedFetch(task)
+            self._fetches[key] = shared
+            task.add_done_callback(
+                functools.partial(self._forget_cancelled_fetch, key, shared)
+            )
+
+        # Shielded so that giving up on one worktree doesn't cancel the
+        # fetch for the others, until the last of them gives up too (so
+        # that a hung fetch doesn't keep holding its host's slot)
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if not shared.waiters and not shared.task.done():
+                shared.task.cancel()
+
+    def _forget_cancelled_fetch(
+        self,
+        key: tuple[str, str],
+        shared: _SharedFetch,
+        _: asyncio.Task,
+    ) -> None:
+        if shared.task.cancelled() and self._fetches.get(key) is shared:
+            del self._fetches[key]
+
+    async def _fetch(
+        self,
+        repo_dir: pathlib.Path,
+        remote: str,
+        remote_url: str,
+        metadata: GitMetadata,
+        profile: FetchProfile,
+    ) -> tuple[int, str, str] | None:
+        if self._is_fresh(metadata):
+            return None
+
+        async with self.limit(remote_host(remote_url)):
+            if self.precheck and await self._is_unchanged(
+                repo_dir, remote, metadata
+            ):
+                return None
+
+            return await git.run_git_cmd_async(
+                args=profile.args(remote),
+                git_dir=repo_dir,
+                env=self.env,
+            )
@@ -1,9 +1,27 @@
+import asyncio
+import contextlib
+import contextvars
+import os
 import pathlib
+import signal
 import subprocess
-from collections.abc import Iterable
+import sys
+from collections.abc import Callable, Iterable, Iterator, Mapping
 from typing import Any
 
+from git_meta import concurrency, timings
+
 HERE = pathlib.Path(__file__).parent
+_STREAM_CHUNK_SIZE = 64 * 1024
+# The return code for commands that were killed for taking too long, like
+# coreutils' `timeout`
+TIMEOUT_RC = 124
+
+# The default timeout for each git command, in seconds. Like the timings
+# recorder, tasks inherit it from the context they're created in
+_COMMAND_TIMEOUT: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "command_timeout", default=None
+)
 
 type GitCompletedProcess = (
     subprocess.CompletedProcess[str]
@@ -12,23 +30,78 @@ type GitCompletedProcess = (
 )
 
 
+def _git_args(
+    args: Iterable[str],
+    git_dir: pathlib.Path | None = None,
+) -> tuple[str, ...]:
+    cmds = ("git",) if git_dir is None else ("git", "-C", str(git_dir))
+    return (*cmds, *args)
+
+
+@contextlib.contextmanager
+def command_timeout(timeout: float | None) -> Iterator[None]:
+    """
+    Kill git commands that take longer than ``timeout`` seconds while in the
+    context, unless it's ``None``.
+    """
+
+    token = _COMMAND_TIMEOUT.set(timeout)
+    try:
+        yield
+    finally:
+        _COMMAND_TIMEOUT.reset(token)
+
+
+def current_command_timeout() -> float | None:
+    """
+    Return the timeout that git commands are running under, if any.
+    """
+
+    return _COMMAND_TIMEOUT.get()
+
+
+def _timeout_message(args: tuple[str, ...], timeout: float) -> bytes:
+    return f"{timings.command_name(args)} timed out after {timeout}s".encode()
+
+
 def _git_cmd(
     args: Iterable[str],
     git_dir: pathlib.Path | None = None,
+    timeout: float | None = None,
 ) -> GitCompletedProcess:
-    cmds = ("git",) if git_dir is None else ("git", "-C", git_dir)
-    return subprocess.run(
-        args=(*cmds, *args),
-        check=False,  # DON'T raise an exception on non-zero return codes
-        capture_output=True,
-    )
+    args = tuple(args)
+    try:
+        return subprocess.run(
+            args=_git_args(args=args, git_dir=git_dir),
+            check=False,  # DON'T raise an exception on non-zero return codes
+            capture_output=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as e:
+        return subprocess.CompletedProcess(
+            args=e.cmd,
+            returncode=TIMEOUT_RC,
+            stdout=b"",
+            stderr=_timeout_message(args, timeout or 0),
+        )
 
 
 def run_git_cmd(
     args: Iterable[str],
     git_dir: pathlib.Path | None = None,
+    timeout: float | None = None,
 ) -> tuple[int, str, str]:
-    proc = _git_cmd(args=args, git_dir=git_dir)
+    """
+    Run a git command, killing it if it takes longer than ``timeout``
+    seconds (which defaults to the ``command_timeout`` context).
+    """
+
+    args = tuple(args)
+    timeout = timeout if timeout is not None else _COMMAND_TIMEOUT.get()
+    with timings.span(timings.command_name(args), "git", git_dir) as span:
+        proc = _git_cmd(args=args, git_dir=git_dir, timeout=timeout)
+        if span is not None:
+            span.rc = proc.returncode
 
     assert isinstance(proc.stdout, bytes)  # noqa: S101
     assert isinstance(proc.stderr, bytes)  # noqa: S101
@@ -38,3 +111,162 @@ def run_git_cmd(
         proc.stdout.decode().rstrip(),
         proc.stderr.decode().rstrip(),
     )
+
+
+def _kill(proc: asyncio.subprocess.Process) -> None:
+    """
+    Kill the process and, where there are process groups, whatever it
+    started (like the ``ssh`` or ``git-remote-https`` behind a fetch).
+    """
+
+    if proc.returncode is not None:
+        return
+    with contextlib.suppress(ProcessLookupError):
+        if sys.platform == "win32":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+
+
+async def _consume_stdout(
+    proc: asyncio.subprocess.Process,
+    consume: Callable[[bytes], None],
+) -> None:
+    assert proc.stdout is not None  # noqa: S101
+
+    while chunk := await proc.stdout.read(_STREAM_CHUNK_SIZE):
+        consume(chunk)
+
+
+async def _communicate(
+    proc: asyncio.subprocess.Process,
+    consume: Callable[[bytes], None] | None,
+) -> tuple[bytes, bytes]:
+    if consume is None:
+        return await proc.communicate()
+
+    assert proc.stderr is not None  # noqa: S101
+
+    _, stderr = await asyncio.gather(
+        _consume_stdout(proc, consume),
+        proc.stderr.read(),
+    )
+    await proc.wait()
+    return b"", stderr
+
+
+async def _git_cmd_async(
+    args: tuple[str, ...],
+    git_dir: pathlib.Path | None = None,
+    env: Mapping[str, str] | None = None,
+    timeout: float | None = None,
+    consume: Callable[[bytes], None] | None = None,
+) -> tuple[int, bytes, bytes]:
+    # The slot is waited for before the timeout starts, since it's only how
+    # long the command itself takes that's being limited
+    async with concurrency.slot(args):
+        return await _run_git_cmd_async(
+            args=args,
+            git_dir=git_dir,
+            env=env,
+            timeout=timeout,
+            consume=consume,
+        )
+
+
+async def _run_git_cmd_async(
+    args: tuple[str, ...],
+    git_dir: pathlib.Path | None = None,
+    env: Mapping[str, str] | None = None,
+    timeout: float | None = None,
+    consume: Callable[[bytes], None] | None = None,
+) -> tuple[int, bytes, bytes]:
+    proc = await asyncio.create_subprocess_exec(
+        *_git_args(args=args, git_dir=git_dir),
+        env=None if env is None else {**os.environ, **env},
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # Its own process group, so that it and its children can be killed
+        # together (and so that Ctrl-C is handled here, not by each of them)
+        start_new_session=sys.platform != "win32",
+    )
+    try:
+        async with asyncio.timeout(timeout):
+            stdout, stderr = await _communicate(proc, consume)
+    except TimeoutError:
+        _kill(proc)
+        await proc.wait()
+        return TIMEOUT_RC, b"", _timeout_message(args, timeout or 0)
+    except asyncio.CancelledError:
+        _kill(proc)
+        await asyncio.shield(proc.wait())
+        raise
+
+    assert proc.returncode is not None  # noqa: S101
+
+    return proc.returncode, stdout, stderr
+
+
+async def run_git_cmd_async(
+    args: Iterable[str],
+    git_dir: pathlib.Path | None = None,
+    env: Mapping[str, str] | None = None,
+    timeout: float | None = None,
+) -> tuple[int, str, str]:
+    """
+    Run a git command on the event loop, without blocking a thread.
+
+    The ``env`` variables are added to (not in place of) the current
+    environment. The command is killed if it takes longer than ``timeout``
+    seconds (which defaults to the ``command_timeout`` context), returning
+    ``TIMEOUT_RC``, and if the task running it is cancelled.
+    """
+
+    args = tuple(args)
+    timeout = timeout if timeout is not None else _COMMAND_TIMEOUT.get()
+    with timings.span(timings.command_name(args), "git", git_dir) as span:
+        rc, stdout, stderr = await _git_cmd_async(
+            args=args,
+            git_dir=git_dir,
+            env=env,
+            timeout=timeout,
+        )
+        if span is not None:
+            span.rc = rc
+
+    return (
+        rc,
+        stdout.decode().rstrip(),
+        stderr.decode().rstrip(),
+    )
+
+
+async def stream_git_cmd_async(
+    args: Iterable[str],
+    consume: Callable[[bytes], None],
+    git_dir: pathlib.Path | None = None,
+    env: Mapping[str, str] | None = None,
+    timeout: float | None = None,
+) -> tuple[int, str]:
+    """
+    Run a git command like ``run_git_cmd_async``, but pass its output to
+    ``consume`` in chunks as it arrives rather than holding all of it.
+
+    Returns the return code and the error output.
+    """
+
+    args = tuple(args)
+    timeout = timeout if timeout is not None else _COMMAND_TIMEOUT.get()
+    with timings.span(timings.command_name(args), "git", git_dir) as span:
+        rc, _, stderr = await _git_cmd_async(
+            args=args,
+            git_dir=git_dir,
+            env=env,
+            timeout=timeout,
+            consume=consume,
+        )
+        if span is not None:
+            span.rc = rc
+
+    return rc, stderr.decode().rstrip()
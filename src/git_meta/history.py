@@ -0,0 +1,238 @@
+"""
+Record the result of every repository in every report, to find what's
+changed since the last report and which repositories keep getting slower.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import json
+import pathlib
+import sqlite3
+import time
+from collections.abc import Iterator
+
+from git_meta.constants import PROGRAM, STATE_HOME
+from git_meta.status import RepoState, RepoStatus
+
+DEFAULT_HISTORY_FILEPATH = STATE_HOME / PROGRAM / "history.sqlite3"
+# Older runs are deleted so that the database doesn't grow forever
+DEFAULT_MAX_RUNS = 200
+DEFAULT_WINDOW = 5
+# How long to wait for another process (like another shard) to finish
+# writing, in seconds
+_BUSY_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    root TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    repo_dir TEXT NOT NULL,
+    status_key TEXT NOT NULL,
+    flags INTEGER NOT NULL,
+    duration REAL,
+    error TEXT NOT NULL,
+    PRIMARY KEY (repo_dir, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_by_run ON results (run_id);
+"""
+
+
+def status_key(state: RepoState) -> str:
+    """
+    Return what a state is compared by to see whether it's changed: its
+    record without its timing.
+    """
+
+    record = state.to_record()
+    del record["duration"]
+    return json.dumps(record, sort_keys=True)
+
+
+@dataclasses.dataclass
+class HistoryEntry:
+    """
+    The result of a repository in one report.
+    """
+
+    repo_dir: str
+    started_at: float
+    flags: RepoStatus
+    duration: float | None
+    error: str
+
+    def to_json(self) -> dict:
+        return {**dataclasses.asdict(self), "flags": str(self.flags)}
+
+
+@dataclasses.dataclass
+class Trend:
+    """
+    The mean duration of a repository's most recent reports, and of the
+    reports before those.
+    """
+
+    repo_dir: str
+    recent: float
+    before: float
+
+    @property
+    def ratio(self) -> float:
+        return self.recent / self.before
+
+    def to_json(self) -> dict:
+        return {**dataclasses.asdict(self), "ratio": self.ratio}
+
+
+class History:
+    """
+    The results of past reports, in an SQLite database.
+
+    The results of a run are only written by ``finish``, in one short
+    transaction, so that runs (like the shards of a report) can record
+    into the same database at the same time.
+    """
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+        self._run: tuple[float, str] | None = None
+        self._pending: list[tuple[str, str, int, float | None, str]] = []
+
+    @classmethod
+    @contextlib.contextmanager
+    def open(cls, filepath: pathlib.Path | None = None) -> Iterator[History]:
+        _path = filepath if filepath is not None else DEFAULT_HISTORY_FILEPATH
+        _path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(_path, timeout=_BUSY_TIMEOUT)
+        try:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA foreign_keys = ON")
+            connection.executescript(_SCHEMA)
+            yield cls(connection)
+        finally:
+            connection.close()
+
+    def start(self, root: pathlib.Path) -> None:
+        self._run = (time.time(), str(root))
+        self._pending.clear()
+
+    def last_status_key(self, repo_dir: str) -> str | None:
+        row = self.connection.execute(
+            "SELECT status_key FROM results WHERE repo_dir = ?"
+            " ORDER BY run_id DESC LIMIT 1",
+            (repo_dir,),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def changed(self, state: RepoState) -> bool:
+        """
+        Whether the state is different to the last one recorded for the
+        repository, or it's never been recorded.
+        """
+
+        return status_key(state) != self.last_status_key(state.repo_dir)
+
+    def record(self, state: RepoState) -> None:
+        """
+        Add the state to the current run.
+        """
+
+        self._pending.append(
+            (
+                state.repo_dir,
+                status_key(state),
+                state.flags.value,
+                state.duration,
+                state.error,
+            )
+        )
+
+    def finish(self, max_runs: int = DEFAULT_MAX_RUNS) -> None:
+        """
+        Write the current run, and delete the runs before the last
+        ``max_runs``.
+        """
+
+        if self._run is None:
+            return
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (started_at, root) VALUES (?, ?)", self._run
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO results"
+                " (run_id, repo_dir, status_key, flags, duration, error)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, *result) for result in self._pending],
+            )
+            self.connection.execute(
+                "DELETE FROM runs WHERE run_id <= ?",
+                ((run_id or 0) - max_runs,),
+            )
+        self._run = None
+        self._pending.clear()
+
+    def entries(self, repo_dir: str, limit: int) -> list[HistoryEntry]:
+        """
+        Return the repository's last ``limit`` results, oldest first.
+        """
+
+        rows = self.connection.execute(
+            "SELECT results.repo_dir, started_at, flags, duration, error"
+            " FROM results JOIN runs USING (run_id)"
+            " WHERE results.repo_dir = ?"
+            " ORDER BY run_id DESC LIMIT ?",
+            (repo_dir, limit),
+        ).fetchall()
+        return [
+            HistoryEntry(
+                repo_dir=repo,
+                started_at=started_at,
+                flags=RepoStatus(flags),
+                duration=duration,
+                error=error,
+            )
+            for repo, started_at, flags, duration, error in reversed(rows)
+        ]
+
+    def slowing(
+        self,
+        window: int = DEFAULT_WINDOW,
+        limit: int = 10,
+    ) -> list[Trend]:
+        """
+        Return the repositories whose last ``window`` reports have slowed
+        down the most compared to the ``window`` reports before them.
+        """
+
+        rows = self.connection.execute(
+            """
+            WITH ranked AS (
+                SELECT
+                    repo_dir,
+                    duration,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY repo_dir ORDER BY run_id DESC
+                    ) AS n
+                FROM results
+                WHERE duration IS NOT NULL
+            )
+            SELECT
+                repo_dir,
+                AVG(CASE WHEN n <= :window THEN duration END) AS recent,
+                AVG(CASE WHEN n > :window THEN duration END) AS before
+            FROM ranked
+            WHERE n <= 2 * :window
+            GROUP BY repo_dir
+            HAVING before > 0
+            ORDER BY recent / before DESC
+            LIMIT :limit
+            """,
+            {"window": window, "limit": limit},
+        ).fetchall()
+        return [Trend(*row) for row in rows]
@@ -1,12 +1,44 @@
 from __future__ import annotations
 
 import asyncio
-import enum
+import contextlib
+import dataclasses
+import multiprocessing
+import multiprocessing.process
+import os
 import pathlib
+import queue
 import re
-from collections.abc import AsyncGenerator, Generator
+import signal
+import threading
+import time
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterable,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+)
+from typing import Any, Literal
 
-from git_meta import config, git
+from git_meta import (
+    cache,
+    concurrency,
+    config,
+    discovery,
+    git,
+    maintain,
+    status,
+    timings,
+    tune,
+)
+from git_meta.cache import ReportCache
+from git_meta.fetcher import Fetcher, FetchProfile
+from git_meta.metadata import GitMetadata
+from git_meta.schedule import Durations, Kind, PrioritySemaphore, Schedule
+from git_meta.shard import Shard, shard_of
+from git_meta.status import GitStatus, RepoState, RepoStatus, UpdateState
 
 RED = "\033[1;31m"
 GREEN = "\033[1;32m"
@@ -19,25 +51,30 @@ BOLD = "\033[1m"
 RESET = "\033[0m"
 
 type GitWorkingDir = pathlib.Path
+type Repositories = Iterable[GitWorkingDir] | AsyncIterable[GitWorkingDir]
 # TODO: design a better API than this!
 type UpdateResult = tuple[int, str, str]  # rc, title, summary
 type ReportResult = tuple[int, str, str]  # rc, title, summary
+# How many repositories to process at once, or "auto" to adapt how many git
+# commands run at once instead
+type Jobs = int | Literal["auto"]
+
+# Matches the default thread pool size that this used to be capped by
+DEFAULT_JOBS = min(32, (os.cpu_count() or 1) + 4)
+# Stop `git status` from refreshing (and so locking and writing) the index
+# https://git-scm.com/docs/git#Documentation/git.txt-codeGITOPTIONALLOCKScode
+_NO_OPTIONAL_LOCKS = {"GIT_OPTIONAL_LOCKS": "0"}
+# How long `git status` gets before it's retried without looking for
+# untracked files, which is what's usually slow in huge worktrees
+DEFAULT_STATUS_TIMEOUT = 10.0
+# How many paths of each kind (staged, untracked, ...) to keep per status
+DEFAULT_MAX_PATHS = 100
 
 
 class GitError(Exception):
     pass
 
 
-# TODO: These are not mutually exclusive, so an Enum is not appropriate
-class RepoStatus(enum.StrEnum):
-    CLEAN_AND_UPDATED = enum.auto()
-    UNTRACKED_FILES = enum.auto()
-    BEHIND_REMOTE = enum.auto()
-    MULTIPLE_BRANCHES = enum.auto()
-    DIRTY = enum.auto()
-    UNKNOWN = enum.auto()
-
-
 def colour(text: str, colour_: str) -> str:
     """
     Return the text in the given colour.
@@ -46,86 +83,244 @@ def colour(text: str, colour_: str) -> str:
     return f"{colour_}{text}{RESET}"
 
 
-def get_git_repos(
+def _compile_filter(select: str, exclude: str) -> Callable[[str], bool]:
+    select_match = re.compile(select).match
+    exclude_match = re.compile(exclude).match
+
+    def matches(path: str) -> bool:
+        return bool(select_match(path)) and not exclude_match(path)
+
+    return matches
+
+
+def _compile_shard_filter(
+    directory: pathlib.Path,
+    shard: Shard | None,
+) -> Callable[[pathlib.Path], bool]:
+    if shard is None:
+        return lambda _: True
+
+    root = directory.resolve()
+    return lambda repo_dir: shard.contains(repo_dir, root)
+
+
+def get_git_repos(  # noqa: PLR0913
     directory: pathlib.Path,
     select: str,
     exclude: str,
+    *,
+    rescan: bool = False,
+    max_depth: int | None = None,
+    prune: Iterable[str] = discovery.DEFAULT_PRUNE,
+    nested: bool = False,
+    shard: Shard | None = None,
+    index_filepath: pathlib.Path | None = None,
 ) -> list[GitWorkingDir]:
     """
     Return a sorted list of all git repositories in the given directory with
     the inclusions and exclusions applied.
+
+    The walk is cached in the discovery index so that later calls only list
+    the directories that have changed; set ``rescan`` to force a full walk.
+    Set ``nested`` to include the repositories (and submodules) inside other
+    repositories, and ``shard`` to only return the repositories in that
+    shard.
     """
 
-    def walk(path: pathlib.Path) -> Generator[pathlib.Path]:
-        # If the path is a git repo...
-        if path.is_dir() and (path / ".git").exists():
-            # ...and matches the inclusion filters
-            if re.match(select, str(path)) and not re.match(exclude, str(path)):
-                # ...then yield the path, which will skip nesting git repos
-                yield path.resolve()
-        # ...else, skip files and walk dirs
-        elif path.is_dir():
-            try:
-                children = path.iterdir()
-            except PermissionError:
-                return
+    matches = _compile_filter(select, exclude)
+    in_shard = _compile_shard_filter(directory, shard)
+    index = discovery.load_index(index_filepath)
+    repositories = sorted(
+        {
+            path.resolve()
+            for path in discovery.walk_git_repos(
+                directory=directory,
+                index=index,
+                rescan=rescan,
+                max_depth=max_depth,
+                prune=prune,
+                nested=nested,
+            )
+            if matches(str(path)) and in_shard(path.resolve())
+        }
+    )
+    discovery.save_index(index, index_filepath)
+
+    return repositories
 
-            for child in children:
-                yield from walk(child)
-        else:
-            return
 
-    return sorted(walk(directory))
+async def stream_git_repos(  # noqa: PLR0913
+    directory: pathlib.Path,
+    select: str,
+    exclude: str,
+    *,
+    rescan: bool = False,
+    max_depth: int | None = None,
+    prune: Iterable[str] = discovery.DEFAULT_PRUNE,
+    nested: bool = False,
+    shard: Shard | None = None,
+    index_filepath: pathlib.Path | None = None,
+) -> AsyncGenerator[GitWorkingDir]:
+    """
+    Yield the git repositories in the given directory, with the inclusions
+    and exclusions applied, as soon as they're found.
+
+    Unlike ``get_git_repos``, the repositories are not sorted, so work on
+    them can start before the whole directory has been walked.
+    """
+
+    matches = _compile_filter(select, exclude)
+    in_shard = _compile_shard_filter(directory, shard)
+    index = await asyncio.to_thread(discovery.load_index, index_filepath)
+    seen = set()
+    async for path in discovery.stream_git_repos(
+        directory=directory,
+        index=index,
+        rescan=rescan,
+        max_depth=max_depth,
+        prune=prune,
+        nested=nested,
+    ):
+        if not matches(str(path)):
+            continue
+        if (repo_dir := path.resolve()) not in seen and in_shard(repo_dir):
+            seen.add(repo_dir)
+            yield repo_dir
+
+    await asyncio.to_thread(discovery.save_index, index, index_filepath)
 
 
-def _get_git_repo_branches(repo_dir: GitWorkingDir) -> list[str]:
-    rc, out, _ = git.run_git_cmd(
-        args=("branch", "--list"),
+async def _get_git_repo_branches(repo_dir: GitWorkingDir) -> list[str]:
+    if (branches := GitMetadata(repo_dir).local_branches) is not None:
+        return branches
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("for-each-ref", "--format=%(refname:short)", "refs/heads"),
         git_dir=repo_dir,
     )
 
-    return [b[2:] for b in out.split("\n")] if rc == 0 else []
+    return out.splitlines() if rc == 0 else []
+
 
+async def _get_branch_statuses(
+    repo_dir: GitWorkingDir,
+) -> list[status.BranchStatus]:
+    """
+    Return every local branch and how far ahead of and behind its upstream
+    it is, all from one ``git for-each-ref``.
+    """
 
-def _get_git_repo_status(repo_dir: GitWorkingDir) -> tuple[str, RepoStatus]:  # noqa: PLR0911
-    rc, out, err = git.run_git_cmd(
-        args=("status",),
+    rc, out, err = await git.run_git_cmd_async(
+        args=status.BRANCHES_ARGS,
         git_dir=repo_dir,
     )
+    if rc != 0:
+        raise GitError(err)
+
+    return status.parse_branches(out)
+
 
-    status = out
+async def _get_git_repo_status(
+    repo_dir: GitWorkingDir,
+    status_timeout: float | None = None,
+    max_paths: int | None = None,
+) -> tuple[GitStatus, RepoStatus]:
+    """
+    Return the parsed status of the repository and its status flags.
+
+    The output of ``git status`` is parsed as it streams in, keeping only the
+    first ``max_paths`` paths of each kind. If it takes longer than
+    ``status_timeout`` seconds, it's retried without looking for untracked
+    files and flagged as partial.
+    """
+
+    partial = RepoStatus.CLEAN_AND_UPDATED
+    parser = status.PorcelainV2Parser(max_paths)
+    rc, err = await git.stream_git_cmd_async(
+        args=status.STATUS_ARGS,
+        consume=parser.feed,
+        git_dir=repo_dir,
+        env=_NO_OPTIONAL_LOCKS,
+        timeout=status_timeout,
+    )
+    if rc == git.TIMEOUT_RC and status_timeout is not None:
+        partial = RepoStatus.PARTIAL
+        parser = status.PorcelainV2Parser(max_paths)
+        rc, err = await git.stream_git_cmd_async(
+            args=status.PARTIAL_STATUS_ARGS,
+            consume=parser.feed,
+            git_dir=repo_dir,
+            env=_NO_OPTIONAL_LOCKS,
+        )
     if rc != 0:
-        return err, RepoStatus.UNKNOWN
-    if "Changes not staged for commit" in status:
-        return status, RepoStatus.DIRTY
-    if "Your branch is behind" in status:
-        return status, RepoStatus.BEHIND_REMOTE
-    if "Untracked files" in status:
-        return status, RepoStatus.UNTRACKED_FILES
-    if len(_get_git_repo_branches(repo_dir)) > 1:
-        return status, RepoStatus.MULTIPLE_BRANCHES
-    if "nothing to commit, working tree clean" in status:
-        return status, RepoStatus.CLEAN_AND_UPDATED
+        raise GitError(err)
+
+    git_status = parser.close()
+    repo_status = git_status.flags | partial
+    # Only worth the extra process when there's nothing else to report
+    if not repo_status and len(await _get_git_repo_branches(repo_dir)) > 1:
+        repo_status |= RepoStatus.MULTIPLE_BRANCHES
 
-    return status, RepoStatus.UNKNOWN
+    return git_status, repo_status
+
+
+async def _get_cached_git_repo_status(
+    repo_dir: GitWorkingDir,
+    report_cache: ReportCache | None,
+    status_timeout: float | None = None,
+    max_paths: int | None = None,
+) -> tuple[GitStatus, RepoStatus]:
+    """
+    Return the status of the repository from the cache if it hasn't changed
+    since it was cached (and kept enough of its paths), otherwise from git
+    (and cache it, unless it's only partial).
+    """
+
+    if report_cache is None:
+        return await _get_git_repo_status(repo_dir, status_timeout, max_paths)
+
+    # Fingerprinting stats the whole worktree, so it's kept off the loop.
+    # It's taken once, before `git status`: anything that changes while that
+    # runs won't match it (see the racy window in `cache.fingerprint`), so
+    # the status is safe to cache under it
+    fingerprint = await asyncio.to_thread(cache.fingerprint, repo_dir)
+    if (
+        fingerprint is not None
+        and (cached := report_cache.get(repo_dir, fingerprint))
+        and cached[0].has_paths(max_paths)
+    ):
+        return cached
+
+    git_status, repo_status = await _get_git_repo_status(
+        repo_dir, status_timeout, max_paths
+    )
+    if RepoStatus.PARTIAL not in repo_status and fingerprint is not None:
+        report_cache.put(repo_dir, fingerprint, git_status, repo_status)
+
+    return git_status, repo_status
 
 
 def _get_status_colour(repository_status: RepoStatus) -> str:
-    return {
-        RepoStatus.CLEAN_AND_UPDATED: GREEN,
-        RepoStatus.DIRTY: RED,
-        RepoStatus.UNTRACKED_FILES: YELLOW,
-        RepoStatus.BEHIND_REMOTE: YELLOW,
-        RepoStatus.MULTIPLE_BRANCHES: YELLOW,
-        RepoStatus.UNKNOWN: MAGENTA,
-    }[repository_status]
+    if RepoStatus.UNKNOWN in repository_status:
+        return MAGENTA
+    if repository_status & (
+        RepoStatus.DIRTY | RepoStatus.STAGED_CHANGES | RepoStatus.CONFLICTS
+    ):
+        return RED
+    if repository_status:
+        return YELLOW
+
+    return GREEN
 
 
-def _get_remote_url(
+async def _get_remote_url(
     repo_dir: GitWorkingDir,
     origin_name: str = "origin",
 ) -> str:
-    rc, out, _ = git.run_git_cmd(
+    if remote_url := GitMetadata(repo_dir).remote_url(origin_name):
+        return remote_url
+
+    rc, out, _ = await git.run_git_cmd_async(
         args=("remote", "get-url", origin_name),
         git_dir=repo_dir,
     )
@@ -133,129 +328,963 @@ def _get_remote_url(
     return out if rc == 0 else ""
 
 
-def _fetch_repo(
+def _fetch_profile(
     repo_dir: GitWorkingDir,
+    repo_config: config.RepoConfig,
+    fetcher: Fetcher,
+    origin_name: str = "origin",
+) -> FetchProfile:
+    """
+    Return what to fetch into the repository: in the fetcher's mode if it
+    has one, otherwise the repository's, narrowed by its config.
+    """
+
+    mode = fetcher.mode or repo_config.fetch_mode or "full"
+    profile = FetchProfile()
+    if mode == "minimal":
+        branch = (
+            repo_config.default_branch_name
+            or GitMetadata(repo_dir).remote_head_branch(origin_name)
+            or "main"
+        )
+        profile = FetchProfile.minimal(origin_name, branch)
+
+    return dataclasses.replace(
+        profile,
+        tags=(
+            repo_config.fetch_tags
+            if repo_config.fetch_tags is not None
+            else profile.tags
+        ),
+        filter=repo_config.fetch_filter,
+        depth=repo_config.fetch_depth,
+    )
+
+
+async def _fetch_repo(
+    repo_dir: GitWorkingDir,
+    fetcher: Fetcher,
+    repo_config: config.RepoConfig | None = None,
     origin_name: str = "origin",
 ) -> None:
-    git.run_git_cmd(
-        args=(
-            "fetch",
+    await fetcher.fetch(
+        repo_dir=repo_dir,
+        remote=origin_name,
+        remote_url=await _get_remote_url(repo_dir, origin_name),
+        profile=_fetch_profile(
+            repo_dir,
+            repo_config or config.RepoConfig(),
+            fetcher,
             origin_name,
-            "--no-recurse-submodules",
-            "--progress",
-            "--prune",
         ),
+    )
+
+
+async def _get_current_branch(repo_dir: GitWorkingDir) -> str | None:
+    metadata = GitMetadata(repo_dir)
+    if metadata.config is not None:
+        return metadata.current_branch
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("symbolic-ref", "--quiet", "--short", "HEAD"),
         git_dir=repo_dir,
     )
 
+    return out if rc == 0 else None
+
+
+async def _get_upstream_ref(
+    repo_dir: GitWorkingDir,
+    branch: str,
+) -> str | None:
+    if upstream := GitMetadata(repo_dir).upstream_ref(branch):
+        return upstream
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("rev-parse", "--symbolic-full-name", f"{branch}@{{upstream}}"),
+        git_dir=repo_dir,
+    )
+
+    return out if rc == 0 and out else None
+
+
+async def _resolve_refs(
+    repo_dir: GitWorkingDir,
+    *refs: str,
+) -> list[str] | None:
+    metadata = GitMetadata(repo_dir)
+    shas = [sha for ref in refs if (sha := metadata.resolve_ref(ref))]
+    if len(shas) == len(refs):
+        return shas
 
-def _pull_repo(repo_dir: GitWorkingDir) -> tuple[int, str]:
-    rc, out, err = git.run_git_cmd(
-        args=("pull", "--no-recurse-submodules"),
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("rev-parse", "--verify", "--end-of-options", *refs),
         git_dir=repo_dir,
     )
 
-    if rc == 0:
-        return rc, out
+    return out.split() if rc == 0 else None
+
+
+async def _fast_forward(
+    repo_dir: GitWorkingDir,
+    branch: str,
+    upstream: str,
+    checked_out: bool,
+) -> tuple[int, str]:
+    """
+    Fast-forward the branch to its upstream's remote-tracking ref without
+    touching the network, refusing to do anything else.
+
+    A checked-out branch is merged so that its worktree moves with it, and
+    any other branch is updated by fetching from the repository itself,
+    which (unlike ``update-ref``) won't move a branch that's checked out in
+    another worktree.
+    """
+
+    if checked_out:
+        args: tuple[str, ...] = ("merge", "--ff-only", "--quiet", upstream)
     else:
-        return rc, err
+        args = (
+            "fetch",
+            "--quiet",
+            "--no-write-fetch-head",
+            "--no-auto-maintenance",
+            ".",
+            f"{upstream}:refs/heads/{branch}",
+        )
+    rc, out, err = await git.run_git_cmd_async(args=args, git_dir=repo_dir)
+
+    return rc, out if rc == 0 else err
 
 
-def _pull_repo_main_branch(
+async def _pull_repo_main_branch(
     repo_dir: GitWorkingDir,
     conf: config.Config,
-    fetch: bool,
-) -> UpdateResult | None:
-    if fetch:
-        _fetch_repo(repo_dir)
-
-    git_status, _ = _get_git_repo_status(repo_dir)
-    if repo_config := conf.repositories.get(str(repo_dir)):
-        default_branch = repo_config.default_branch_name
+    fetcher: Fetcher | None,
+    durations: Durations | None = None,
+) -> UpdateState:
+    """
+    Fetch the repository (unless the config says not to), then fast-forward
+    its default branch.
+    """
+
+    repo_config = conf.repository_config(repo_dir)
+    if fetcher is not None and repo_config.fetch is not False:
+        with _timed(durations, repo_dir, "fetch"):
+            await _fetch_repo(repo_dir, fetcher, repo_config)
+
+    with _timed(durations, repo_dir, "update"):
+        return await _fast_forward_main_branch(repo_dir, repo_config)
+
+
+async def _fast_forward_main_branch(
+    repo_dir: GitWorkingDir,
+    repo_config: config.RepoConfig,
+) -> UpdateState:
+    """
+    Fast-forward the default branch to its upstream, whether it's checked
+    out or not, using only the commits that have already been fetched.
+    """
+
+    # TODO: use `git config get init.defaultbranch` when it isn't configured
+    default_branch = repo_config.default_branch_name or "main"
+    state = UpdateState(repo_dir=str(repo_dir), branch=default_branch)
+
+    upstream = await _get_upstream_ref(repo_dir, default_branch)
+    if upstream is None:
+        return state
+    shas = await _resolve_refs(
+        repo_dir, f"refs/heads/{default_branch}", upstream
+    )
+    if shas is None:
+        return state
+    state.old_sha, state.new_sha = old, new = shas
+    if old == new:
+        return state
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("rev-list", "--left-right", "--count", f"{old}...{new}"),
+        git_dir=repo_dir,
+    )
+    if rc != 0:
+        return state
+    ahead, behind = map(int, out.split())
+    if ahead or not behind:
+        return state  # only ever fast-forward
+
+    checked_out = await _get_current_branch(repo_dir) == default_branch
+    state.rc, progress = await _fast_forward(
+        repo_dir, default_branch, upstream, checked_out
+    )
+    if state.rc != 0:
+        state.error = progress
     else:
-        default_branch = "main"  # TODO: use `git config get init.defaultbranch`
+        state.commits = behind
 
-    if (
-        "Your branch is behind" in git_status
-        and f"On branch {default_branch}" in git_status
-    ):
-        rc, progress = _pull_repo(repo_dir)
-        return (
-            rc,
-            colour(f"Updating {repo_dir}...", BOLD + BLUE),
-            progress if rc == 0 else colour(progress, RED),
-        )
+    return state
 
-    return -1, "", ""
 
+def format_update(state: UpdateState, quiet_level: int = 0) -> UpdateResult:
+    """
+    Return the report of the repository's update, as printed by the CLI.
+    """
 
-def _report_on_repo(
+    if state.rc == -1:
+        return -1, "", ""
+
+    header = colour(f"Updating {state.repo_dir}...", BOLD + BLUE)
+    if state.error:
+        error = state.error.splitlines()[0] if quiet_level > 0 else state.error
+        return state.rc, header, colour(error, RED)
+
+    commits = "commit" if state.commits == 1 else "commits"
+    return (
+        state.rc,
+        header,
+        f"Fast-forwarded {state.branch} by {state.commits} {commits}"
+        f" ({state.old_sha[:7]}..{state.new_sha[:7]})",
+    )
+
+
+async def get_repo_state(
     repo_dir: GitWorkingDir,
-    fetch: bool,
-    print_all: bool,
-    quiet_level: int,
+    report_cache: ReportCache | None = None,
+    status_timeout: float | None = DEFAULT_STATUS_TIMEOUT,
+    max_paths: int | None = DEFAULT_MAX_PATHS,
+    branches: bool = False,
+) -> RepoState:
+    """
+    Return the current state of the repository, without fetching, and how
+    each of its local branches compares to its upstream if ``branches`` is
+    set.
+    """
+
+    state = RepoState(
+        repo_dir=str(repo_dir),
+        remote_url=await _get_remote_url(repo_dir, "origin"),
+    )
+    try:
+        state.status, state.flags = await _get_cached_git_repo_status(
+            repo_dir, report_cache, status_timeout, max_paths
+        )
+        if branches:
+            state.branches = await _get_branch_statuses(repo_dir)
+            for branch in state.branches:
+                state.flags |= branch.flags
+    except GitError as e:
+        state.error = str(e)
+
+    return state
+
+
+def format_report(
+    state: RepoState,
+    print_all: bool = False,
+    quiet_level: int = 0,
 ) -> ReportResult:
-    if fetch:
-        _fetch_repo(repo_dir)
-
-    git_status, repo_status = _get_git_repo_status(repo_dir)
-    repo_header = colour(str(repo_dir), BOLD + BLUE)
-    if remote_url := _get_remote_url(repo_dir, "origin"):
-        repo_header += colour(f"  (origin: {remote_url})", GREY)
-
-    if print_all or repo_status != RepoStatus.CLEAN_AND_UPDATED:
-        status_message = repo_status if quiet_level > 0 else git_status
-        return (
-            0 if repo_status.CLEAN_AND_UPDATED else 1,
-            repo_header,
-            colour(status_message, _get_status_colour(repo_status)),
+    """
+    Return the report of the repository's state, as printed by the CLI.
+    """
+
+    repo_status = state.flags
+    if not print_all and repo_status == RepoStatus.CLEAN_AND_UPDATED:
+        return -1, "", ""
+
+    repo_header = colour(state.repo_dir, BOLD + BLUE)
+    if state.remote_url:
+        repo_header += colour(f"  (origin: {state.remote_url})", GREY)
+
+    if quiet_level > 0:
+        status_message = str(repo_status)
+    elif state.status is not None:
+        status_message = status.format_status(state.status)
+    else:
+        status_message = state.error
+    if RepoStatus.PARTIAL in repo_status and quiet_level == 0:
+        status_message += (
+            "\n\n(untracked files weren't checked: status was too slow)"
         )
+    if state.branches and quiet_level == 0:
+        if branches_message := status.format_branches(state.branches):
+            status_message += "\n\n" + branches_message
+
+    return (
+        0 if repo_status == RepoStatus.CLEAN_AND_UPDATED else 1,
+        repo_header,
+        colour(status_message, _get_status_colour(repo_status)),
+    )
+
+
+async def _report_on_repo(  # noqa: PLR0913
+    repo_dir: GitWorkingDir,
+    fetcher: Fetcher | None,
+    report_cache: ReportCache | None,
+    *,
+    repo_timeout: float | None,
+    status_timeout: float | None,
+    max_paths: int | None,
+    branches: bool = False,
+    durations: Durations | None = None,
+    repo_config: config.RepoConfig | None = None,
+) -> RepoState:
+    start = time.perf_counter()
+    try:
+        async with asyncio.timeout(repo_timeout):
+            if fetcher is not None:
+                with _timed(durations, repo_dir, "fetch"):
+                    await _fetch_repo(repo_dir, fetcher, repo_config)
+            with _timed(durations, repo_dir, "status"):
+                state = await get_repo_state(
+                    repo_dir, report_cache, status_timeout, max_paths, branches
+                )
+    except TimeoutError:
+        state = RepoState(
+            repo_dir=str(repo_dir),
+            error=f"Timed out after {repo_timeout}s",
+        )
+
+    state.duration = time.perf_counter() - start
+    return state
+
+
+@contextlib.contextmanager
+def _timed(
+    durations: Durations | None,
+    repo_dir: GitWorkingDir,
+    kind: Kind,
+) -> Iterator[None]:
+    """
+    Record how long the step takes in the repository.
+
+    A step that's cancelled (like by ``repo_timeout``) would have taken at
+    least as long as it ran for, so that's recorded if it's longer than
+    the step is expected to take: otherwise the repositories that always
+    time out would never be expected to be slow, and never started first.
+    """
 
-    return -1, "", ""
+    start = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        if durations is not None:
+            elapsed = time.perf_counter() - start
+            if elapsed > durations.estimate(repo_dir, [kind]):
+                durations.observe(repo_dir, kind, elapsed)
+        raise
+    if durations is not None:
+        durations.observe(repo_dir, kind, time.perf_counter() - start)
 
 
-async def pull_repo_main_branches(
-    repositories: list[pathlib.Path],
+def _priority(
+    schedule: Schedule,
+    durations: Durations | None,
+    kinds: Iterable[Kind],
+) -> Callable[[GitWorkingDir], float] | None:
+    """
+    Return the priority to start the repositories in, longest expected
+    first, or None to start them in the order they're found.
+    """
+
+    if schedule != "lpt":
+        return None
+    estimates = durations if durations is not None else Durations.load()
+    _kinds = tuple(kinds)
+    return lambda repo_dir: estimates.estimate(repo_dir, _kinds)
+
+
+async def _aiter[T](items: Iterable[T] | AsyncIterable[T]) -> AsyncGenerator[T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _as_completed_bounded[T](
+    repositories: Repositories,
+    process: Callable[[GitWorkingDir], Coroutine[Any, Any, T]],
+    jobs: Jobs,
+    priority: Callable[[GitWorkingDir], float] | None = None,
+) -> AsyncGenerator[T]:
+    """
+    Process the repositories as they arrive, with at most ``jobs`` of them
+    being processed at once, and yield the results as they complete.
+
+    If ``jobs`` is "auto", the git commands are limited instead, adapting to
+    how well the disk and the network keep up (see ``concurrency``).
+
+    Repositories are started in the order they arrive or, if ``priority``
+    is given, highest priority first. Repositories that are still being
+    found (an async iterable) are started as they arrive, so only those
+    waiting for a slot are reordered, while a list of them is sorted
+    before any is started.
+    """
+
+    auto = jobs == concurrency.AUTO
+    semaphore = PrioritySemaphore(concurrency.AUTO_MAX_JOBS if auto else jobs)
+    completed: asyncio.Queue[asyncio.Task[Any]] = asyncio.Queue()
+    tasks: set[asyncio.Task[T]] = set()
+
+    async def bounded(repo_dir: GitWorkingDir) -> T:
+        async with semaphore.acquiring(
+            priority(repo_dir) if priority is not None else 0
+        ):
+            return await process(repo_dir)
+
+    async def submit_all() -> None:
+        # The tasks inherit the limiters from the submitter's context
+        with (
+            concurrency.limiting(
+                concurrency.current_limiters() or concurrency.Limiters()
+            )
+            if auto
+            else contextlib.nullcontext()
+        ):
+            found = repositories
+            if priority is not None and not isinstance(found, AsyncIterable):
+                # Sorted, so that the first to take the free slots are the
+                # highest priority ones too, rather than the first listed
+                found = sorted(found, key=priority, reverse=True)
+            async for repo_dir in _aiter(found):
+                task = asyncio.create_task(bounded(repo_dir))
+                task.add_done_callback(completed.put_nowait)
+                tasks.add(task)
+
+    # The submitter is put on the queue too, to mark the end of the input
+    submitter = asyncio.create_task(submit_all())
+    submitter.add_done_callback(completed.put_nowait)
+    try:
+        while not submitter.done() or tasks:
+            task = await completed.get()
+            if task is submitter:
+                task.result()  # re-raise any error from the input
+                continue
+            tasks.discard(task)
+            yield task.result()
+    finally:
+        # Wait for the cancelled tasks so that their git processes are killed
+        # before this returns (or the interpreter exits)
+        for task in (submitter, *tasks):
+            task.cancel()
+        await asyncio.gather(submitter, *tasks, return_exceptions=True)
+
+
+async def update_states(  # noqa: PLR0913
+    repositories: Repositories,
     fetch: bool = True,
+    *,
+    jobs: Jobs = DEFAULT_JOBS,
+    fetcher: Fetcher | None = None,
+    repo_timeout: float | None = None,
+    durations: Durations | None = None,
+    schedule: Schedule = "path",
+) -> AsyncGenerator[UpdateState]:
+    """
+    Pull the default branches on the given git repositories, yielding what
+    was done to each as it completes, and giving up on any that take longer
+    than ``repo_timeout`` seconds.
+
+    See ``report_states`` for the ``durations`` and the ``schedule``.
+    """
+
+    conf = config.load_config()
+    fetcher = (fetcher or Fetcher()) if fetch else None
+
+    async def process(repo_dir: GitWorkingDir) -> UpdateState:
+        start = time.perf_counter()
+        with timings.span("update", "repo", repo_dir) as span:
+            try:
+                async with asyncio.timeout(repo_timeout):
+                    state = await _pull_repo_main_branch(
+                        repo_dir=repo_dir,
+                        conf=conf,
+                        fetcher=fetcher,
+                        durations=durations,
+                    )
+            except TimeoutError:
+                state = UpdateState(
+                    repo_dir=str(repo_dir),
+                    rc=1,
+                    error=f"Timed out after {repo_timeout}s",
+                )
+            if span is not None:
+                span.rc = state.rc
+
+        state.duration = time.perf_counter() - start
+        return state
+
+    kinds: list[Kind] = ["fetch", "update"] if fetch else ["update"]
+    try:
+        async for result in _as_completed_bounded(
+            repositories,
+            process,
+            jobs,
+            _priority(schedule, durations, kinds),
+        ):
+            yield result
+    finally:
+        if durations is not None:
+            durations.save()
+
+
+async def pull_repo_main_branches(  # noqa: PLR0913
+    repositories: Repositories,
+    fetch: bool = True,
+    quiet_level: int = 0,
+    *,
+    jobs: Jobs = DEFAULT_JOBS,
+    fetcher: Fetcher | None = None,
+    repo_timeout: float | None = None,
+    durations: Durations | None = None,
+    schedule: Schedule = "path",
 ) -> AsyncGenerator[UpdateResult]:
     """
     Pull the default branches on the given git repositories.
+
+    See ``update_states`` for the timeouts and scheduling.
     """
 
-    for future in asyncio.as_completed(
-        [
-            asyncio.to_thread(
-                _pull_repo_main_branch,
-                repo_dir=repo,
-                conf=config.load_config(),
-                fetch=fetch,
+    states = update_states(
+        repositories,
+        fetch=fetch,
+        jobs=jobs,
+        fetcher=fetcher,
+        repo_timeout=repo_timeout,
+        durations=durations,
+        schedule=schedule,
+    )
+    async with contextlib.aclosing(states):
+        async for state in states:
+            yield format_update(state, quiet_level=quiet_level)
+
+
+async def report_states(  # noqa: PLR0913
+    repositories: Repositories,
+    fetch: bool = True,
+    *,
+    jobs: Jobs = DEFAULT_JOBS,
+    fetcher: Fetcher | None = None,
+    report_cache: ReportCache | None = None,
+    repo_timeout: float | None = None,
+    status_timeout: float | None = DEFAULT_STATUS_TIMEOUT,
+    max_paths: int | None = DEFAULT_MAX_PATHS,
+    branches: bool = False,
+    durations: Durations | None = None,
+    schedule: Schedule = "path",
+) -> AsyncGenerator[RepoState]:
+    """
+    Yield the state of each of the given git repositories as it completes.
+
+    When a ``report_cache`` is given, the statuses of repositories that
+    haven't changed since the last report are reused rather than recomputed.
+
+    Repositories that take longer than ``repo_timeout`` seconds are given
+    up on and reported with an error, and statuses that take longer than
+    ``status_timeout`` seconds are retried without looking for untracked
+    files (see ``RepoStatus.PARTIAL``).
+
+    Only the first ``max_paths`` paths of each kind are kept for each
+    repository (all of them if it's ``None``), but all of them are counted.
+
+    With ``branches``, every local branch is compared to its upstream too,
+    not just the current one.
+
+    When ``durations`` are given, how long each repository takes to fetch
+    and to check is recorded in them. With the "lpt" ``schedule``, the
+    repositories expected to take longest are started first, so that they
+    don't hold up the end of the report.
+    """
+
+    fetcher = (fetcher or Fetcher()) if fetch else None
+    conf = config.load_config()
+
+    async def process(repo_dir: GitWorkingDir) -> RepoState:
+        repo_config = conf.repository_config(repo_dir)
+        skip_fetch = repo_config.fetch is False
+        with timings.span("report", "repo", repo_dir) as span:
+            state = await _report_on_repo(
+                repo_dir=repo_dir,
+                fetcher=None if skip_fetch else fetcher,
+                report_cache=report_cache,
+                repo_timeout=repo_timeout,
+                status_timeout=status_timeout,
+                max_paths=max_paths,
+                branches=branches,
+                durations=durations,
+                repo_config=repo_config,
             )
-            for repo in repositories
-        ]
-    ):
-        yield await future
+            if span is not None:
+                span.rc = 0 if not state.error else 1
+
+        return state
+
+    kinds: list[Kind] = ["fetch", "status"] if fetch else ["status"]
+    try:
+        async for result in _as_completed_bounded(
+            repositories,
+            process,
+            jobs,
+            _priority(schedule, durations, kinds),
+        ):
+            yield result
+    finally:
+        if report_cache is not None:
+            report_cache.save()
+        if durations is not None:
+            durations.save()
+
+
+# How long to wait for a result before checking that the workers are alive
+_WORKER_POLL_INTERVAL = 0.1
 
 
-async def git_report(
-    repositories: list[pathlib.Path],
+async def _worker_states(
+    inbox: multiprocessing.Queue,
+    outbox: multiprocessing.Queue,
+    command_timeout: float | None,
+    record: bool,
+    report_kwargs: dict[str, Any],
+) -> None:
+    async def repositories() -> AsyncGenerator[GitWorkingDir]:
+        while True:
+            # Polled, so that a cancelled worker isn't left waiting on a
+            # thread that's blocked on the inbox
+            try:
+                repo_dir = await asyncio.to_thread(
+                    inbox.get, timeout=_WORKER_POLL_INTERVAL
+                )
+            except queue.Empty:
+                continue
+            if repo_dir is None:
+                return
+            yield pathlib.Path(repo_dir)
+
+    recorder = timings.Recorder() if record else None
+    with git.command_timeout(command_timeout), timings.recording(recorder):
+        states = report_states(repositories(), **report_kwargs)
+        async with contextlib.aclosing(states):
+            async for state in states:
+                outbox.put(("state", state.to_json()))
+
+    outbox.put(("done", recorder.spans if recorder is not None else []))
+
+
+async def _run_worker_states(*args: Any) -> None:  # pragma: no cover
+    # Like the CLI, treat SIGTERM like Ctrl-C so that git processes are killed
+    task = asyncio.current_task()
+    with contextlib.suppress(NotImplementedError):  # Windows
+        if task is not None:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, task.cancel
+            )
+
+    await _worker_states(*args)
+
+
+def _report_worker(*args: Any) -> None:  # pragma: no cover
+    """
+    The entry point of a worker process for ``report_states_in_processes``.
+    """
+
+    with contextlib.suppress(KeyboardInterrupt, asyncio.CancelledError):
+        asyncio.run(_run_worker_states(*args))
+
+
+def _receive(
+    outbox: multiprocessing.Queue,
+    workers: list[multiprocessing.process.BaseProcess],
+    stopped: threading.Event,
+) -> tuple[str, Any] | None:
+    """
+    Return the next message from the workers, or ``None`` once ``stopped``
+    is set.
+    """
+
+    while not stopped.is_set():
+        try:
+            return outbox.get(timeout=_WORKER_POLL_INTERVAL)
+        except queue.Empty:
+            if any(worker.exitcode not in {None, 0} for worker in workers):
+                raise RuntimeError("A report worker process died") from None
+            if all(worker.exitcode is not None for worker in workers):
+                raise RuntimeError(
+                    "The report worker processes exited before finishing"
+                ) from None
+
+    return None
+
+
+async def report_states_in_processes(
+    repositories: Repositories,
+    root: pathlib.Path,
+    processes: int,
+    **report_kwargs: Any,
+) -> AsyncGenerator[RepoState]:
+    """
+    Like ``report_states``, but split the repositories between ``processes``
+    worker processes (each with its own event loop) and yield their states
+    as they arrive.
+
+    Each repository is sent to the worker for its shard (see
+    ``shard_of``) as soon as it's found, and the keyword arguments are
+    passed on to ``report_states`` in each worker, so ``jobs`` and the
+    fetcher's limits apply per worker.
+
+    If finding the repositories fails, the workers are stopped and the
+    error is raised.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    outbox = context.Queue()
+    inboxes = [context.Queue() for _ in range(processes)]
+    recorder = timings.current_recorder()
+    workers = [
+        context.Process(
+            target=_report_worker,
+            args=(
+                inbox,
+                outbox,
+                git.current_command_timeout(),
+                recorder is not None,
+                report_kwargs,
+            ),
+            daemon=True,
+        )
+        for inbox in inboxes
+    ]
+    for worker in workers:
+        worker.start()
+
+    root = root.resolve()
+
+    # Set once the repositories couldn't all be sent, or the report is over
+    stopped = threading.Event()
+
+    async def send_all() -> None:
+        try:
+            async for repo_dir in _aiter(repositories):
+                index = shard_of(repo_dir, root, processes)
+                inboxes[index].put(str(repo_dir))
+        except BaseException:
+            stopped.set()
+            raise
+        finally:
+            for inbox in inboxes:
+                inbox.put(None)
+
+    sender = asyncio.create_task(send_all())
+    try:
+        finished = 0
+        while finished < processes:
+            message = await asyncio.to_thread(
+                _receive, outbox, workers, stopped
+            )
+            if message is None:
+                break  # the sender failed, which is raised below
+            kind, payload = message
+            if kind == "state":
+                yield RepoState.from_json(payload)
+            else:
+                finished += 1
+                if recorder is not None:
+                    recorder.spans.extend(payload)
+        await sender
+    finally:
+        stopped.set()
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()  # the workers kill their git processes
+            await asyncio.to_thread(worker.join)
+
+
+async def git_report(  # noqa: PLR0913
+    repositories: Repositories,
     fetch: bool = True,
     print_all: bool = False,  # TODO: Control this via the verbosity
     quiet_level: int = 0,
+    *,
+    jobs: Jobs = DEFAULT_JOBS,
+    fetcher: Fetcher | None = None,
+    report_cache: ReportCache | None = None,
+    repo_timeout: float | None = None,
+    status_timeout: float | None = DEFAULT_STATUS_TIMEOUT,
+    max_paths: int | None = DEFAULT_MAX_PATHS,
+    branches: bool = False,
+    durations: Durations | None = None,
+    schedule: Schedule = "path",
 ) -> AsyncGenerator[ReportResult]:
     """
     Report on the given git repositories.
+
+    See ``report_states`` for the caching, timeouts, path limits, branches
+    and scheduling.
     """
 
-    for future in asyncio.as_completed(
-        [
-            asyncio.to_thread(
-                _report_on_repo,
-                repo_dir=repo,
-                fetch=fetch,
+    states = report_states(
+        repositories,
+        fetch=fetch,
+        jobs=jobs,
+        fetcher=fetcher,
+        report_cache=report_cache,
+        repo_timeout=repo_timeout,
+        status_timeout=status_timeout,
+        max_paths=max_paths,
+        branches=branches,
+        durations=durations,
+        schedule=schedule,
+    )
+    async with contextlib.aclosing(states):
+        async for state in states:
+            yield format_report(
+                state=state,
                 print_all=print_all,
                 quiet_level=quiet_level,
             )
-            for repo in repositories
-        ]
-    ):
-        yield await future
+
+
+async def tune_repos(
+    repositories: Repositories,
+    apply: bool = False,
+    *,
+    accelerators: frozenset[str] = frozenset(tune.ACCELERATORS),
+    min_files: int = tune.DEFAULT_MIN_FILES,
+    jobs: Jobs = DEFAULT_JOBS,
+) -> AsyncGenerator[tune.TuneResult]:
+    """
+    Recommend git's accelerators for the given repositories and, if
+    ``apply`` is set, enable them.
+
+    The settings that are changed are recorded in the config, so that they
+    can be reverted with ``revert_tuning``.
+    """
+
+    conf = config.load_config()
+    # The same for every repository, so only asked of git once
+    fsmonitor = (
+        await tune.fsmonitor_supported()
+        if "fsmonitor" in accelerators
+        else False
+    )
+
+    async def process(repo_dir: GitWorkingDir) -> tune.TuneResult:
+        result = await tune.recommend(
+            repo_dir, accelerators, min_files, fsmonitor
+        )
+        if apply:
+            await tune.apply(result)
+        return result
+
+    changed = False
+    try:
+        async for result in _as_completed_bounded(repositories, process, jobs):
+            if result.changed:
+                repo_config = conf.repositories.setdefault(
+                    str(result.repo_dir), config.RepoConfig()
+                )
+                # Keep the values from before the first time it was tuned
+                for key, previous in result.changed.items():
+                    repo_config.tuned.setdefault(key, previous)
+                changed = True
+            yield result
+    finally:
+        if changed:
+            config.save_config(conf)
+
+
+async def maintain_repos(  # noqa: PLR0913
+    repositories: Repositories,
+    *,
+    tasks: frozenset[str] = frozenset(maintain.TASKS),
+    jobs: Jobs = maintain.DEFAULT_JOBS,
+    min_interval: float = maintain.DEFAULT_MIN_INTERVAL,
+    io_budget: int | None = None,
+    measure: bool = False,
+    state_filepath: pathlib.Path | None = None,
+) -> AsyncGenerator[maintain.MaintainResult]:
+    """
+    Run git's maintenance ``tasks`` in the given repositories, yielding
+    what each reclaimed.
+
+    Repositories maintained less than ``min_interval`` seconds ago are
+    skipped, as are the worktrees of a repository that's already been
+    maintained. Once the repositories maintained have ``io_budget`` bytes
+    of objects between them, the rest are skipped until the next run.
+
+    With ``measure``, the probe (see ``maintain.PROBE_ARGS``) is timed
+    before and after the tasks, which costs several extra runs of it.
+    """
+
+    maintained_at = maintain.load_state(state_filepath)
+    maintained: dict[str, float] = {}
+    seen: set[str] = set()
+    spent = 0
+
+    async def process(repo_dir: GitWorkingDir) -> maintain.MaintainResult:
+        nonlocal spent
+        result = maintain.MaintainResult(repo_dir=repo_dir)
+        key = maintain.maintenance_key(repo_dir)
+        if key in seen:
+            result.skipped = "already maintained through another worktree"
+            return result
+        seen.add(key)
+        if time.time() - maintained_at.get(key, 0) < min_interval:
+            result.skipped = "maintained recently"
+            return result
+
+        result.size_before = await maintain.objects_size(repo_dir)
+        size = result.size_before or 0
+        # The first repository always fits, so that one that's bigger than
+        # the whole budget isn't put off forever
+        if io_budget is not None and spent and spent + size > io_budget:
+            result.skipped = "over the IO budget"
+            return result
+        spent += size
+
+        with timings.span("maintain", "repo", repo_dir) as span:
+            await maintain.run(result, sorted(tasks), measure)
+            if span is not None:
+                span.rc = 0 if not result.error else 1
+        if not result.error:
+            maintained[key] = time.time()
+        return result
+
+    try:
+        async for result in _as_completed_bounded(repositories, process, jobs):
+            yield result
+    finally:
+        if maintained:
+            maintain.save_state(maintained, state_filepath)
+
+
+async def revert_tuning(
+    repositories: Repositories,
+    *,
+    jobs: Jobs = DEFAULT_JOBS,
+) -> AsyncGenerator[tune.TuneResult]:
+    """
+    Restore the settings that ``tune_repos`` changed in the given
+    repositories, as recorded in the config.
+    """
+
+    conf = config.load_config()
+
+    async def process(repo_dir: GitWorkingDir) -> tune.TuneResult:
+        result = tune.TuneResult(repo_dir=repo_dir, entries=None)
+        if repo_config := conf.repositories.get(str(repo_dir)):
+            result.changed = dict(repo_config.tuned)
+            result.error = await tune.revert(repo_dir, repo_config.tuned)
+        return result
+
+    changed = False
+    try:
+        async for result in _as_completed_bounded(repositories, process, jobs):
+            if result.changed and not result.error:
+                conf.repositories[str(result.repo_dir)].tuned.clear()
+                changed = True
+            yield result
+    finally:
+        if changed:
+            config.save_config(conf)
@@ -0,0 +1,202 @@
+"""
+Run git's maintenance tasks, which precompute the structures (like the
+commit-graph) that keep reports and fetches fast as repositories grow.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+import pathlib
+import time
+
+from git_meta import git
+from git_meta.constants import PROGRAM, STATE_HOME
+from git_meta.metadata import GitMetadata
+
+DEFAULT_STATE_FILEPATH = STATE_HOME / PROGRAM / "maintenance.json"
+# Maintenance rewrites packs, so it gets far fewer jobs than reports do
+DEFAULT_JOBS = 2
+# Repositories maintained more recently than this are skipped, in seconds
+DEFAULT_MIN_INTERVAL = 24 * 60 * 60
+
+# In the order they're run: packing the loose objects first gives the
+# multi-pack-index and the incremental repack something to work with
+# https://git-scm.com/docs/git-maintenance#_tasks
+TASKS: dict[str, tuple[str, ...]] = {
+    "loose-objects": ("maintenance", "run", "--task=loose-objects"),
+    "multi-pack-index": ("multi-pack-index", "write"),
+    "incremental-repack": ("maintenance", "run", "--task=incremental-repack"),
+    "commit-graph": ("maintenance", "run", "--task=commit-graph"),
+}
+# Tasks that fail in repositories without any packs
+_PACK_TASKS = frozenset({"multi-pack-index", "incremental-repack"})
+# Timed before and after (with ``measure``), as a measure of what the
+# commit-graph saves
+PROBE_ARGS = ("rev-list", "--count", "--all")
+# The probe is run once to warm the caches up, then timed this many times,
+# keeping the fastest so that the before and after are compared like for like
+PROBE_RUNS = 3
+
+
+def maintenance_key(repo_dir: pathlib.Path) -> str:
+    """
+    Return what a repository is maintained under: its common git directory,
+    so that the worktrees of a repository are only maintained once.
+    """
+
+    common_dir = GitMetadata(repo_dir).common_dir
+    return os.path.realpath(common_dir if common_dir is not None else repo_dir)
+
+
+def load_state(filepath: pathlib.Path | None = None) -> dict[str, float]:
+    """
+    Return when each repository (by its ``maintenance_key``) was last
+    maintained.
+    """
+
+    _path = filepath if filepath is not None else DEFAULT_STATE_FILEPATH
+    try:
+        with open(_path) as f:
+            return {
+                key: float(maintained_at)
+                for key, maintained_at in json.load(f).items()
+            }
+    except (OSError, ValueError, TypeError, AttributeError):
+        # A missing or corrupt state just means maintaining everything
+        return {}
+
+
+def save_state(
+    maintained: dict[str, float],
+    filepath: pathlib.Path | None = None,
+) -> None:
+    """
+    Add the repositories that were maintained to the saved state.
+    """
+
+    _path = filepath if filepath is not None else DEFAULT_STATE_FILEPATH
+    state = load_state(_path) | maintained
+    _path.parent.mkdir(parents=True, exist_ok=True)
+    _tmp_path = _path.with_suffix(f".{os.getpid()}.tmp")
+    with open(_tmp_path, "w+") as f:
+        json.dump(state, f)
+
+    os.replace(_tmp_path, _path)
+
+
+@dataclasses.dataclass
+class MaintainResult:
+    """
+    The maintenance tasks that were run in a repository, and the size of
+    its objects and (when measured) the time of the probe (see
+    ``PROBE_ARGS``) before and after them.
+    """
+
+    repo_dir: pathlib.Path
+    tasks: list[str] = dataclasses.field(default_factory=list)
+    skipped: str = ""  # why the repository wasn't maintained
+    size_before: int | None = None  # bytes
+    size_after: int | None = None
+    probe_before: float | None = None  # seconds
+    probe_after: float | None = None
+    duration: float = 0.0  # seconds
+    error: str = ""
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        if self.size_before is None or self.size_after is None:
+            return 0
+        return self.size_before - self.size_after
+
+    @property
+    def reclaimed_seconds(self) -> float:
+        if self.probe_before is None or self.probe_after is None:
+            return 0.0
+        return self.probe_before - self.probe_after
+
+
+async def objects_size(repo_dir: pathlib.Path) -> int | None:
+    """
+    Return how many bytes the repository's objects take up, loose and
+    packed, according to ``git count-objects``.
+    """
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("count-objects", "-v"),
+        git_dir=repo_dir,
+    )
+    if rc != 0:
+        return None
+
+    counts = dict(line.split(": ", 1) for line in out.splitlines())
+    kib = sum(
+        int(counts.get(key, 0)) for key in ("size", "size-pack", "size-garbage")
+    )
+    return kib * 1024
+
+
+async def _probe(repo_dir: pathlib.Path) -> float | None:
+    """
+    Return the fastest of ``PROBE_RUNS`` warm runs of the probe, in seconds.
+    """
+
+    rc, _, _ = await git.run_git_cmd_async(args=PROBE_ARGS, git_dir=repo_dir)
+    if rc != 0:
+        return None
+
+    seconds = []
+    for _ in range(PROBE_RUNS):
+        start = time.perf_counter()
+        rc, _, _ = await git.run_git_cmd_async(
+            args=PROBE_ARGS, git_dir=repo_dir
+        )
+        if rc != 0:
+            return None
+        seconds.append(time.perf_counter() - start)
+
+    return min(seconds)
+
+
+def _has_packs(repo_dir: pathlib.Path) -> bool:
+    common_dir = GitMetadata(repo_dir).common_dir
+    if common_dir is None:
+        return True  # let git decide
+    pack_dir = common_dir / "objects" / "pack"
+    return any(pack_dir.glob("*.pack"))
+
+
+async def run(
+    result: MaintainResult,
+    tasks: list[str],
+    measure: bool = False,
+) -> MaintainResult:
+    """
+    Run the tasks in the repository, in the order of ``TASKS``, measuring
+    the space that they reclaim and, with ``measure``, the time that they
+    save the probe.
+    """
+
+    start = time.perf_counter()
+    repo_dir = result.repo_dir
+    if result.size_before is None:
+        result.size_before = await objects_size(repo_dir)
+    if measure:
+        result.probe_before = await _probe(repo_dir)
+    for name, args in TASKS.items():
+        if name not in tasks:
+            continue
+        if name in _PACK_TASKS and not _has_packs(repo_dir):
+            continue
+        rc, _, err = await git.run_git_cmd_async(args=args, git_dir=repo_dir)
+        if rc != 0:
+            result.error = err or f"{name} failed"
+            break
+        result.tasks.append(name)
+
+    result.size_after = await objects_size(repo_dir)
+    if measure:
+        result.probe_after = await _probe(repo_dir)
+    result.duration = time.perf_counter() - start
+    return result
@@ -0,0 +1,477 @@
+from __future__ import annotations
+
+import functools
+import os
+import pathlib
+import struct
+
+from git_meta.constants import CONFIG_HOME, HOME
+
+type ConfigValues = dict[str, list[str]]
+
+_HEAD_REF_PREFIX = "ref: "
+_GITDIR_PREFIX = "gitdir: "
+_MAX_SYMREF_DEPTH = 5
+_CONFIG_ESCAPES = {"n": "\n", "t": "\t", "b": "\b", '"': '"', "\\": "\\"}
+
+# https://git-scm.com/docs/index-format
+_INDEX_HEADER = struct.Struct(">4sLL")
+_INDEX_VERSIONS = frozenset({2, 3, 4})
+# From version 4, paths are prefix-compressed and entries aren't padded
+_INDEX_PREFIX_COMPRESSION_VERSION = 4
+# ctime, mtime, dev, ino, mode, uid, gid and size, before the object name
+_INDEX_STAT_SIZE = 40
+_INDEX_MODE = struct.Struct(">24xL")
+_INDEX_FLAGS = struct.Struct(">H")
+_INDEX_EXTENDED_FLAG = 0x4000
+_INDEX_SKIP_WORKTREE_FLAG = 0x4000
+_INDEX_EXTENSION_HEADER = struct.Struct(">4sL")
+# The shared index of a split index holds entries that aren't in this one
+_SPLIT_INDEX_EXTENSION = b"link"
+_GITLINK_MODE = 0o160000
+_HASH_SIZES = {"sha1": 20, "sha256": 32}
+
+
+class UnsupportedConfigError(Exception):
+    pass
+
+
+def _read_text(path: pathlib.Path) -> str | None:
+    try:
+        return path.read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _config_key(section: str, name: str) -> str:
+    # Sections and names are case-insensitive, subsections are not
+    section, dot, subsection = section.partition(".")
+    return f"{section.lower()}{dot}{subsection}.{name.lower()}"
+
+
+def _parse_config_section(line: str) -> tuple[str, str]:
+    header, _, rest = line[1:].partition("]")
+    if '"' in header:
+        section, _, subsection = header.partition(" ")
+        subsection = subsection.strip().removeprefix('"').removesuffix('"')
+        header = section + "." + subsection.replace('\\"', '"')
+    else:
+        # The deprecated `[section.subsection]` syntax is case-insensitive
+        header = header.lower()
+
+    return header.strip(), rest.strip()
+
+
+def _parse_config_value(value: str) -> str:
+    parsed = []
+    in_quotes = False
+    chars = iter(value.strip())
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, "")
+            parsed.append(_CONFIG_ESCAPES.get(escaped, escaped))
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif char in "#;" and not in_quotes:
+            break
+        else:
+            parsed.append(char)
+
+    return "".join(parsed).strip()
+
+
+def parse_config(text: str) -> ConfigValues:
+    """
+    Parse the contents of a git config file into a mapping of fully qualified
+    (``section.subsection.name``) keys to their values.
+
+    Raises ``UnsupportedConfigError`` for config that would need git itself
+    to interpret, such as includes.
+    """
+
+    values: ConfigValues = {}
+    section = ""
+    lines = iter(text.splitlines())
+    for raw_line in lines:
+        line = raw_line.strip()
+        while line.endswith("\\") and not line.endswith("\\\\"):
+            line = line[:-1] + next(lines, "").strip()
+        if not line or line[0] in "#;":
+            continue
+
+        if line.startswith("["):
+            section, line = _parse_config_section(line)
+            if section.split(".")[0] in {"include", "includeif"}:
+                raise UnsupportedConfigError(section)
+            if not line:
+                continue
+
+        name, eq, value = line.partition("=")
+        value = _parse_config_value(value) if eq else "true"
+        values.setdefault(_config_key(section, name.strip()), []).append(value)
+
+    return values
+
+
+@functools.cache
+def _has_global_url_rewrites() -> bool:
+    """
+    Whether the global git config rewrites URLs, which would make the URLs
+    in the repository config differ from what git reports.
+    """
+
+    global_configs = [
+        os.environ.get("GIT_CONFIG_GLOBAL", HOME / ".gitconfig"),
+        CONFIG_HOME / "git" / "config",
+    ]
+    return any(
+        "insteadof" in (_read_text(pathlib.Path(path)) or "").lower()
+        for path in global_configs
+    )
+
+
+def _read_varint(data: bytes, offset: int) -> tuple[int, int]:
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+
+    return value, offset
+
+
+def parse_index(data: bytes, hash_size: int = 20) -> list[bytes] | None:
+    """
+    Return the paths of the entries of a git index (versions 2 to 4) that
+    are checked out, as the bytes that git stores, in the index's (sorted)
+    order, or ``None`` if the index has entries that aren't plain files
+    (submodules) or that are kept elsewhere (a split index).
+
+    https://git-scm.com/docs/index-format
+    """
+
+    signature, version, count = _INDEX_HEADER.unpack_from(data)
+    if signature != b"DIRC" or version not in _INDEX_VERSIONS:
+        return None
+
+    paths = []
+    path = b""
+    offset = _INDEX_HEADER.size
+    for _ in range(count):
+        start = offset
+        (mode,) = _INDEX_MODE.unpack_from(data, offset)
+        offset += _INDEX_STAT_SIZE + hash_size
+        (flags,) = _INDEX_FLAGS.unpack_from(data, offset)
+        offset += _INDEX_FLAGS.size
+        skip_worktree = False
+        if flags & _INDEX_EXTENDED_FLAG:
+            (extended_flags,) = _INDEX_FLAGS.unpack_from(data, offset)
+            offset += _INDEX_FLAGS.size
+            skip_worktree = bool(extended_flags & _INDEX_SKIP_WORKTREE_FLAG)
+
+        if version >= _INDEX_PREFIX_COMPRESSION_VERSION:
+            strip, offset = _read_varint(data, offset)
+            if strip > len(path):
+                return None
+            end = data.index(b"\0", offset)
+            path = path[: len(path) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            # The entry is padded with 1-8 NULs to a multiple of 8 bytes
+            end = data.index(b"\0", offset)
+            path = data[offset:end]
+            offset = start + (end - start + 8) // 8 * 8
+
+        if mode == _GITLINK_MODE:
+            return None
+        # Conflicted paths have an entry for each stage
+        if not skip_worktree and (not paths or paths[-1] != path):
+            paths.append(path)
+
+    while offset + _INDEX_EXTENSION_HEADER.size <= len(data) - hash_size:
+        extension, size = _INDEX_EXTENSION_HEADER.unpack_from(data, offset)
+        if extension == _SPLIT_INDEX_EXTENSION:
+            return None
+        offset += _INDEX_EXTENSION_HEADER.size + size
+
+    return paths
+
+
+class GitMetadata:
+    """
+    Lazily read the metadata of the git repository with the given worktree
+    straight from its files, without spawning git.
+
+    Anything that can't be answered with confidence is ``None`` so that the
+    caller can fall back to asking git.
+
+    https://git-scm.com/docs/gitrepository-layout
+    """
+
+    def __init__(self, repo_dir: pathlib.Path) -> None:
+        self.repo_dir = repo_dir
+
+    @functools.cached_property
+    def git_dir(self) -> pathlib.Path | None:
+        """
+        The git directory for this worktree, following ``.git`` files.
+        """
+
+        dot_git = self.repo_dir / ".git"
+        if dot_git.is_dir():
+            return dot_git
+
+        text = _read_text(dot_git)
+        if text is None or not text.startswith(_GITDIR_PREFIX):
+            return None
+
+        return self.repo_dir / text.removeprefix(_GITDIR_PREFIX).strip()
+
+    @functools.cached_property
+    def common_dir(self) -> pathlib.Path | None:
+        """
+        The git directory shared by all worktrees of this repository.
+        """
+
+        if self.git_dir is None:
+            return None
+        if (common_dir := _read_text(self.git_dir / "commondir")) is None:
+            return self.git_dir
+
+        return self.git_dir / common_dir.strip()
+
+    @functools.cached_property
+    def config(self) -> ConfigValues | None:
+        if self.common_dir is None:
+            return None
+        if (text := _read_text(self.common_dir / "config")) is None:
+            return None
+
+        try:
+            config = parse_config(text)
+        except UnsupportedConfigError:
+            return None
+
+        # Only the files backend is readable without git
+        if config.get("extensions.refstorage", ["files"])[-1] != "files":
+            return None
+
+        return config
+
+    def get_config(self, key: str) -> str | None:
+        """
+        Return the last value of the config key, like ``git config get``.
+        """
+
+        if self.config is None:
+            return None
+        if values := self.config.get(key):
+            return values[-1]
+
+        return None
+
+    @functools.cached_property
+    def packed_refs(self) -> dict[str, str]:
+        if self.common_dir is None:
+            return {}
+
+        packed_refs = {}
+        text = _read_text(self.common_dir / "packed-refs") or ""
+        for line in text.splitlines():
+            if not line or line[0] in "#^":
+                continue
+            sha, _, ref = line.partition(" ")
+            packed_refs[ref] = sha
+
+        return packed_refs
+
+    def resolve_ref(self, ref: str) -> str | None:
+        """
+        Return the commit SHA that the ref points at, following symbolic refs.
+        """
+
+        if self.common_dir is None or self.config is None:
+            return None
+
+        for _ in range(_MAX_SYMREF_DEPTH):
+            loose_ref = _read_text(self.common_dir / ref)
+            if loose_ref is None:
+                return self.packed_refs.get(ref)
+
+            loose_ref = loose_ref.strip()
+            if not loose_ref.startswith(_HEAD_REF_PREFIX):
+                return loose_ref or None
+            ref = loose_ref.removeprefix(_HEAD_REF_PREFIX)
+
+        return None
+
+    @functools.cached_property
+    def head(self) -> str | None:
+        """
+        The contents of ``HEAD``: either a ``ref: <ref>`` line or a SHA.
+        """
+
+        if self.git_dir is None or self.config is None:
+            return None
+
+        return (_read_text(self.git_dir / "HEAD") or "").strip() or None
+
+    @property
+    def current_branch(self) -> str | None:
+        """
+        The checked-out branch, or ``None`` if the HEAD is detached or unknown.
+        """
+
+        if self.head is None or not self.head.startswith(_HEAD_REF_PREFIX):
+            return None
+
+        ref = self.head.removeprefix(_HEAD_REF_PREFIX)
+        return ref.removeprefix("refs/heads/")
+
+    def remote_head_branch(self, remote: str = "origin") -> str | None:
+        """
+        The remote's default branch, as recorded by ``git clone`` (or
+        ``git remote set-head``) in ``refs/remotes/<remote>/HEAD``.
+        """
+
+        if self.common_dir is None or self.config is None:
+            return None
+
+        prefix = f"{_HEAD_REF_PREFIX}refs/remotes/{remote}/"
+        text = _read_text(
+            self.common_dir / "refs" / "remotes" / remote / "HEAD"
+        )
+        if text is None or not text.startswith(prefix):
+            return None
+
+        return text.removeprefix(prefix).strip() or None
+
+    @property
+    def head_sha(self) -> str | None:
+        if self.head is None:
+            return None
+        if not self.head.startswith(_HEAD_REF_PREFIX):
+            return self.head
+
+        return self.resolve_ref(self.head.removeprefix(_HEAD_REF_PREFIX))
+
+    @property
+    def local_branches(self) -> list[str] | None:
+        """
+        The names of the local branches, like ``git branch --list``.
+        """
+
+        if self.common_dir is None or self.config is None:
+            return None
+
+        heads_dir = self.common_dir / "refs" / "heads"
+        branches = {
+            ref.removeprefix("refs/heads/")
+            for ref in self.packed_refs
+            if ref.startswith("refs/heads/")
+        }
+        for dirpath, _, filenames in os.walk(heads_dir):
+            branches.update(
+                (pathlib.Path(dirpath) / filename)
+                .relative_to(heads_dir)
+                .as_posix()
+                for filename in filenames
+                if not filename.endswith(".lock")
+            )
+
+        return sorted(branches)
+
+    def remote_url(self, remote: str = "origin") -> str | None:
+        """
+        The URL of the remote, like ``git remote get-url``.
+        """
+
+        if _has_global_url_rewrites() or self.config is None:
+            return None
+        if any("insteadof" in key for key in self.config):
+            return None
+
+        return self.get_config(f"remote.{remote}.url")
+
+    def upstream_ref(self, branch: str) -> str | None:
+        """
+        The remote-tracking ref of the branch's upstream, if it has one.
+        """
+
+        remote = self.get_config(f"branch.{branch}.remote")
+        merge = self.get_config(f"branch.{branch}.merge")
+        if remote is None or merge is None:
+            return None
+        if remote == ".":
+            return merge
+
+        for refspec in (self.config or {}).get(f"remote.{remote}.fetch", []):
+            src, _, dst = refspec.removeprefix("+").partition(":")
+            if src == merge:
+                return dst
+            prefix, star, suffix = src.partition("*")
+            if star and merge.startswith(prefix) and merge.endswith(suffix):
+                glob = merge.removeprefix(prefix).removesuffix(suffix)
+                return dst.replace("*", glob, 1)
+
+        return None
+
+    @functools.cached_property
+    def tracked_paths(self) -> list[bytes] | None:
+        """
+        The paths of the files checked out from the index (see
+        ``parse_index``), relative to the worktree.
+        """
+
+        if self.git_dir is None or self.config is None:
+            return None
+        object_format = self.get_config("extensions.objectformat") or "sha1"
+        if (hash_size := _HASH_SIZES.get(object_format.lower())) is None:
+            return None
+
+        try:
+            data = (self.git_dir / "index").read_bytes()
+        except FileNotFoundError:
+            return []  # nothing has been added yet
+        except OSError:
+            return None
+
+        try:
+            return parse_index(data, hash_size)
+        except (struct.error, ValueError, IndexError):
+            return None
+
+    def tracked_refs(self, remote: str = "origin") -> dict[str, str]:
+        """
+        The refs on the remote that local branches track, mapped to their
+        remote-tracking refs.
+        """
+
+        tracked_refs = {}
+        for branch in self.local_branches or []:
+            if self.get_config(f"branch.{branch}.remote") != remote:
+                continue
+            merge = self.get_config(f"branch.{branch}.merge")
+            if merge and (upstream := self.upstream_ref(branch)):
+                tracked_refs[merge] = upstream
+
+        return tracked_refs
+
+    @property
+    def fetch_head_mtime(self) -> float | None:
+        """
+        When the repository was last fetched, if it has ever been fetched.
+        """
+
+        mtimes = []
+        for git_dir in (self.git_dir, self.common_dir):
+            if git_dir is None:
+                continue
+            try:
+                mtimes.append((git_dir / "FETCH_HEAD").stat().st_mtime)
+            except OSError:
+                continue
+
+        return max(mtimes, default=None)
@@ -0,0 +1,176 @@
+"""
+Remember how long each repository takes, to start the slowest ones first
+(longest processing time first, LPT) so they don't hold up the end of a run.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import pathlib
+import statistics
+from collections.abc import AsyncIterator, Iterable
+from typing import Literal
+
+from git_meta.constants import PROGRAM, STATE_HOME
+
+DEFAULT_DURATIONS_FILEPATH = STATE_HOME / PROGRAM / "durations.json"
+DEFAULT_MAX_ENTRIES = 10_000
+# The estimate for a repository that's never been timed, in seconds, when no
+# repository has been
+DEFAULT_ESTIMATE = 1.0
+# How much each new duration counts towards a repository's estimate
+_SMOOTHING = 0.5
+
+type Schedule = Literal["path", "lpt"]
+SCHEDULES: tuple[Schedule, ...] = ("path", "lpt")
+
+# What's timed in each repository
+type Kind = Literal["fetch", "status", "update"]
+
+
+class Durations:
+    """
+    How long each step (like fetching) takes in each repository, keyed by
+    its path, as exponentially weighted moving averages.
+    """
+
+    def __init__(
+        self,
+        filepath: pathlib.Path | None = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.filepath = (
+            filepath if filepath is not None else DEFAULT_DURATIONS_FILEPATH
+        )
+        self.max_entries = max_entries
+        self.entries: dict[str, dict[str, float]] = {}
+        self._observed: set[str] = set()
+        self._typical: dict[Kind, float] = {}
+
+    @classmethod
+    def load(
+        cls,
+        filepath: pathlib.Path | None = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> Durations:
+        durations = cls(filepath=filepath, max_entries=max_entries)
+        try:
+            with open(durations.filepath) as f:
+                doc = json.load(f)
+            durations.entries = {
+                repo: {kind: float(seconds) for kind, seconds in entry.items()}
+                for repo, entry in doc.get("entries", {}).items()
+            }
+        except (OSError, ValueError, TypeError, AttributeError):
+            # Missing or corrupt durations just mean default estimates
+            durations.entries = {}
+
+        return durations
+
+    def save(self) -> None:
+        """
+        Write the durations, keeping the entries that other processes (like
+        the other shards of a report) have saved since they were loaded.
+        """
+
+        entries = Durations.load(self.filepath, self.max_entries).entries
+        for repo, entry in self.entries.items():
+            if repo in self._observed:
+                entries.pop(repo, None)
+                entries[repo] = entry  # the newest go last
+        # Dicts keep their insertion order, so the oldest entries go first
+        for repo in list(entries)[: max(0, len(entries) - self.max_entries)]:
+            del entries[repo]
+
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        _tmp_path = self.filepath.with_suffix(f".{os.getpid()}.tmp")
+        with open(_tmp_path, "w+") as f:
+            json.dump({"entries": entries}, f)
+
+        os.replace(_tmp_path, self.filepath)
+
+    def observe(
+        self, repo_dir: pathlib.Path, kind: Kind, seconds: float
+    ) -> None:
+        repo = str(repo_dir)
+        entry = self.entries.pop(repo, {})
+        previous = entry.get(kind)
+        entry[kind] = (
+            seconds
+            if previous is None
+            else _SMOOTHING * seconds + (1 - _SMOOTHING) * previous
+        )
+        self.entries[repo] = entry  # moved to the end, as the newest
+        self._observed.add(repo)
+
+    def estimate(self, repo_dir: pathlib.Path, kinds: Iterable[Kind]) -> float:
+        """
+        Return how long the steps are expected to take in the repository.
+
+        A step that's never been timed in the repository is expected to take
+        as long as it did in the median repository when it was first asked
+        for (so that estimating every repository isn't quadratic).
+        """
+
+        entry = self.entries.get(str(repo_dir), {})
+        return sum(
+            entry[kind] if kind in entry else self.typical(kind)
+            for kind in kinds
+        )
+
+    def typical(self, kind: Kind) -> float:
+        if kind not in self._typical:
+            seconds = [
+                entry[kind] for entry in self.entries.values() if kind in entry
+            ]
+            self._typical[kind] = (
+                statistics.median(seconds) if seconds else DEFAULT_ESTIMATE
+            )
+        return self._typical[kind]
+
+
+class PrioritySemaphore:
+    """
+    A semaphore that's released to the waiter with the highest priority
+    first, then to the one that's been waiting longest.
+    """
+
+    def __init__(self, value: int) -> None:
+        self._value = value
+        self._waiters: list[tuple[float, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+
+    async def _acquire(self, priority: float) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._counter), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()  # it was handed the slot, so pass it on
+            raise
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)  # the slot is handed straight over
+                return
+        self._value += 1
+
+    @contextlib.asynccontextmanager
+    async def acquiring(self, priority: float) -> AsyncIterator[None]:
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
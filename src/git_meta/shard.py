@@ -0,0 +1,90 @@
+"""
+Split the repositories between shards, so that a report can be spread
+across several processes or machines and the results merged afterwards.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+import pathlib
+from collections.abc import Iterable
+from typing import TextIO
+
+from git_meta.status import RepoState, UpdateState
+
+
+def shard_of(repo_dir: pathlib.Path, root: pathlib.Path, count: int) -> int:
+    """
+    Return which of ``count`` shards (counting from zero) the repository
+    belongs to.
+
+    The path is hashed relative to the root directory so that machines
+    with the same layout under different roots agree on the shards, and
+    with a hash that (unlike ``hash()``) is the same in every process.
+    """
+
+    if repo_dir.is_relative_to(root):
+        key = repo_dir.relative_to(root).as_posix()
+    else:
+        key = repo_dir.as_posix()
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest) % count
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """
+    The ``index``-th of ``count`` shards, counting from one like ``1/4``.
+    """
+
+    index: int
+    count: int
+
+    def __post_init__(self) -> None:
+        if not 1 <= self.index <= self.count:
+            raise ValueError(f"Invalid shard: {self}")
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    @classmethod
+    def parse(cls, text: str) -> Shard:
+        index, sep, count = text.partition("/")
+        if not sep:
+            raise ValueError(f"Shards look like 1/4, not {text!r}")
+
+        return cls(index=int(index), count=int(count))
+
+    def contains(self, repo_dir: pathlib.Path, root: pathlib.Path) -> bool:
+        return shard_of(repo_dir, root, self.count) == self.index - 1
+
+
+def write_result(state: RepoState | UpdateState, f: TextIO) -> None:
+    """
+    Write the full state as a line of JSON, for ``load_results`` (which
+    reads the states of reports).
+    """
+
+    f.write(json.dumps(state.to_json()) + "\n")
+    f.flush()
+
+
+def load_results(filepaths: Iterable[pathlib.Path]) -> list[RepoState]:
+    """
+    Return the states from the results files of the shards, sorted by their
+    repositories. If a repository is in more than one file, the last one
+    wins.
+    """
+
+    states: dict[str, RepoState] = {}
+    for filepath in filepaths:
+        with open(filepath) as f:
+            for line in f:
+                if line.strip():
+                    state = RepoState.from_json(json.loads(line))
+                    states[state.repo_dir] = state
+
+    return sorted(states.values(), key=lambda state: state.repo_dir)
@@ -0,0 +1,433 @@
+from __future__ import annotations
+
+import dataclasses
+import enum
+
+STATUS_ARGS = ("status", "--porcelain=v2", "--branch", "-z")
+# For when scanning for untracked files takes too long
+PARTIAL_STATUS_ARGS = (*STATUS_ARGS, "--untracked-files=no")
+# Every local branch and how it compares to its upstream, in one process
+BRANCHES_ARGS = (
+    "for-each-ref",
+    "--format=%(HEAD)%00%(refname:short)%00%(upstream:short)%00"
+    "%(upstream:track,nobracket)",
+    "refs/heads",
+)
+
+
+class RepoStatus(enum.Flag):
+    CLEAN_AND_UPDATED = 0
+    UNTRACKED_FILES = enum.auto()
+    BEHIND_REMOTE = enum.auto()
+    AHEAD_OF_REMOTE = enum.auto()
+    MULTIPLE_BRANCHES = enum.auto()
+    STAGED_CHANGES = enum.auto()
+    DIRTY = enum.auto()
+    CONFLICTS = enum.auto()
+    UNKNOWN = enum.auto()
+    PARTIAL = enum.auto()  # untracked files weren't checked
+    # Only checked with branches, for the branches other than the current one
+    BRANCHES_AHEAD = enum.auto()
+    BRANCHES_BEHIND = enum.auto()  # or their upstreams are gone
+
+    def __str__(self) -> str:
+        if not self:
+            return "clean_and_updated"
+        return ", ".join(str(flag.name).lower() for flag in self)
+
+
+@dataclasses.dataclass
+class GitStatus:
+    """
+    The structured output of ``git status --porcelain=v2 --branch``.
+
+    The path lists can be cut short (see ``PorcelainV2Parser``), so the
+    counts are the number of paths there really are in each category.
+    """
+
+    oid: str | None = None
+    branch: str | None = None  # None when the HEAD is detached
+    upstream: str | None = None
+    ahead: int = 0
+    behind: int = 0
+    staged: list[str] = dataclasses.field(default_factory=list)
+    unstaged: list[str] = dataclasses.field(default_factory=list)
+    untracked: list[str] = dataclasses.field(default_factory=list)
+    conflicted: list[str] = dataclasses.field(default_factory=list)
+    staged_count: int = 0
+    unstaged_count: int = 0
+    untracked_count: int = 0
+    conflicted_count: int = 0
+
+    def __post_init__(self) -> None:
+        # Statuses built from (or cached with) only the lists are complete
+        self.staged_count = max(self.staged_count, len(self.staged))
+        self.unstaged_count = max(self.unstaged_count, len(self.unstaged))
+        self.untracked_count = max(self.untracked_count, len(self.untracked))
+        self.conflicted_count = max(self.conflicted_count, len(self.conflicted))
+
+    @property
+    def flags(self) -> RepoStatus:
+        """
+        The repository status flags that can be derived from the status alone.
+        """
+
+        flags = RepoStatus.CLEAN_AND_UPDATED
+        if self.untracked_count:
+            flags |= RepoStatus.UNTRACKED_FILES
+        if self.behind:
+            flags |= RepoStatus.BEHIND_REMOTE
+        if self.ahead:
+            flags |= RepoStatus.AHEAD_OF_REMOTE
+        if self.staged_count:
+            flags |= RepoStatus.STAGED_CHANGES
+        if self.unstaged_count:
+            flags |= RepoStatus.DIRTY
+        if self.conflicted_count:
+            flags |= RepoStatus.CONFLICTS
+
+        return flags
+
+    def has_paths(self, max_paths: int | None) -> bool:
+        """
+        Whether the status has as many of its paths as ``max_paths`` would
+        keep (all of them, if it's ``None``).
+        """
+
+        return all(
+            len(paths)
+            >= (count if max_paths is None else min(count, max_paths))
+            for paths, count in (
+                (self.staged, self.staged_count),
+                (self.unstaged, self.unstaged_count),
+                (self.untracked, self.untracked_count),
+                (self.conflicted, self.conflicted_count),
+            )
+        )
+
+
+def _parse_header(status: GitStatus, header: str) -> None:
+    key, _, value = header.partition(" ")
+    match key:
+        case "branch.oid":
+            status.oid = None if value == "(initial)" else value
+        case "branch.head":
+            status.branch = None if value == "(detached)" else value
+        case "branch.upstream":
+            status.upstream = value
+        case "branch.ab":
+            ahead, behind = value.split(" ")
+            status.ahead = int(ahead.lstrip("+"))
+            status.behind = int(behind.lstrip("-"))
+
+
+class PorcelainV2Parser:
+    """
+    Parse the NUL-separated output of ``git status --porcelain=v2 --branch -z``
+    as it's fed in, in chunks of any size.
+
+    Only the first ``max_paths`` paths of each category are kept (all of
+    them if it's ``None``), while all of them are counted, so the memory
+    used doesn't grow with the size of the worktree.
+
+    https://git-scm.com/docs/git-status#_porcelain_format_version_2
+    """
+
+    def __init__(self, max_paths: int | None = None) -> None:
+        self.max_paths = max_paths
+        self.status = GitStatus()
+        self._partial_entry = b""
+        self._skip_entry = False
+
+    def _add_path(self, paths: list[str], path: str) -> None:
+        if self.max_paths is None or len(paths) < self.max_paths:
+            paths.append(path)
+
+    def _add_changed_entry(self, xy: str, path: str) -> None:
+        staged, unstaged = xy
+        if staged != ".":
+            self.status.staged_count += 1
+            self._add_path(self.status.staged, path)
+        if unstaged != ".":
+            self.status.unstaged_count += 1
+            self._add_path(self.status.unstaged, path)
+
+    def _parse_entry(self, entry: str) -> None:
+        if self._skip_entry:
+            self._skip_entry = False
+            return
+
+        kind, _, rest = entry.partition(" ")
+        match kind:
+            case "#":
+                _parse_header(self.status, rest)
+            case "1":
+                # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+                fields = rest.split(" ", 7)
+                self._add_changed_entry(fields[0], fields[7])
+            case "2":
+                # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>
+                # ...followed by the original path as its own entry
+                fields = rest.split(" ", 8)
+                self._add_changed_entry(fields[0], fields[8])
+                self._skip_entry = True
+            case "u":
+                # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+                self.status.conflicted_count += 1
+                self._add_path(self.status.conflicted, rest.split(" ", 9)[9])
+            case "?":
+                self.status.untracked_count += 1
+                self._add_path(self.status.untracked, rest)
+
+    def feed(self, chunk: bytes) -> None:
+        *entries, self._partial_entry = (self._partial_entry + chunk).split(
+            b"\0"
+        )
+        for entry in entries:
+            self._parse_entry(entry.decode(errors="replace"))
+
+    def close(self) -> GitStatus:
+        """
+        Parse whatever is left and return the status.
+        """
+
+        if self._partial_entry:
+            self._parse_entry(self._partial_entry.decode(errors="replace"))
+            self._partial_entry = b""
+
+        return self.status
+
+
+def parse_porcelain_v2(output: str, max_paths: int | None = None) -> GitStatus:
+    """
+    Parse the NUL-separated output of ``git status --porcelain=v2 --branch -z``.
+    """
+
+    parser = PorcelainV2Parser(max_paths)
+    parser.feed(output.encode())
+    return parser.close()
+
+
+@dataclasses.dataclass
+class BranchStatus:
+    """
+    A local branch and how it compares to its upstream.
+    """
+
+    name: str
+    upstream: str | None = None
+    ahead: int = 0
+    behind: int = 0
+    gone: bool = False  # the upstream branch has been deleted
+    current: bool = False
+
+    @property
+    def flags(self) -> RepoStatus:
+        flags = RepoStatus.CLEAN_AND_UPDATED
+        if self.current:
+            return flags  # already reported by the status
+        if self.ahead:
+            flags |= RepoStatus.BRANCHES_AHEAD
+        if self.behind or self.gone:
+            flags |= RepoStatus.BRANCHES_BEHIND
+
+        return flags
+
+    def describe(self) -> str:
+        if self.upstream is None:
+            return "no upstream"
+        if self.gone:
+            return f"{self.upstream} is gone"
+        if self.ahead or self.behind:
+            return (
+                f"ahead {self.ahead}, behind {self.behind} of {self.upstream}"
+            )
+        return f"up to date with {self.upstream}"
+
+
+def parse_branches(output: str) -> list[BranchStatus]:
+    """
+    Parse the output of ``git for-each-ref`` with ``BRANCHES_ARGS``.
+
+    https://git-scm.com/docs/git-for-each-ref#_field_names
+    """
+
+    branches = []
+    for line in output.splitlines():
+        if not line:
+            continue
+        head, name, upstream, track = line.split("\0")
+        branch = BranchStatus(
+            name=name,
+            upstream=upstream or None,
+            gone=track == "gone",
+            current=head == "*",
+        )
+        # Like "ahead 1, behind 2", or just one of them
+        for part in track.split(", "):
+            direction, _, count = part.partition(" ")
+            if direction == "ahead":
+                branch.ahead = int(count)
+            elif direction == "behind":
+                branch.behind = int(count)
+        branches.append(branch)
+
+    return branches
+
+
+def format_branches(branches: list[BranchStatus]) -> str:
+    """
+    Return a human-readable list of the branches that aren't up to date
+    with their upstreams.
+    """
+
+    lines = [
+        f"\t{'*' if branch.current else ' '} {branch.name}: {branch.describe()}"
+        for branch in branches
+        if branch.upstream is None
+        or branch.gone
+        or branch.ahead
+        or branch.behind
+    ]
+    return "\n".join(["Branches:", *lines]) if lines else ""
+
+
+def format_status(status: GitStatus) -> str:
+    """
+    Return a human-readable summary of the status.
+    """
+
+    lines = [f"On branch {status.branch or '(detached HEAD)'}"]
+    if status.upstream:
+        tracking = f"Tracking {status.upstream}"
+        if status.ahead or status.behind:
+            tracking += f" (ahead {status.ahead}, behind {status.behind})"
+        lines.append(tracking)
+
+    sections = [
+        ("Unmerged paths", status.conflicted, status.conflicted_count),
+        ("Changes to be committed", status.staged, status.staged_count),
+        (
+            "Changes not staged for commit",
+            status.unstaged,
+            status.unstaged_count,
+        ),
+        ("Untracked files", status.untracked, status.untracked_count),
+    ]
+    for title, paths, count in sections:
+        if count:
+            lines.extend(["", f"{title}:", *(f"\t{path}" for path in paths)])
+        if count > len(paths):
+            lines.append(f"\t...and {count - len(paths)} more")
+
+    if not any(count for _, _, count in sections):
+        lines.extend(["", "nothing to commit, working tree clean"])
+
+    return "\n".join(lines)
+
+
+@dataclasses.dataclass
+class RepoState:
+    """
+    Everything that's reported about a repository.
+    """
+
+    repo_dir: str
+    remote_url: str = ""
+    status: GitStatus | None = None
+    flags: RepoStatus = RepoStatus.UNKNOWN
+    error: str = ""
+    duration: float | None = None  # seconds, including any fetch
+    branches: list[BranchStatus] | None = None  # None when not checked
+
+    @classmethod
+    def from_json(cls, doc: dict) -> RepoState:
+        status = doc.get("status")
+        branches = doc.get("branches")
+        return cls(
+            repo_dir=doc["repo_dir"],
+            remote_url=doc.get("remote_url", ""),
+            status=GitStatus(**status) if status is not None else None,
+            flags=RepoStatus(doc.get("flags", RepoStatus.UNKNOWN.value)),
+            error=doc.get("error", ""),
+            duration=doc.get("duration"),
+            branches=(
+                [BranchStatus(**branch) for branch in branches]
+                if branches is not None
+                else None
+            ),
+        )
+
+    def to_json(self) -> dict:
+        return {**dataclasses.asdict(self), "flags": self.flags.value}
+
+    def to_record(self) -> dict:
+        """
+        Return the state as a flat record for other tools to consume, with
+        counts of the changed paths rather than the paths themselves.
+        """
+
+        status = self.status if self.status is not None else GitStatus()
+        return {
+            "path": self.repo_dir,
+            "remote": self.remote_url or None,
+            "branch": status.branch,
+            "upstream": status.upstream,
+            "ahead": status.ahead,
+            "behind": status.behind,
+            "staged": status.staged_count,
+            "unstaged": status.unstaged_count,
+            "untracked": status.untracked_count,
+            "conflicted": status.conflicted_count,
+            "flags": [str(flag.name).lower() for flag in self.flags],
+            "duration": self.duration,
+            "error": self.error or None,
+            **(
+                {
+                    "branches": [
+                        dataclasses.asdict(branch) for branch in self.branches
+                    ]
+                }
+                if self.branches is not None
+                else {}
+            ),
+        }
+
+
+@dataclasses.dataclass
+class UpdateState:
+    """
+    What updating a repository's default branch did.
+    """
+
+    repo_dir: str
+    branch: str = ""
+    old_sha: str = ""
+    new_sha: str = ""
+    commits: int = 0  # how many commits the branch was fast-forwarded by
+    rc: int = -1  # -1 when there was nothing to fast-forward
+    error: str = ""
+    duration: float | None = None  # seconds, including any fetch
+
+    @classmethod
+    def from_json(cls, doc: dict) -> UpdateState:
+        return cls(**doc)
+
+    def to_json(self) -> dict:
+        return dataclasses.asdict(self)
+
+    def to_record(self) -> dict:
+        """
+        Return the update as a flat record for other tools to consume.
+        """
+
+        return {
+            "path": self.repo_dir,
+            "branch": self.branch or None,
+            "old_sha": self.old_sha or None,
+            "new_sha": self.new_sha or None,
+            "commits": self.commits,
+            "rc": self.rc,
+            "error": self.error or None,
+            "duration": self.duration,
+        }
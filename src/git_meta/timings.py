@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import json
+import os
+import pathlib
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from typing import TextIO
+
+# The recorder that spans are added to, if timings are being recorded.
+# Tasks copy the context they're created in, so setting this before
+# starting a run covers every task (and git command) in it
+_RECORDER: contextvars.ContextVar[Recorder | None] = contextvars.ContextVar(
+    "recorder", default=None
+)
+
+DEFAULT_SUMMARY_LIMIT = 10
+# Commands whose first argument is itself a subcommand, like `remote get-url`
+_NESTED_COMMANDS = frozenset({"config", "remote", "stash", "worktree"})
+
+
+def _worker() -> str:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:  # no running event loop
+        task = None
+
+    return task.get_name() if task is not None else "main"
+
+
+@dataclasses.dataclass
+class Span:
+    """
+    A timed piece of work: either a git command (``category == "git"``) or
+    all the work on a repository (``category == "repo"``).
+
+    ``start`` is seconds since the epoch and ``duration`` is in seconds.
+    """
+
+    name: str
+    category: str
+    repo_dir: str | None
+    start: float
+    duration: float = 0.0
+    rc: int | None = None
+    pid: int = dataclasses.field(default_factory=os.getpid)
+    thread: int = dataclasses.field(default_factory=threading.get_ident)
+    worker: str = dataclasses.field(default_factory=_worker)
+
+    def to_json(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+class Recorder:
+    """
+    Collect the spans from a run, to export or summarise afterwards.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+
+    def to_ndjson(self, f: TextIO) -> None:
+        """
+        Write one JSON object per span.
+        """
+
+        for span in self.spans:
+            f.write(json.dumps(span.to_json()) + "\n")
+
+    def to_chrome_trace(self, f: TextIO) -> None:
+        """
+        Write the spans in the Chrome trace event format, which can be opened
+        with ``chrome://tracing`` or https://ui.perfetto.dev.
+
+        Each worker (asyncio task) gets its own track in its process's group,
+        so that the git commands for a repository nest under the repository's
+        span.
+        """
+
+        origin = min((span.start for span in self.spans), default=0.0)
+        # Task names are only unique within a process
+        workers: dict[tuple[int, str], int] = {}
+        events = []
+        for span in self.spans:
+            tid = workers.setdefault((span.pid, span.worker), len(workers) + 1)
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": (span.start - origin) * 1e6,
+                    "dur": span.duration * 1e6,
+                    "pid": span.pid,
+                    "tid": tid,
+                    "args": {"repo_dir": span.repo_dir, "rc": span.rc},
+                }
+            )
+        events.extend(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": worker},
+            }
+            for (pid, worker), tid in workers.items()
+        )
+        json.dump({"traceEvents": events}, f)
+
+    def export(self, filepath: pathlib.Path, format_: str = "ndjson") -> None:
+        with open(filepath, "w") as f:
+            if format_ == "chrome":
+                self.to_chrome_trace(f)
+            else:
+                self.to_ndjson(f)
+
+    def summary(self, limit: int = DEFAULT_SUMMARY_LIMIT) -> str:
+        """
+        Return the slowest repositories and the time spent in each git
+        command, slowest first.
+        """
+
+        repos = sorted(
+            (span for span in self.spans if span.category == "repo"),
+            key=lambda span: span.duration,
+            reverse=True,
+        )
+        commands: dict[str, list[float]] = collections.defaultdict(list)
+        for span in self.spans:
+            if span.category == "git":
+                commands[span.name].append(span.duration)
+
+        lines = [f"Slowest {min(limit, len(repos))} repositories:"]
+        lines.extend(
+            f"  {span.duration:8.3f}s  {span.repo_dir}"
+            for span in repos[:limit]
+        )
+        lines.append("Time spent in git commands:")
+        lines.extend(
+            f"  {sum(durations):8.3f}s  {name}"
+            f"  (count: {len(durations)}, max: {max(durations):.3f}s)"
+            for name, durations in sorted(
+                commands.items(), key=lambda item: sum(item[1]), reverse=True
+            )
+        )
+
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def recording(recorder: Recorder | None) -> Iterator[Recorder | None]:
+    """
+    Record spans into the recorder while in the context, unless it's
+    ``None``.
+    """
+
+    token = _RECORDER.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _RECORDER.reset(token)
+
+
+def current_recorder() -> Recorder | None:
+    """
+    Return the recorder that spans are being recorded into, if any.
+    """
+
+    return _RECORDER.get()
+
+
+@contextlib.contextmanager
+def span(
+    name: str,
+    category: str,
+    repo_dir: pathlib.Path | None = None,
+) -> Iterator[Span | None]:
+    """
+    Time the work in the context as a span, if timings are being recorded.
+
+    The caller can set the span's ``rc`` once it's known.
+    """
+
+    if (recorder := _RECORDER.get()) is None:
+        yield None
+        return
+
+    span_ = Span(
+        name=name,
+        category=category,
+        repo_dir=None if repo_dir is None else str(repo_dir),
+        start=time.time(),
+    )
+    start = time.perf_counter()
+    try:
+        yield span_
+    finally:
+        span_.duration = time.perf_counter() - start
+        recorder.spans.append(span_)
+
+
+def command_name(args: Sequence[str]) -> str:
+    """
+    Return the name to record a git command under, like ``git fetch`` or
+    ``git remote get-url``.
+    """
+
+    while args and args[0] == "-c":
+        args = args[2:]  # config overrides come before the command
+    depth = 2 if args and args[0] in _NESTED_COMMANDS else 1
+    return " ".join(["git", *args[:depth]])
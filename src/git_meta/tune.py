@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import dataclasses
+import pathlib
+import struct
+
+from git_meta import git
+from git_meta.metadata import GitMetadata
+
+# https://git-scm.com/docs/git-config and https://git-scm.com/docs/scalar
+ACCELERATORS: dict[str, dict[str, str]] = {
+    "untracked-cache": {"core.untrackedCache": "true"},
+    "fsmonitor": {"core.fsmonitor": "true"},
+    "many-files": {"feature.manyFiles": "true"},
+    "commit-graph": {
+        "core.commitGraph": "true",
+        "fetch.writeCommitGraph": "true",
+    },
+}
+# Worth the extra moving parts only in large worktrees
+LARGE_WORKTREE_ACCELERATORS = frozenset({"fsmonitor", "many-files"})
+DEFAULT_MIN_FILES = 10_000
+
+# https://git-scm.com/docs/index-format
+_INDEX_HEADER = struct.Struct(">4sLL")
+
+
+def index_entries(repo_dir: pathlib.Path) -> int | None:
+    """
+    Return the number of entries in the repository's index, read from its
+    header, or ``None`` if the index can't be read.
+    """
+
+    if (git_dir := GitMetadata(repo_dir).git_dir) is None:
+        return None
+    try:
+        with open(git_dir / "index", "rb") as f:
+            header = f.read(_INDEX_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < _INDEX_HEADER.size:
+        return None
+
+    signature, _, entries = _INDEX_HEADER.unpack(header)
+    return entries if signature == b"DIRC" else None
+
+
+async def fsmonitor_supported() -> bool:
+    """
+    Whether this git has the built-in fsmonitor daemon, which is only built
+    for macOS and Windows.
+    """
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("version", "--build-options")
+    )
+    return rc == 0 and "fsmonitor--daemon" in out
+
+
+async def _get_local_config(repo_dir: pathlib.Path, key: str) -> str | None:
+    metadata = GitMetadata(repo_dir)
+    if metadata.config is not None:
+        return metadata.get_config(key.lower())
+
+    rc, out, _ = await git.run_git_cmd_async(
+        args=("config", "--local", "--get", key),
+        git_dir=repo_dir,
+    )
+
+    return out if rc == 0 else None
+
+
+@dataclasses.dataclass
+class TuneResult:
+    """
+    The accelerators that were recommended for a repository and, if they
+    were applied, the previous values of the settings that were changed
+    (``None`` for settings that weren't set).
+    """
+
+    repo_dir: pathlib.Path
+    entries: int | None
+    recommended: list[str] = dataclasses.field(default_factory=list)
+    changed: dict[str, str | None] = dataclasses.field(default_factory=dict)
+    error: str = ""
+
+
+async def recommend(
+    repo_dir: pathlib.Path,
+    accelerators: frozenset[str] = frozenset(ACCELERATORS),
+    min_files: int = DEFAULT_MIN_FILES,
+    fsmonitor: bool | None = None,
+) -> TuneResult:
+    """
+    Return the accelerators that aren't enabled for the repository yet and
+    would be worth enabling.
+
+    Whether git supports the ``fsmonitor`` accelerator is asked of git
+    unless it's given, like when tuning many repositories at once.
+    """
+
+    result = TuneResult(repo_dir=repo_dir, entries=index_entries(repo_dir))
+    for name, settings in ACCELERATORS.items():
+        if name not in accelerators:
+            continue
+        if (
+            name in LARGE_WORKTREE_ACCELERATORS
+            and (result.entries or 0) < min_files
+        ):
+            continue
+        if name == "fsmonitor":
+            if fsmonitor is None:
+                fsmonitor = await fsmonitor_supported()
+            if not fsmonitor:
+                continue
+        current = {
+            key: await _get_local_config(repo_dir, key) for key in settings
+        }
+        if current != settings:
+            result.recommended.append(name)
+
+    return result
+
+
+async def apply(result: TuneResult) -> TuneResult:
+    """
+    Enable the recommended accelerators, recording what was changed.
+    """
+
+    for name in result.recommended:
+        for key, value in ACCELERATORS[name].items():
+            previous = await _get_local_config(result.repo_dir, key)
+            if previous == value:
+                continue
+            rc, _, err = await git.run_git_cmd_async(
+                args=("config", "--local", key, value),
+                git_dir=result.repo_dir,
+            )
+            if rc != 0:
+                result.error = err
+                return result
+            result.changed[key] = previous
+
+        if name == "commit-graph":
+            # Fetches keep it up to date from here on
+            rc, _, err = await git.run_git_cmd_async(
+                args=("commit-graph", "write", "--reachable"),
+                git_dir=result.repo_dir,
+            )
+            if rc != 0:
+                result.error = err
+                return result
+
+    return result
+
+
+async def revert(
+    repo_dir: pathlib.Path,
+    tuned: dict[str, str | None],
+) -> str:
+    """
+    Restore the settings that were changed by tuning, returning any error.
+    """
+
+    for key, previous in tuned.items():
+        args = (
+            ("config", "--local", "--unset", key)
+            if previous is None
+            else ("config", "--local", key, previous)
+        )
+        rc, _, err = await git.run_git_cmd_async(args=args, git_dir=repo_dir)
+        if rc not in {0, 5}:  # 5 is unsetting a key that isn't set
+            return err
+
+    return ""
@@ -0,0 +1,78 @@
+import pathlib
+import subprocess
+
+import pytest
+
+from git_meta import cache
+
+
+@pytest.fixture(autouse=True)
+def git_env(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """
+    Isolate git from the user's config and give it an identity to commit with.
+    """
+
+    env_vars = {
+        "GIT_CONFIG_GLOBAL": str(tmp_path / ".gitconfig"),
+        "GIT_CONFIG_NOSYSTEM": "1",
+        "GIT_AUTHOR_NAME": "git-meta",
+        "GIT_AUTHOR_EMAIL": "git-meta@example.com",
+        "GIT_COMMITTER_NAME": "git-meta",
+        "GIT_COMMITTER_EMAIL": "git-meta@example.com",
+    }
+    for env_var_name, env_var_value in env_vars.items():
+        monkeypatch.setenv(name=env_var_name, value=env_var_value)
+
+
+@pytest.fixture
+def no_racy_window(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Trust the fingerprints of repositories that were only just modified, as
+    the ones created by tests always are.
+    """
+
+    monkeypatch.setattr(cache, "_RACY_WINDOW_NS", 0)
+
+
+def git(*args: str | pathlib.Path, cwd: pathlib.Path | None = None) -> str:
+    """
+    Run a git command for setting up a test, failing loudly if it fails.
+    """
+
+    return subprocess.run(
+        args=("git", *map(str, args)),
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def make_repo(path: pathlib.Path, branch: str = "main") -> pathlib.Path:
+    """
+    Create a git repository with a single commit on the given branch.
+    """
+
+    git("init", "--quiet", "--initial-branch", branch, path)
+    (path / "README.md").write_text("# README\n")
+    git("add", "README.md", cwd=path)
+    git("commit", "--quiet", "--message", "Initial commit", cwd=path)
+
+    return path
+
+
+@pytest.fixture
+def remote_and_clone(
+    tmp_path: pathlib.Path,
+) -> tuple[pathlib.Path, pathlib.Path]:
+    """
+    A bare remote and a clone of it.
+    """
+
+    source = make_repo(tmp_path / "source")
+    remote = tmp_path / "remote.git"
+    git("clone", "--quiet", "--bare", source, remote)
+    clone = tmp_path / "clone"
+    git("clone", "--quiet", remote, clone)
+
+    return remote, clone
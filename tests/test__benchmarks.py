@@ -0,0 +1,55 @@
+import asyncio
+import pathlib
+
+import git_meta
+from benchmarks.farm import FarmSpec, make_farm
+from git_meta.status import RepoStatus
+from tests.conftest import git
+
+
+def test__make_farm(tmp_path: pathlib.Path):
+    """
+    The farm has the repositories that were asked for, with remotes that
+    are ahead of them.
+    """
+
+    spec = FarmSpec(
+        repos=3,
+        max_depth=2,
+        untracked_ratio=1,
+        dirty_ratio=0,
+        behind_ratio=1,
+        noise_dirs=2,
+        large_repos=0,
+    )
+    repos = make_farm(tmp_path, spec)
+
+    assert sorted(repos) == sorted(
+        git_meta.get_git_repos(
+            tmp_path / "workspace",
+            select="",
+            exclude="^$",
+            rescan=True,
+            index_filepath=tmp_path / "index.json",
+        )
+    )
+    for repo in repos:
+        git("fetch", "--quiet", cwd=repo)
+        state = asyncio.run(git_meta.get_repo_state(repo))
+        assert state.flags == (
+            RepoStatus.UNTRACKED_FILES | RepoStatus.BEHIND_REMOTE
+        )
+
+
+def test__make_farm__large_repos(tmp_path: pathlib.Path):
+    """
+    Large repositories are kept apart, clean and up to date.
+    """
+
+    spec = FarmSpec(repos=0, noise_dirs=0, large_repos=1, large_files=250)
+    (repo,) = make_farm(tmp_path, spec)
+
+    assert repo == tmp_path / "workspace" / "large" / "repo-0"
+    assert len(git("ls-files", cwd=repo).splitlines()) == 250
+    state = asyncio.run(git_meta.get_repo_state(repo))
+    assert state.flags == RepoStatus.CLEAN_AND_UPDATED
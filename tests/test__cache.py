@@ -0,0 +1,154 @@
+import os
+import pathlib
+import time
+
+import pytest
+
+from git_meta import cache
+from git_meta.status import GitStatus, RepoStatus
+from tests.conftest import git, make_repo
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__fingerprint__changes_with_the_repo_state(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    git("status", cwd=repo)  # refresh the index
+    before = cache.fingerprint(repo)
+
+    assert before is not None
+    assert cache.fingerprint(repo) == before
+
+    (repo / "new.txt").write_text("new\n")
+    after_new_file = cache.fingerprint(repo)
+    assert after_new_file != before
+
+    git("add", "new.txt", cwd=repo)
+    after_add = cache.fingerprint(repo)
+    assert after_add != after_new_file
+
+    git("commit", "--quiet", "--message", "Add file", cwd=repo)
+    assert cache.fingerprint(repo) != after_add
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__fingerprint__changes_with_the_worktree(tmp_path: pathlib.Path):
+    """
+    Edits that don't touch the git directory, like to a tracked file in a
+    subdirectory, change the fingerprint.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    (repo / "src" / "empty").mkdir(parents=True)
+    (repo / "src" / "module.py").write_text("a = 1\n")
+    git("add", "src", cwd=repo)
+    git("commit", "--quiet", "--message", "Add module", cwd=repo)
+    before = cache.fingerprint(repo)
+
+    assert before is not None
+    module = repo / "src" / "module.py"
+    mtime_ns = module.stat().st_mtime_ns
+    module.write_text("a = 2\n")  # the same size
+    os.utime(module, ns=(mtime_ns + 1, mtime_ns + 1))
+    after_edit = cache.fingerprint(repo)
+    assert after_edit not in (None, before)
+
+    (repo / "src" / "empty" / "new.txt").write_text("new\n")
+    assert cache.fingerprint(repo) not in (None, after_edit)
+
+
+def test__fingerprint__racy(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+
+    assert cache.fingerprint(repo) is None  # just created
+
+    hour_ago = time.time() - 60 * 60
+    for path in [repo, *repo.rglob("*")]:
+        os.utime(path, (hour_ago, hour_ago), follow_symlinks=False)
+    assert cache.fingerprint(repo) is not None
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__fingerprint__submodules(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    submodule = make_repo(tmp_path / "submodule")
+    git(
+        "-c",
+        "protocol.file.allow=always",
+        "submodule",
+        "add",
+        "--quiet",
+        submodule,
+        "submodule",
+        cwd=repo,
+    )
+
+    assert cache.fingerprint(repo) is None
+
+
+def test__fingerprint__not_a_repo(tmp_path: pathlib.Path):
+    assert cache.fingerprint(tmp_path) is None
+
+
+def test__report_cache__get_and_put(tmp_path: pathlib.Path):
+    report_cache = cache.ReportCache(filepath=tmp_path / "reports.json")
+    status = GitStatus(branch="main", untracked=["new.txt"])
+    flags = RepoStatus.UNTRACKED_FILES
+
+    report_cache.put(tmp_path, [1, 2], status, flags)
+
+    assert report_cache.get(tmp_path, [1, 2]) == (status, flags)
+    assert report_cache.get(tmp_path, [1, 3]) is None
+    assert report_cache.get(tmp_path / "other", [1, 2]) is None
+
+
+def test__report_cache__evicts_least_recently_used(tmp_path: pathlib.Path):
+    report_cache = cache.ReportCache(max_entries=2)
+    repos = [tmp_path / name for name in "abc"]
+    status = GitStatus()
+
+    report_cache.put(repos[0], [0], status, RepoStatus.CLEAN_AND_UPDATED)
+    report_cache.put(repos[1], [0], status, RepoStatus.CLEAN_AND_UPDATED)
+    report_cache.get(repos[0], [0])
+    report_cache.put(repos[2], [0], status, RepoStatus.CLEAN_AND_UPDATED)
+
+    assert list(report_cache.entries) == [str(repos[0]), str(repos[2])]
+
+
+def test__report_cache__save_and_load(tmp_path: pathlib.Path):
+    filepath = tmp_path / "cache" / "reports.json"
+    report_cache = cache.ReportCache(filepath=filepath)
+    report_cache.put(
+        tmp_path,
+        [1, 2],
+        GitStatus(branch="main", ahead=1, staged=["a"]),
+        RepoStatus.AHEAD_OF_REMOTE | RepoStatus.STAGED_CHANGES,
+    )
+    report_cache.save()
+
+    assert cache.ReportCache.load(filepath).entries == report_cache.entries
+
+    filepath.write_text("{not json")
+    assert not cache.ReportCache.load(filepath).entries
+
+
+def test__report_cache__save_keeps_other_processes_entries(
+    tmp_path: pathlib.Path,
+):
+    """
+    Caches loaded at the same time (like by the shards of a report) don't
+    overwrite each other's entries when they're saved.
+    """
+
+    filepath = tmp_path / "reports.json"
+    first = cache.ReportCache.load(filepath)
+    second = cache.ReportCache.load(filepath)
+    status, flags = GitStatus(), RepoStatus.CLEAN_AND_UPDATED
+    first.put(tmp_path / "a", [0], status, flags)
+    second.put(tmp_path / "b", [0], status, flags)
+    first.save()
+    second.save()
+
+    assert list(cache.ReportCache.load(filepath).entries) == [
+        str(tmp_path / "a"),
+        str(tmp_path / "b"),
+    ]
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import pathlib
+import shutil
+
+import pytest
+
+from git_meta import cache, cli, discovery, history, maintain, schedule
+from tests.conftest import git
+
+
+@pytest.fixture(autouse=True)
+def cache_files(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path):
+    cache_home = tmp_path / "cache"
+    monkeypatch.setattr(
+        discovery, "DEFAULT_INDEX_FILEPATH", cache_home / "discovery.json"
+    )
+    monkeypatch.setattr(
+        cache, "DEFAULT_CACHE_FILEPATH", cache_home / "reports.json"
+    )
+    monkeypatch.setattr(
+        history, "DEFAULT_HISTORY_FILEPATH", tmp_path / "history.sqlite3"
+    )
+    monkeypatch.setattr(
+        schedule, "DEFAULT_DURATIONS_FILEPATH", tmp_path / "durations.json"
+    )
+    monkeypatch.setattr(
+        maintain, "DEFAULT_STATE_FILEPATH", tmp_path / "maintenance.json"
+    )
+
+
+@pytest.fixture
+def behind_clone(
+    remote_and_clone: tuple[pathlib.Path, pathlib.Path],
+    tmp_path: pathlib.Path,
+) -> pathlib.Path:
+    """
+    A clone whose default branch is one commit behind its remote.
+    """
+
+    remote, clone = remote_and_clone
+    source = tmp_path / "source"
+    git("commit", "--quiet", "--allow-empty", "--message", "New", cwd=source)
+    git("push", "--quiet", remote, "main", cwd=source)
+
+    return clone
+
+
+def test__report(behind_clone: pathlib.Path, capsys: pytest.CaptureFixture):
+    rc = asyncio.run(cli.main(["report", str(behind_clone), "-q"]))
+    out = capsys.readouterr().out
+
+    assert rc == cli.SUCCESS
+    assert str(behind_clone) in out
+    assert "behind_remote" in out
+    assert "Found 1 git repositories" in out
+
+
+@pytest.mark.parametrize("format_", ["json", "ndjson"])
+def test__report__structured(
+    behind_clone: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+    format_: str,
+):
+    """
+    Structured output is only the records, without any ANSI colours.
+    """
+
+    rc = asyncio.run(
+        cli.main(["report", str(behind_clone), "--format", format_])
+    )
+    out = capsys.readouterr().out
+
+    if format_ == "json":
+        records = json.loads(out)
+    else:
+        records = [json.loads(line) for line in out.splitlines()]
+
+    assert rc == cli.SUCCESS
+    assert len(records) == 1
+    assert records[0]["path"] == str(behind_clone)
+    assert records[0]["branch"] == "main"
+    assert records[0]["behind"] == 1
+    assert records[0]["flags"] == ["behind_remote"]
+    assert records[0]["duration"] > 0
+    assert records[0]["error"] is None
+
+
+def test__report__branches(
+    behind_clone: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    git("branch", "--quiet", "--no-track", "local", cwd=behind_clone)
+
+    rc = asyncio.run(
+        cli.main(
+            ["report", str(behind_clone), "--branches", "--format", "ndjson"]
+        )
+    )
+    (record,) = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+
+    assert rc == cli.SUCCESS
+    assert [branch["name"] for branch in record["branches"]] == [
+        "local",
+        "main",
+    ]
+    assert record["branches"][0]["upstream"] is None
+    assert record["branches"][1]["behind"] == 1
+
+
+def test__report__shards_and_merge(
+    behind_clone: pathlib.Path,
+    tmp_path: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    """
+    Each repository is reported by exactly one shard, and merging the shards'
+    results gives the whole report.
+    """
+
+    root = tmp_path / "repos"
+    for name in ("a", "b", "c"):
+        shutil.copytree(behind_clone, root / name)
+    results = [tmp_path / f"{i}.ndjson" for i in (1, 2)]
+    for i, results_file in enumerate(results, start=1):
+        args = ["report", str(root), "--no-fetch", "--shard", f"{i}/2"]
+        rc = asyncio.run(cli.main([*args, "--results", str(results_file)]))
+        assert rc == cli.SUCCESS
+    capsys.readouterr()
+
+    rc = asyncio.run(
+        cli.main(["merge", *map(str, results), "--format", "ndjson"])
+    )
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+
+    assert rc == cli.SUCCESS
+    assert sum(len(f.read_text().splitlines()) for f in results) == 3
+    assert [record["path"] for record in records] == [
+        str(root / name) for name in ("a", "b", "c")
+    ]
+    assert all(record["branch"] == "main" for record in records)
+
+
+def test__report__changed_since_last(
+    behind_clone: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    args = ["report", str(behind_clone), "--no-fetch", "--changed-since-last"]
+
+    asyncio.run(cli.main(args))
+    first = capsys.readouterr().out
+    asyncio.run(cli.main(args))
+    second = capsys.readouterr().out
+    (behind_clone / "new.txt").write_text("")
+    asyncio.run(cli.main(args))
+    third = capsys.readouterr().out
+
+    assert "1 changed since the last report" in first
+    assert "0 changed since the last report" in second
+    assert second.count(str(behind_clone)) == 1  # only in the header
+    assert "new.txt" in third
+    assert "1 changed since the last report" in third
+
+
+def test__update(behind_clone: pathlib.Path, capsys: pytest.CaptureFixture):
+    rc = asyncio.run(cli.main(["update", str(behind_clone)]))
+    out = capsys.readouterr().out
+
+    assert rc == cli.SUCCESS
+    assert f"Updating {behind_clone}" in out
+    assert git("status", "--short", "--branch", cwd=behind_clone) == (
+        "## main...origin/main"
+    )
+
+
+def test__update__branch_not_checked_out(
+    behind_clone: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    """
+    The default branch is fast-forwarded even when another branch is
+    checked out, without the checked-out branch moving.
+    """
+
+    git("switch", "--quiet", "--create", "feature", cwd=behind_clone)
+    before = git("rev-parse", "feature", cwd=behind_clone)
+
+    rc = asyncio.run(cli.main(["update", str(behind_clone)]))
+    out = capsys.readouterr().out
+
+    assert rc == cli.SUCCESS
+    assert "Fast-forwarded main by 1 commit" in out
+    assert git("rev-parse", "main", cwd=behind_clone) == git(
+        "rev-parse", "origin/main", cwd=behind_clone
+    )
+    assert git("rev-parse", "feature", cwd=behind_clone) == before
+
+
+def test__update__no_second_network_call(
+    remote_and_clone: tuple[pathlib.Path, pathlib.Path],
+    behind_clone: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    """
+    Without fetching, the branch is fast-forwarded to what was already
+    fetched, so the remote isn't needed at all.
+    """
+
+    remote, _ = remote_and_clone
+    git("fetch", "--quiet", cwd=behind_clone)
+    shutil.rmtree(remote)
+
+    rc = asyncio.run(cli.main(["update", str(behind_clone), "--no-fetch"]))
+    out = capsys.readouterr().out
+
+    assert rc == cli.SUCCESS
+    assert "Fast-forwarded main by 1 commit" in out
+    assert git("status", "--short", "--branch", cwd=behind_clone) == (
+        "## main...origin/main"
+    )
+
+
+def test__update__diverged(
+    behind_clone: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    """
+    Branches that can't be fast-forwarded are left alone.
+    """
+
+    git("commit", "--quiet", "--allow-empty", "-m", "Local", cwd=behind_clone)
+    before = git("rev-parse", "main", cwd=behind_clone)
+
+    rc = asyncio.run(cli.main(["update", str(behind_clone)]))
+    out = capsys.readouterr().out
+
+    assert rc == cli.SUCCESS
+    assert "Fast-forwarded" not in out
+    assert git("rev-parse", "main", cwd=behind_clone) == before
+
+
+@pytest.mark.parametrize("format_", ["json", "ndjson"])
+def test__update__structured(
+    behind_clone: pathlib.Path,
+    tmp_path: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+    format_: str,
+):
+    """
+    Structured output is a record for every repository, with what its
+    default branch was moved from and to.
+    """
+
+    old = git("rev-parse", "main", cwd=behind_clone)
+    results = tmp_path / "results.ndjson"
+
+    rc = asyncio.run(
+        cli.main(
+            [
+                "update",
+                str(behind_clone),
+                "--format",
+                format_,
+                "--results",
+                str(results),
+            ]
+        )
+    )
+    out = capsys.readouterr().out
+
+    if format_ == "json":
+        records = json.loads(out)
+    else:
+        records = [json.loads(line) for line in out.splitlines()]
+
+    assert rc == cli.SUCCESS
+    assert records == [
+        {
+            "path": str(behind_clone),
+            "branch": "main",
+            "old_sha": old,
+            "new_sha": git("rev-parse", "main", cwd=behind_clone),
+            "commits": 1,
+            "rc": 0,
+            "error": None,
+            "duration": records[0]["duration"],
+        }
+    ]
+    assert records[0]["duration"] > 0
+    (result,) = results.read_text().splitlines()
+    assert json.loads(result)["new_sha"] == records[0]["new_sha"]
+
+
+def test__maintain(behind_clone: pathlib.Path, capsys: pytest.CaptureFixture):
+    rc = asyncio.run(cli.main(["maintain", str(behind_clone)]))
+    out = capsys.readouterr().out
+    rc_again = asyncio.run(cli.main(["maintain", str(behind_clone)]))
+    out_again = capsys.readouterr().out
+
+    assert rc == rc_again == cli.SUCCESS
+    assert "Ran loose-objects" in out
+    assert "commit-graph" in out
+    assert "Maintained 1 of them (skipped 0)" in out
+    assert "Maintained 0 of them (skipped 1)" in out_again
+    assert "rev-list" not in out  # only probed with --measure
+
+    rc_measured = asyncio.run(
+        cli.main(["maintain", "--force", "--measure", str(behind_clone)])
+    )
+    out_measured = capsys.readouterr().out
+    assert rc_measured == cli.SUCCESS
+    assert "of `git rev-list --count --all`" in out_measured
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from git_meta import concurrency
+
+
+def _run_windows(
+    limiter: concurrency.AdaptiveLimiter,
+    latencies: list[float],
+) -> list[int]:
+    """
+    Feed the limiter a window of operations at each latency, and return its
+    limit after each one.
+    """
+
+    limits = []
+    for latency in latencies:
+        for _ in range(max(limiter.limit, concurrency._MIN_WINDOW)):
+            limiter._observe(latency)
+        limits.append(limiter.limit)
+    return limits
+
+
+def test__adaptive_limiter__increases_while_latency_holds():
+    limiter = concurrency.AdaptiveLimiter(initial=2, max_limit=5)
+    limiter._adjust(latency=0.1, throughput=10)
+
+    for throughput in range(11, 20):
+        limiter._adjust(latency=0.1, throughput=throughput)
+
+    assert limiter.limit == 5  # capped at the maximum
+
+
+def test__adaptive_limiter__holds_when_throughput_does_not_improve():
+    limiter = concurrency.AdaptiveLimiter(initial=4)
+
+    limiter._adjust(latency=0.1, throughput=10)
+    limiter._adjust(latency=0.1, throughput=10)
+
+    assert limiter.limit == 5  # raised once, then held
+
+
+def test__adaptive_limiter__backs_off_when_latency_climbs():
+    limiter = concurrency.AdaptiveLimiter(initial=16, min_limit=2)
+
+    limits = _run_windows(limiter, [0.01] + [0.1] * 10)
+
+    assert limits[1] == 12  # 16 + 1, then cut by a quarter
+    assert limits[-1] == 2  # down to the minimum
+
+
+@pytest.mark.parametrize(
+    "args, network",
+    [
+        (("fetch", "--prune", "origin"), True),
+        (("-c", "core.fsmonitor=false", "ls-remote", "origin"), True),
+        (("status", "--porcelain=v2"), False),
+        (("rev-parse", "HEAD"), False),
+    ],
+)
+def test__limiters__for_command(args: tuple[str, ...], network: bool):
+    limiters = concurrency.Limiters()
+
+    expected = limiters.network if network else limiters.disk
+    assert limiters.for_command(args) is expected
+
+
+def test__adaptive_limiter__slot_respects_the_limit():
+    limiter = concurrency.AdaptiveLimiter(initial=3, max_limit=3)
+    running = 0
+    max_running = 0
+
+    async def operation() -> None:
+        nonlocal running, max_running
+        async with limiter.slot():
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+    async def run() -> None:
+        await asyncio.gather(*(operation() for _ in range(20)))
+
+    asyncio.run(run())
+
+    assert max_running == 3
+    assert limiter.in_flight == 0
+
+
+def test__adaptive_limiter__cancelled_waiters_do_not_hold_slots():
+    limiter = concurrency.AdaptiveLimiter(initial=1, max_limit=1)
+
+    async def operation() -> None:
+        async with limiter.slot():
+            await asyncio.sleep(0.01)
+
+    async def run() -> None:
+        first = asyncio.create_task(operation())
+        waiting = asyncio.create_task(operation())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.wait_for(asyncio.gather(first, operation()), 1)
+
+    asyncio.run(run())
+
+    assert limiter.in_flight == 0
+
+
+def test__slot__only_limits_within_limiting():
+    limiters = concurrency.Limiters(
+        disk=concurrency.AdaptiveLimiter(initial=1, max_limit=1)
+    )
+
+    async def run() -> None:
+        async with concurrency.slot(("status",)):
+            assert limiters.disk.in_flight == 0
+        with concurrency.limiting(limiters):
+            async with concurrency.slot(("status",)):
+                assert limiters.disk.in_flight == 1
+
+    asyncio.run(run())
+
+    assert concurrency.current_limiters() is None
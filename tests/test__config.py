@@ -83,7 +83,7 @@ def test__set_repository_config__happy_path(
 
 @pytest.mark.parametrize(
     "repo, key, expected",
-    [("repos/foo", "default_branch_name", "main")],
+    [("repos/foo", "default_branch_name", None)],
 )
 def test__unset_repository_config__happy_path(
     standard_config: config.Config,
@@ -101,3 +101,73 @@ def test__unset_repository_config__happy_path(
 
     actual = getattr(standard_config.repositories[str(repository)], key)
     assert actual == expected
+
+
+@pytest.mark.parametrize(
+    "pattern, path, expected",
+    [
+        ("/work/legacy", "/work/legacy/repo", True),
+        ("/work/legacy", "/work/legacy", True),
+        ("/work/legacy", "/work/legacy-2/repo", False),
+        ("/work/legacy/*", "/work/legacy/repo/nested", True),
+        ("/work/*/repo", "/work/legacy/repo", True),
+        ("/work/*/repo", "/work/legacy/other", False),
+        ("/work/**/repo", "/work/repo", True),
+        ("/work/**/repo", "/work/a/b/repo", True),
+        ("/work/**/repo", "/work/a/b/other", False),
+        ("/work/repo-[0-9]", "/work/repo-1", True),
+        ("/work/repo-[0-9]", "/work/repo-a", False),
+    ],
+)
+def test__rule_matcher(pattern: str, path: str, expected: bool):
+    assert (config.RuleMatcher({pattern: 0}).match(path) == [0]) is expected
+
+
+def test__rule_matcher__returns_the_matching_values_in_order():
+    matcher = config.RuleMatcher(
+        {
+            "/work/*/repo": "a",
+            "/work": "b",
+            "/work/*/other": "c",
+            "/work/legacy/*": "d",
+        }
+    )
+
+    assert matcher.match("/work/legacy/repo") == ["a", "b", "d"]
+    assert matcher.match("/elsewhere/repo") == []
+
+
+def test__repository_config__precedence(tmp_path: pathlib.Path):
+    """
+    A repository's own settings win over the rules matching it, and later
+    rules win over earlier ones.
+    """
+
+    conf = config.Config.from_json(
+        {
+            "rules": {
+                f"{tmp_path}/work": {"default_branch_name": "develop"},
+                f"{tmp_path}/work/legacy/*": {
+                    "default_branch_name": "master",
+                    "fetch": False,
+                },
+            },
+            "repositories": {
+                f"{tmp_path}/work/legacy/own": {"default_branch_name": "trunk"},
+                f"{tmp_path}/work/legacy/tuned": {"tuned": {"a.b": None}},
+            },
+        }
+    )
+
+    def resolve(repo: str) -> tuple[str | None, bool | None]:
+        repo_config = conf.repository_config(tmp_path / repo)
+        return repo_config.default_branch_name, repo_config.fetch
+
+    assert resolve("elsewhere") == (None, None)
+    assert resolve("work/new") == ("develop", None)
+    assert resolve("work/legacy/old") == ("master", False)
+    assert resolve("work/legacy/own") == ("trunk", False)
+    assert resolve("work/legacy/tuned") == ("master", False)
+    assert conf.repository_config(tmp_path / "work/legacy/tuned").tuned == {
+        "a.b": None
+    }
@@ -0,0 +1,249 @@
+import asyncio
+import pathlib
+import shutil
+import sys
+import tempfile
+from collections.abc import AsyncGenerator, Generator
+
+import pytest
+
+from git_meta import cache, daemon, main
+from git_meta.status import RepoState, RepoStatus
+from tests.conftest import git, make_repo
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="Unix sockets are not available on Windows",
+)
+
+
+@pytest.fixture
+def socket_path() -> Generator[pathlib.Path]:
+    # Unix socket paths are limited to ~100 characters, which the pytest
+    # temporary directories can exceed
+    socket_dir = pathlib.Path(tempfile.mkdtemp(dir="/tmp"))
+    yield socket_dir / "daemon.sock"
+    shutil.rmtree(socket_dir)
+
+
+async def _query(socket_path: pathlib.Path) -> dict[str, RepoState]:
+    return {state.repo_dir: state async for state in daemon.query(socket_path)}
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test__daemon__serves_and_refreshes_statuses(
+    tmp_path: pathlib.Path,
+    socket_path: pathlib.Path,
+    use_inotify: bool,
+):
+    repo = make_repo(tmp_path / "repo")
+
+    async def repositories() -> AsyncGenerator[pathlib.Path]:
+        yield repo
+
+    async def run() -> tuple[dict[str, RepoState], dict[str, RepoState]]:
+        daemon_ = daemon.Daemon(
+            repositories,
+            socket_path=socket_path,
+            poll_interval=0.05,
+            use_inotify=use_inotify,
+        )
+        serving = asyncio.create_task(daemon_.serve())
+        while not daemon_.warmed_up:
+            await asyncio.sleep(0.01)
+
+        before = await _query(socket_path)
+        (repo / "untracked.txt").write_text("")
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if daemon_.states[str(repo)].flags != before[str(repo)].flags:
+                break
+        after = await _query(socket_path)
+
+        serving.cancel()
+        return before, after
+
+    before, after = asyncio.run(run())
+
+    assert before[str(repo)].flags == RepoStatus.CLEAN_AND_UPDATED
+    assert after[str(repo)].flags == RepoStatus.UNTRACKED_FILES
+    assert not socket_path.exists()
+
+
+def test__query__no_daemon(socket_path: pathlib.Path):
+    with pytest.raises(daemon.DaemonError):
+        asyncio.run(_query(socket_path))
+
+
+def test__daemon__warming_up(tmp_path: pathlib.Path, socket_path: pathlib.Path):
+    """
+    The socket is served straight away, before the first refresh is over.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    discovered = asyncio.Event()
+
+    async def repositories() -> AsyncGenerator[pathlib.Path]:
+        await discovered.wait()
+        yield repo
+
+    async def run() -> dict[str, RepoState]:
+        daemon_ = daemon.Daemon(repositories, socket_path=socket_path)
+        serving = asyncio.create_task(daemon_.serve())
+        while not socket_path.exists():
+            await asyncio.sleep(0.01)
+
+        with pytest.raises(daemon.DaemonWarmingUpError):
+            await _query(socket_path)
+        discovered.set()
+        while not daemon_.warmed_up:
+            await asyncio.sleep(0.01)
+        states = await _query(socket_path)
+
+        serving.cancel()
+        return states
+
+    assert list(asyncio.run(run())) == [str(repo)]
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux-only"
+)
+def test__daemon__forgets_repositories_that_are_gone(
+    tmp_path: pathlib.Path,
+    socket_path: pathlib.Path,
+):
+    repos = [make_repo(tmp_path / f"repo-{i}") for i in range(2)]
+    (repos[0] / "subdir").mkdir()
+
+    async def repositories() -> AsyncGenerator[pathlib.Path]:
+        for repo in repos:
+            if repo.exists():
+                yield repo
+
+    async def run() -> None:
+        daemon_ = daemon.Daemon(repositories, socket_path=socket_path)
+        assert daemon_._inotify is not None
+        watches = daemon_._inotify.watches
+        serving = asyncio.create_task(daemon_.serve())
+        while not daemon_.warmed_up:
+            await asyncio.sleep(0.01)
+        watched = len(watches)
+
+        # Deleting a watched directory removes its watch
+        (repos[0] / "subdir").rmdir()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(watches) < watched:
+                break
+        assert len(watches) == watched - 1
+
+        shutil.rmtree(repos[1])
+        await daemon_.refresh_all()
+        assert {repo for _, repo, _ in watches.values()} == {repos[0]}
+        assert list(daemon_.states) == [str(repos[0])]
+
+        serving.cancel()
+
+    asyncio.run(run())
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__polling_watcher__notices_worktree_edits(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    (repo / "src").mkdir()
+    (repo / "src" / "module.py").write_text("a = 1\n")
+    git("add", "src", cwd=repo)
+    git("commit", "--quiet", "--message", "Add module", cwd=repo)
+    changes = []
+
+    async def run() -> None:
+        watcher = daemon._PollingWatcher(
+            lambda repo_dir, _: changes.append(repo_dir), interval=0.01
+        )
+        watcher.watch(repo)
+        watcher.start()
+        await asyncio.sleep(0.05)
+        assert not changes
+        (repo / "src" / "module.py").write_text("a = 22\n")
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if changes:
+                break
+        watcher.close()
+
+    asyncio.run(run())
+
+    assert changes[:1] == [repo]
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__polling_watcher__skips_what_was_refreshed(tmp_path: pathlib.Path):
+    """
+    A change that a refresh already saw isn't polled as a change again.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    changes = []
+
+    async def run() -> None:
+        watcher = daemon._PollingWatcher(
+            lambda repo_dir, _: changes.append(repo_dir), interval=0.01
+        )
+        watcher.watch(repo)
+        watcher.start()
+        await asyncio.sleep(0.05)
+        (repo / "untracked.txt").write_text("")
+        watcher.seen(repo, cache.fingerprint(repo))
+        await asyncio.sleep(0.05)
+        watcher.close()
+
+    asyncio.run(run())
+
+    assert not changes
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__daemon__git_dir_changes_refresh_if_the_fingerprint_changed(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: pathlib.Path,
+):
+    """
+    Changes in the git directory (like our own `git status` refreshing the
+    index) only refresh a repository whose fingerprint changed, and changes
+    in the worktree always refresh it.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    refreshed = []
+    get_repo_state = main.get_repo_state
+
+    async def _get_repo_state(repo_dir: pathlib.Path) -> RepoState:
+        refreshed.append(repo_dir)
+        return await get_repo_state(repo_dir)
+
+    monkeypatch.setattr(main, "get_repo_state", _get_repo_state)
+
+    async def settle(daemon_: daemon.Daemon) -> None:
+        await asyncio.sleep(daemon._DEBOUNCE_SECONDS * 2)
+        while daemon_._refreshing:
+            await asyncio.sleep(0.01)
+
+    async def run() -> None:
+        async def repositories() -> AsyncGenerator[pathlib.Path]:
+            yield repo
+
+        daemon_ = daemon.Daemon(repositories, use_inotify=False)
+        await daemon_.refresh_all()
+        assert refreshed == [repo]
+
+        daemon_._on_change(repo, True)
+        await settle(daemon_)
+        assert refreshed == [repo]
+
+        daemon_._on_change(repo, False)
+        daemon_._on_change(repo, True)
+        await settle(daemon_)
+        assert refreshed == [repo, repo]
+
+    asyncio.run(run())
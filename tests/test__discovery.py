@@ -0,0 +1,159 @@
+import asyncio
+import pathlib
+
+import pytest
+
+from git_meta import discovery
+
+
+@pytest.fixture
+def repo_tree(tmp_path: pathlib.Path) -> pathlib.Path:
+    """
+    A directory tree with git repositories at different depths.
+    """
+
+    root = tmp_path / "root"
+    for repo in ["a", "b/c", "b/d/e", "a/nested"]:
+        (root / repo / ".git").mkdir(parents=True)
+    (root / "b" / "f" / "not-a-repo").mkdir(parents=True)
+    (root / "b" / "file.txt").write_text("")
+
+    return root
+
+
+@pytest.fixture
+def scans(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """
+    The directories that were listed during the test.
+    """
+
+    scanned = []
+    scan_directory = discovery._scan_directory
+
+    def _scan_directory(
+        path: str, nested: bool = False
+    ) -> tuple[bool, list[str]]:
+        scanned.append(path)
+        return scan_directory(path, nested)
+
+    monkeypatch.setattr(discovery, "_scan_directory", _scan_directory)
+    monkeypatch.setattr(discovery, "_RACY_WINDOW_NS", 0)
+
+    return scanned
+
+
+def test__walk_git_repos(repo_tree: pathlib.Path):
+    index = discovery.DiscoveryIndex()
+    repos = sorted(discovery.walk_git_repos(repo_tree, index))
+
+    assert repos == [repo_tree / "a", repo_tree / "b/c", repo_tree / "b/d/e"]
+    assert list(index.roots) == [str(repo_tree)]
+
+
+def test__walk_git_repos__nested(repo_tree: pathlib.Path):
+    """
+    Nested repositories are found when asked for, even when the repository
+    they're in was indexed without walking into it.
+    """
+
+    index = discovery.DiscoveryIndex()
+    list(discovery.walk_git_repos(repo_tree, index))
+    repos = sorted(discovery.walk_git_repos(repo_tree, index, nested=True))
+
+    assert repos == [
+        repo_tree / "a",
+        repo_tree / "a/nested",
+        repo_tree / "b/c",
+        repo_tree / "b/d/e",
+    ]
+
+
+def test__walk_git_repos__unchanged_directories_are_not_rescanned(
+    repo_tree: pathlib.Path,
+    scans: list[str],
+):
+    index = discovery.DiscoveryIndex()
+    expected = list(discovery.walk_git_repos(repo_tree, index))
+    scans.clear()
+
+    assert list(discovery.walk_git_repos(repo_tree, index)) == expected
+    assert scans == []
+
+    (repo_tree / "b" / "f" / "g" / ".git").mkdir(parents=True)
+    actual = list(discovery.walk_git_repos(repo_tree, index))
+
+    assert actual == [*expected, repo_tree / "b/f/g"]
+    assert scans == [str(repo_tree / "b/f"), str(repo_tree / "b/f/g")]
+
+
+def test__walk_git_repos__rescan(repo_tree: pathlib.Path, scans: list[str]):
+    index = discovery.DiscoveryIndex()
+    list(discovery.walk_git_repos(repo_tree, index))
+    scans.clear()
+    list(discovery.walk_git_repos(repo_tree, index, rescan=True))
+
+    assert str(repo_tree) in scans
+    assert len(scans) == len(index.roots[str(repo_tree)])
+
+
+def test__save_index__round_trip(
+    repo_tree: pathlib.Path,
+    tmp_path: pathlib.Path,
+):
+    filepath = tmp_path / "cache" / "discovery.json"
+    index = discovery.DiscoveryIndex()
+    list(discovery.walk_git_repos(repo_tree, index))
+    discovery.save_index(index, filepath)
+
+    assert discovery.load_index(filepath) == index
+
+
+def test__load_index__corrupt_index_is_ignored(tmp_path: pathlib.Path):
+    filepath = tmp_path / "discovery.json"
+    filepath.write_text("{not json")
+
+    assert discovery.load_index(filepath) == discovery.DiscoveryIndex()
+
+
+@pytest.mark.parametrize(
+    "max_depth, prune, expected",
+    [
+        (None, {"b"}, ["a"]),
+        (1, set(), ["a"]),
+        (2, set(), ["a", "b/c"]),
+        (None, {"d"}, ["a", "b/c"]),
+    ],
+)
+def test__walk_git_repos__pruning(
+    repo_tree: pathlib.Path,
+    max_depth: int | None,
+    prune: set[str],
+    expected: list[str],
+):
+    repos = discovery.walk_git_repos(
+        directory=repo_tree,
+        index=discovery.DiscoveryIndex(),
+        max_depth=max_depth,
+        prune=prune,
+    )
+
+    assert sorted(repos) == [repo_tree / repo for repo in expected]
+
+
+def test__walk_git_repos__default_prune(repo_tree: pathlib.Path):
+    (repo_tree / "node_modules" / "package" / ".git").mkdir(parents=True)
+    repos = discovery.walk_git_repos(repo_tree, discovery.DiscoveryIndex())
+
+    assert repo_tree / "node_modules/package" not in list(repos)
+
+
+def test__stream_git_repos(repo_tree: pathlib.Path):
+    async def stream() -> list[pathlib.Path]:
+        index = discovery.DiscoveryIndex()
+        return [
+            path async for path in discovery.stream_git_repos(repo_tree, index)
+        ]
+
+    expected = discovery.walk_git_repos(repo_tree, discovery.DiscoveryIndex())
+
+    assert asyncio.run(stream()) == list(expected)
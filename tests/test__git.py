@@ -0,0 +1,118 @@
+import asyncio
+import pathlib
+import sys
+import time
+
+import pytest
+
+from git_meta import git
+
+
+def test__run_git_cmd_async__matches_run_git_cmd(tmp_path: pathlib.Path):
+    args = ("init", "--quiet", str(tmp_path))
+    git.run_git_cmd(args=args)
+
+    expected = git.run_git_cmd(args=("status",), git_dir=tmp_path)
+    actual = asyncio.run(
+        git.run_git_cmd_async(args=("status",), git_dir=tmp_path)
+    )
+
+    assert actual == expected
+
+
+def test__stream_git_cmd_async__matches_run_git_cmd(tmp_path: pathlib.Path):
+    git.run_git_cmd(args=("init", "--quiet", str(tmp_path)))
+    # More output than fits in one chunk
+    for i in range(4000):
+        (tmp_path / f"untracked-{i}.txt").write_text("")
+    args = ("status", "--porcelain", "--untracked-files=all")
+
+    chunks: list[bytes] = []
+    rc, err = asyncio.run(
+        git.stream_git_cmd_async(
+            args=args, consume=chunks.append, git_dir=tmp_path
+        )
+    )
+
+    assert (rc, err) == (0, "")
+    assert len(chunks) > 1
+    assert (
+        b"".join(chunks).decode().rstrip()
+        == git.run_git_cmd(args=args, git_dir=tmp_path)[1]
+    )
+
+
+def test__run_git_cmd_async__non_zero_return_code(tmp_path: pathlib.Path):
+    rc, out, err = asyncio.run(
+        git.run_git_cmd_async(args=("status",), git_dir=tmp_path)
+    )
+
+    assert rc != 0
+    assert out == ""
+    assert err != ""
+
+
+def _sleep_then_touch(marker: pathlib.Path) -> tuple[str, ...]:
+    # The shell and its `sleep` are children of git, so this also checks
+    # that the whole process group is killed
+    return ("-c", f"alias.slow=!sleep 0.5 && touch '{marker}'", "slow")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses a POSIX shell")
+def test__run_git_cmd_async__timeout(tmp_path: pathlib.Path):
+    marker = tmp_path / "marker"
+
+    rc, _, err = asyncio.run(
+        git.run_git_cmd_async(args=_sleep_then_touch(marker), timeout=0.1)
+    )
+    time.sleep(0.8)
+
+    assert rc == git.TIMEOUT_RC
+    assert err == "git slow timed out after 0.1s"
+    assert not marker.exists()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses a POSIX shell")
+def test__run_git_cmd_async__cancelled(tmp_path: pathlib.Path):
+    marker = tmp_path / "marker"
+
+    async def run() -> None:
+        task = asyncio.create_task(
+            git.run_git_cmd_async(args=_sleep_then_touch(marker))
+        )
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    time.sleep(0.8)
+
+    assert not marker.exists()
+
+
+def test__command_timeout(tmp_path: pathlib.Path):
+    """
+    The context's timeout is used unless one is given.
+    """
+
+    git.run_git_cmd(args=("init", "--quiet", str(tmp_path)))
+    with git.command_timeout(0):
+        rc, _, _ = asyncio.run(
+            git.run_git_cmd_async(args=("status",), git_dir=tmp_path)
+        )
+        rc_with_timeout, _, _ = asyncio.run(
+            git.run_git_cmd_async(
+                args=("status",), git_dir=tmp_path, timeout=10
+            )
+        )
+
+    assert rc == git.TIMEOUT_RC
+    assert rc_with_timeout == 0
+
+
+def test__current_command_timeout():
+    assert git.current_command_timeout() is None
+    with git.command_timeout(5):
+        assert git.current_command_timeout() == 5
+    assert git.current_command_timeout() is None
@@ -0,0 +1,87 @@
+import pathlib
+
+from git_meta import history
+from git_meta.status import RepoState, RepoStatus
+
+
+def _run(
+    history_: history.History,
+    states: list[RepoState],
+    max_runs: int = history.DEFAULT_MAX_RUNS,
+) -> list[bool]:
+    history_.start(pathlib.Path("/work"))
+    changed = [history_.changed(state) for state in states]
+    for state in states:
+        history_.record(state)
+    history_.finish(max_runs=max_runs)
+
+    return changed
+
+
+def test__history__changed(tmp_path: pathlib.Path):
+    """
+    Only the status is compared, not the timing.
+    """
+
+    clean = RepoStatus.CLEAN_AND_UPDATED
+    with history.History.open(tmp_path / "history.sqlite3") as history_:
+        first = _run(
+            history_,
+            [
+                RepoState(repo_dir="/a", flags=clean, duration=1.0),
+                RepoState(repo_dir="/b", flags=clean, duration=1.0),
+            ],
+        )
+        second = _run(
+            history_,
+            [
+                RepoState(repo_dir="/a", flags=clean, duration=2.0),
+                RepoState(repo_dir="/b", error="Oops", duration=1.0),
+            ],
+        )
+
+    assert first == [True, True]
+    assert second == [False, True]
+
+
+def test__history__entries_and_pruning(tmp_path: pathlib.Path):
+    with history.History.open(tmp_path / "history.sqlite3") as history_:
+        for i in range(5):
+            state = RepoState(
+                repo_dir="/a",
+                flags=RepoStatus.CLEAN_AND_UPDATED,
+                duration=float(i),
+            )
+            _run(history_, [state], max_runs=3)
+
+        entries = history_.entries("/a", limit=10)
+        runs = history_.connection.execute("SELECT COUNT(*) FROM runs")
+
+        assert [entry.duration for entry in entries] == [2.0, 3.0, 4.0]
+        assert [entry.flags for entry in entries] == [
+            RepoStatus.CLEAN_AND_UPDATED
+        ] * 3
+        assert runs.fetchone() == (3,)
+        assert history_.entries("/a", limit=1)[0].duration == 4.0
+
+
+def test__history__slowing(tmp_path: pathlib.Path):
+    durations = {
+        "/steady": [1.0, 1.0, 1.0, 1.0],
+        "/slower": [1.0, 1.0, 3.0, 5.0],
+    }
+    with history.History.open(tmp_path / "history.sqlite3") as history_:
+        for i in range(4):
+            _run(
+                history_,
+                [
+                    RepoState(repo_dir=repo, duration=runs[i])
+                    for repo, runs in durations.items()
+                ],
+            )
+
+        trends = history_.slowing(window=2)
+
+    assert [trend.repo_dir for trend in trends] == ["/slower", "/steady"]
+    assert trends[0].ratio == 4.0
+    assert trends[1].ratio == 1.0
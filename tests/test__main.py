@@ -0,0 +1,490 @@
+import asyncio
+import contextlib
+import pathlib
+from collections.abc import AsyncGenerator
+from typing import Any
+
+import pytest
+
+from git_meta import cache, concurrency, config, main, maintain
+from git_meta.fetcher import Fetcher, FetchProfile
+from git_meta.schedule import Durations
+from git_meta.status import GitStatus, RepoState, RepoStatus
+from tests.conftest import git, make_repo
+
+
+async def _stream(paths: list[pathlib.Path]) -> AsyncGenerator[pathlib.Path]:
+    for path in paths:
+        await asyncio.sleep(0)
+        yield path
+
+
+@pytest.mark.parametrize("jobs", [1, 3, 100])
+@pytest.mark.parametrize("streamed", [True, False])
+def test__as_completed_bounded(jobs: int, streamed: bool):
+    paths = [pathlib.Path(str(i)) for i in range(10)]
+    running = 0
+    max_running = 0
+
+    async def process(path: pathlib.Path) -> str:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001 * (int(path.name) % 3))
+        running -= 1
+        return path.name
+
+    async def run() -> list[str]:
+        repositories = _stream(paths) if streamed else paths
+        return [
+            result
+            async for result in main._as_completed_bounded(
+                repositories, process, jobs
+            )
+        ]
+
+    results = asyncio.run(run())
+
+    assert sorted(results) == sorted(path.name for path in paths)
+    assert max_running <= jobs
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 4])
+@pytest.mark.parametrize("streamed", [False, True])
+def test__as_completed_bounded__priority(jobs: int, streamed: bool):
+    """
+    The highest priority repositories start first. Repositories that are
+    streamed start as they're found, so only the ones waiting for a free
+    job are reordered.
+    """
+
+    paths = [pathlib.Path(str(i)) for i in [2, 0, 5, 1, 4, 3]]
+    started: list[str] = []
+
+    async def run() -> list[str]:
+        # The jobs hold their slots until every repository has been found
+        found_all = asyncio.Event()
+
+        async def stream() -> AsyncGenerator[pathlib.Path]:
+            async for path in _stream(paths):
+                yield path
+            found_all.set()
+
+        async def process(path: pathlib.Path) -> str:
+            started.append(path.name)
+            await found_all.wait()
+            return path.name
+
+        if not streamed:
+            found_all.set()
+        return [
+            result
+            async for result in main._as_completed_bounded(
+                stream() if streamed else paths,
+                process,
+                jobs,
+                priority=lambda path: int(path.name),
+            )
+        ]
+
+    asyncio.run(run())
+
+    if streamed:
+        # The first jobs found start straight away
+        first = [path.name for path in paths[:jobs]]
+        rest = sorted(
+            (path.name for path in paths[jobs:]), key=int, reverse=True
+        )
+        assert started == first + rest
+    else:
+        assert started == ["5", "4", "3", "2", "1", "0"]
+
+
+def test__timed__records_timed_out_steps(tmp_path: pathlib.Path):
+    """
+    A step that times out is recorded as taking as long as it ran for, but
+    only if that's longer than it was expected to take.
+    """
+
+    durations = Durations(tmp_path / "durations.json")
+    for fast in ["fast", "faster"]:
+        durations.observe(pathlib.Path(fast), "status", 0.001)
+    slow, slower = pathlib.Path("slow"), pathlib.Path("slower")
+    durations.observe(slower, "status", 60.0)
+
+    async def time_out(repo_dir: pathlib.Path) -> None:
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(0.05):
+                with main._timed(durations, repo_dir, "status"):
+                    await asyncio.sleep(1)
+
+    asyncio.run(time_out(slow))
+    asyncio.run(time_out(slower))
+
+    assert durations.entries[str(slow)]["status"] >= 0.05
+    assert durations.entries[str(slower)]["status"] == 60.0
+
+
+def test__report_states__records_durations(tmp_path: pathlib.Path):
+    repos = [make_repo(tmp_path / f"repo-{i}") for i in range(2)]
+    durations = Durations(tmp_path / "durations.json")
+
+    async def report() -> list[RepoState]:
+        return [
+            state
+            async for state in main.report_states(
+                repos, fetch=False, durations=durations, schedule="lpt"
+            )
+        ]
+
+    asyncio.run(report())
+
+    saved = Durations.load(tmp_path / "durations.json")
+    assert sorted(saved.entries) == [str(repo) for repo in repos]
+    assert all(set(entry) == {"status"} for entry in saved.entries.values())
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__git_report__reuses_cached_statuses(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: pathlib.Path,
+):
+    repo = make_repo(tmp_path / "repo")
+    (repo / "untracked.txt").write_text("")
+    report_cache = cache.ReportCache(filepath=tmp_path / "reports.json")
+    calls = []
+    get_git_repo_status = main._get_git_repo_status
+
+    async def _get_git_repo_status(
+        repo_dir: pathlib.Path,
+        status_timeout: float | None = None,
+        max_paths: int | None = None,
+    ) -> tuple[GitStatus, RepoStatus]:
+        calls.append(repo_dir)
+        return await get_git_repo_status(repo_dir, status_timeout, max_paths)
+
+    monkeypatch.setattr(main, "_get_git_repo_status", _get_git_repo_status)
+    fingerprints = []
+    fingerprint = cache.fingerprint
+
+    def _fingerprint(repo_dir: pathlib.Path) -> cache.Fingerprint | None:
+        fingerprints.append(repo_dir)
+        return fingerprint(repo_dir)
+
+    monkeypatch.setattr(cache, "fingerprint", _fingerprint)
+
+    async def report() -> list[main.ReportResult]:
+        return [
+            result
+            async for result in main.git_report(
+                [repo],
+                fetch=False,
+                quiet_level=1,
+                report_cache=report_cache,
+            )
+        ]
+
+    first = asyncio.run(report())
+    second = asyncio.run(report())
+
+    assert first == second
+    assert first[0][0] == 1
+    assert calls == [repo]
+    assert fingerprints == [repo, repo]  # once per lookup
+    assert report_cache.filepath.exists()
+
+
+@pytest.mark.usefixtures("no_racy_window")
+def test__git_report__cache_notices_worktree_edits(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    (repo / "src").mkdir()
+    (repo / "src" / "module.py").write_text("a = 1\n")
+    git("add", "src", cwd=repo)
+    git("commit", "--quiet", "--message", "Add module", cwd=repo)
+    report_cache = cache.ReportCache(filepath=tmp_path / "reports.json")
+
+    async def report() -> RepoStatus:
+        states = main.report_states(
+            [repo], fetch=False, report_cache=report_cache
+        )
+        (state,) = [state async for state in states]
+        return state.flags
+
+    assert asyncio.run(report()) == RepoStatus.CLEAN_AND_UPDATED
+    assert str(repo) in report_cache.entries
+    (repo / "src" / "module.py").write_text("a = 22\n")
+
+    assert RepoStatus.DIRTY in asyncio.run(report())
+
+
+def test__get_repo_state__partial_when_status_is_slow(tmp_path: pathlib.Path):
+    """
+    A status that takes too long is retried without looking for untracked
+    files, and flagged as partial.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    (repo / "untracked.txt").write_text("")
+
+    state = asyncio.run(main.get_repo_state(repo, status_timeout=0))
+
+    assert state.error == ""
+    assert state.flags == RepoStatus.PARTIAL
+
+
+def test__report_states__auto_jobs(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: pathlib.Path,
+):
+    """
+    With "auto" jobs, the git commands run under adaptive limiters instead.
+    """
+
+    # Keep every latency for the assertions
+    monkeypatch.setattr(concurrency, "_MIN_WINDOW", 10_000)
+    repos = [make_repo(tmp_path / f"repo-{i}") for i in range(3)]
+    limiters = concurrency.Limiters()
+
+    async def report() -> list[RepoState]:
+        with concurrency.limiting(limiters):
+            return [
+                state
+                async for state in main.report_states(
+                    repos, fetch=False, jobs=concurrency.AUTO
+                )
+            ]
+
+    states = asyncio.run(report())
+
+    assert sorted(state.repo_dir for state in states) == [
+        str(repo) for repo in repos
+    ]
+    assert all(state.error == "" for state in states)
+    assert limiters.disk._latencies  # the status commands were limited
+    assert limiters.disk.in_flight == 0
+
+
+def test__get_repo_state__branches(
+    remote_and_clone: tuple[pathlib.Path, pathlib.Path],
+):
+    """
+    Every local branch is compared with its upstream, not just the current
+    one.
+    """
+
+    _, clone = remote_and_clone
+    git("branch", "--quiet", "--track", "ahead", "origin/main", cwd=clone)
+    git("switch", "--quiet", "ahead", cwd=clone)
+    git("commit", "--quiet", "--allow-empty", "--message", "New", cwd=clone)
+    git("switch", "--quiet", "main", cwd=clone)
+
+    without = asyncio.run(main.get_repo_state(clone))
+    state = asyncio.run(main.get_repo_state(clone, branches=True))
+
+    assert without.branches is None
+    assert RepoStatus.BRANCHES_AHEAD not in without.flags
+    assert state.branches is not None
+    assert [(b.name, b.ahead, b.current) for b in state.branches] == [
+        ("ahead", 1, False),
+        ("main", 0, True),
+    ]
+    assert RepoStatus.BRANCHES_AHEAD in state.flags
+    assert (
+        "ahead: ahead 1, behind 0 of origin/main"
+        in (main.format_report(state)[2])
+    )
+
+
+def test__report_states__repo_timeout(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+
+    async def report() -> list[RepoState]:
+        return [
+            state
+            async for state in main.report_states(
+                [repo], fetch=False, repo_timeout=0
+            )
+        ]
+
+    (state,) = asyncio.run(report())
+
+    assert state.repo_dir == str(repo)
+    assert state.error == "Timed out after 0s"
+    assert state.flags == RepoStatus.UNKNOWN
+
+
+@pytest.mark.parametrize(
+    "fetcher_mode, repo_config, expected",
+    [
+        (None, config.RepoConfig(), FetchProfile()),
+        (
+            None,
+            config.RepoConfig(fetch_mode="minimal"),
+            FetchProfile.minimal("origin", "main"),
+        ),
+        (
+            "minimal",
+            config.RepoConfig(default_branch_name="trunk", fetch_tags=True),
+            FetchProfile(
+                refspecs=("+refs/heads/trunk:refs/remotes/origin/trunk",),
+                tags=True,
+            ),
+        ),
+        (
+            "full",
+            config.RepoConfig(
+                fetch_mode="minimal", fetch_filter="blob:none", fetch_depth=5
+            ),
+            FetchProfile(filter="blob:none", depth=5),
+        ),
+    ],
+)
+def test__fetch_profile(
+    remote_and_clone: tuple[pathlib.Path, pathlib.Path],
+    fetcher_mode: Any,
+    repo_config: config.RepoConfig,
+    expected: FetchProfile,
+):
+    """
+    The fleet-wide mode wins over each repository's, and the rest of the
+    profile comes from the repository's config.
+    """
+
+    _, clone = remote_and_clone
+
+    profile = main._fetch_profile(
+        clone, repo_config, Fetcher(mode=fetcher_mode)
+    )
+
+    assert profile == expected
+
+
+def test__report_states__rules_can_skip_fetch(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: pathlib.Path,
+):
+    fetch = make_repo(tmp_path / "work" / "fetch")
+    skip = make_repo(tmp_path / "work" / "legacy" / "skip")
+    conf = config.Config.from_json(
+        {"rules": {str(tmp_path / "work" / "legacy"): {"fetch": False}}}
+    )
+    monkeypatch.setattr(config, "load_config", lambda: conf)
+    fetched = []
+
+    class RecordingFetcher(Fetcher):
+        async def fetch(
+            self,
+            repo_dir: pathlib.Path,
+            remote: str = "origin",
+            remote_url: str = "",
+            profile: FetchProfile | None = None,
+        ) -> None:
+            fetched.append(repo_dir)
+
+    async def report() -> list[RepoState]:
+        return [
+            state
+            async for state in main.report_states(
+                [fetch, skip], fetcher=RecordingFetcher()
+            )
+        ]
+
+    assert len(asyncio.run(report())) == 2
+    assert fetched == [fetch]
+
+
+def test__report_states_in_processes(tmp_path: pathlib.Path):
+    repos = [make_repo(tmp_path / f"repo-{i}") for i in range(3)]
+    (repos[0] / "untracked.txt").write_text("")
+
+    async def report() -> list[RepoState]:
+        return [
+            state
+            async for state in main.report_states_in_processes(
+                _stream(repos), tmp_path, 2, fetch=False
+            )
+        ]
+
+    states = sorted(asyncio.run(report()), key=lambda state: state.repo_dir)
+
+    assert [state.repo_dir for state in states] == list(map(str, repos))
+    assert [state.flags for state in states] == [
+        RepoStatus.UNTRACKED_FILES,
+        RepoStatus.CLEAN_AND_UPDATED,
+        RepoStatus.CLEAN_AND_UPDATED,
+    ]
+
+
+def test__report_states_in_processes__discovery_fails(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+
+    async def repositories() -> AsyncGenerator[pathlib.Path]:
+        yield repo
+        raise OSError("unreadable")
+
+    async def report() -> list[RepoState]:
+        return [
+            state
+            async for state in main.report_states_in_processes(
+                repositories(), tmp_path, 2, fetch=False
+            )
+        ]
+
+    with pytest.raises(OSError, match="unreadable"):
+        asyncio.run(report())
+
+
+def test__report_states_in_processes__cancelled(tmp_path: pathlib.Path):
+    async def repositories() -> AsyncGenerator[pathlib.Path]:
+        yield make_repo(tmp_path / "repo")
+        await asyncio.Event().wait()  # never finishes finding repositories
+
+    async def report() -> None:
+        states = main.report_states_in_processes(
+            repositories(), tmp_path, 2, fetch=False
+        )
+        async with contextlib.aclosing(states):
+            await anext(states)
+            await asyncio.wait_for(anext(states), 0.5)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(report())
+
+
+def test__maintain_repos(tmp_path: pathlib.Path):
+    """
+    Repositories are maintained once per interval, and their worktrees
+    only once.
+    """
+
+    repos = [make_repo(tmp_path / f"repo-{i}") for i in range(2)]
+    worktree = tmp_path / "worktree"
+    git("worktree", "add", "--quiet", "-b", "other", worktree, cwd=repos[0])
+    state_filepath = tmp_path / "maintenance.json"
+
+    async def run(**kwargs: Any) -> list[maintain.MaintainResult]:
+        results = main.maintain_repos(
+            [*repos, worktree], state_filepath=state_filepath, **kwargs
+        )
+        return [result async for result in results]
+
+    first = asyncio.run(run(jobs=1))
+    second = asyncio.run(run())
+    budgeted = asyncio.run(run(jobs=1, min_interval=0, io_budget=1))
+
+    assert [result.skipped for result in first] == [
+        "",
+        "",
+        "already maintained through another worktree",
+    ]
+    assert all(not result.error for result in first)
+    assert sorted(result.skipped for result in second) == [
+        "already maintained through another worktree",
+        "maintained recently",
+        "maintained recently",
+    ]
+    assert [result.skipped for result in budgeted] == [
+        "",
+        "over the IO budget",
+        "already maintained through another worktree",
+    ]
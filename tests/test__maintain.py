@@ -0,0 +1,63 @@
+import asyncio
+import pathlib
+
+from git_meta import maintain
+from tests.conftest import git, make_repo
+
+
+def test__run(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    objects_dir = repo / ".git" / "objects"
+
+    result = asyncio.run(
+        maintain.run(
+            maintain.MaintainResult(repo_dir=repo),
+            list(maintain.TASKS),
+            measure=True,
+        )
+    )
+
+    assert result.error == ""
+    assert result.tasks == list(maintain.TASKS)
+    assert (objects_dir / "info" / "commit-graph").exists() or (
+        objects_dir / "info" / "commit-graphs"
+    ).exists()
+    assert (objects_dir / "pack" / "multi-pack-index").exists()
+    assert result.size_before is not None
+    assert result.size_after is not None
+    assert result.probe_before is not None
+    assert result.probe_after is not None
+    assert result.duration > 0
+
+
+def test__run__skips_pack_tasks_without_packs(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+
+    result = asyncio.run(
+        maintain.run(
+            maintain.MaintainResult(repo_dir=repo),
+            ["multi-pack-index", "incremental-repack", "commit-graph"],
+        )
+    )
+
+    assert result.error == ""
+    assert result.tasks == ["commit-graph"]
+    assert result.probe_before is None  # only probed when measuring
+
+
+def test__maintenance_key__worktrees(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    worktree = tmp_path / "worktree"
+    git("worktree", "add", "--quiet", "-b", "other", worktree, cwd=repo)
+
+    assert maintain.maintenance_key(worktree) == maintain.maintenance_key(repo)
+
+
+def test__state(tmp_path: pathlib.Path):
+    filepath = tmp_path / "maintenance.json"
+    assert maintain.load_state(filepath) == {}
+
+    maintain.save_state({"a": 1.0}, filepath)
+    maintain.save_state({"b": 2.0}, filepath)
+
+    assert maintain.load_state(filepath) == {"a": 1.0, "b": 2.0}
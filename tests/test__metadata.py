@@ -0,0 +1,134 @@
+import pathlib
+
+import pytest
+
+from git_meta import metadata
+from git_meta.metadata import GitMetadata
+from tests.conftest import git, make_repo
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("", {}),
+        (
+            "[core]\n\tbare = false\n\tFileMode\n",
+            {"core.bare": ["false"], "core.filemode": ["true"]},
+        ),
+        (
+            '[remote "Origin"]\n'
+            "\turl = git@example.com:foo/bar.git  # comment\n"
+            "\tfetch = +refs/heads/*:refs/remotes/Origin/*\n"
+            "\tfetch = +refs/tags/*:refs/tags/*\n",
+            {
+                "remote.Origin.url": ["git@example.com:foo/bar.git"],
+                "remote.Origin.fetch": [
+                    "+refs/heads/*:refs/remotes/Origin/*",
+                    "+refs/tags/*:refs/tags/*",
+                ],
+            },
+        ),
+        (
+            '[branch "main"] remote = origin\n\tmerge = "refs/heads/#main"\n',
+            {
+                "branch.main.remote": ["origin"],
+                "branch.main.merge": ["refs/heads/#main"],
+            },
+        ),
+    ],
+)
+def test__parse_config(text: str, expected: dict):
+    assert metadata.parse_config(text) == expected
+
+
+def test__parse_config__includes_are_unsupported():
+    with pytest.raises(metadata.UnsupportedConfigError):
+        metadata.parse_config("[include]\n\tpath = other.config\n")
+
+
+def test__git_metadata__matches_git(
+    remote_and_clone: tuple[pathlib.Path, pathlib.Path],
+):
+    _, clone = remote_and_clone
+    git("branch", "feature/nested", cwd=clone)
+    git("branch", "packed", cwd=clone)
+    git("pack-refs", "--all", cwd=clone)
+    git("branch", "loose", cwd=clone)
+
+    meta = GitMetadata(clone)
+
+    assert meta.current_branch == "main"
+    assert meta.head_sha == git("rev-parse", "HEAD", cwd=clone)
+    assert meta.local_branches == ["feature/nested", "loose", "main", "packed"]
+    assert meta.remote_url() == git("remote", "get-url", "origin", cwd=clone)
+    assert meta.upstream_ref("main") == "refs/remotes/origin/main"
+    assert meta.resolve_ref("refs/remotes/origin/main") == meta.head_sha
+    assert meta.tracked_refs() == {
+        "refs/heads/main": "refs/remotes/origin/main"
+    }
+    assert meta.tracked_refs("upstream") == {}
+    assert meta.remote_head_branch() == "main"
+    assert meta.remote_head_branch("upstream") is None
+
+
+def test__git_metadata__linked_worktree(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    worktree = tmp_path / "worktree"
+    git("worktree", "add", "--quiet", "-b", "feature", worktree, cwd=repo)
+
+    meta = GitMetadata(worktree)
+
+    assert meta.git_dir == repo / ".git" / "worktrees" / "worktree"
+    assert meta.common_dir is not None
+    assert meta.common_dir.resolve() == (repo / ".git").resolve()
+    assert meta.current_branch == "feature"
+    assert meta.local_branches == ["feature", "main"]
+
+
+def test__git_metadata__detached_head(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    git("checkout", "--quiet", "--detach", cwd=repo)
+
+    meta = GitMetadata(repo)
+
+    assert meta.current_branch is None
+    assert meta.head_sha == git("rev-parse", "HEAD", cwd=repo)
+
+
+def test__git_metadata__not_a_repo(tmp_path: pathlib.Path):
+    meta = GitMetadata(tmp_path)
+
+    assert meta.git_dir is None
+    assert meta.local_branches is None
+    assert meta.remote_url() is None
+
+
+@pytest.mark.parametrize("version", ["2", "3", "4"])
+def test__tracked_paths(tmp_path: pathlib.Path, version: str):
+    repo = make_repo(tmp_path / "repo")
+    for path in ["a/b/c.txt", "a/b/d.txt", "a/e.txt", "skipped.txt"]:
+        (repo / path).parent.mkdir(parents=True, exist_ok=True)
+        (repo / path).write_text(path)
+    git("add", ".", cwd=repo)
+    git("update-index", "--skip-worktree", "skipped.txt", cwd=repo)
+    git("update-index", "--index-version", version, cwd=repo)
+
+    assert GitMetadata(repo).tracked_paths == [
+        b"README.md",
+        b"a/b/c.txt",
+        b"a/b/d.txt",
+        b"a/e.txt",
+    ]
+
+
+def test__tracked_paths__split_index(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    git("update-index", "--split-index", cwd=repo)
+
+    assert GitMetadata(repo).tracked_paths is None
+
+
+def test__tracked_paths__no_index(tmp_path: pathlib.Path):
+    git("init", "--quiet", tmp_path / "repo")
+
+    assert GitMetadata(tmp_path / "repo").tracked_paths == []
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import pathlib
+
+import pytest
+
+from git_meta import schedule
+
+
+def test__durations__estimate(tmp_path: pathlib.Path):
+    durations = schedule.Durations(tmp_path / "durations.json")
+    for repo, seconds in [("a", 1.0), ("b", 3.0), ("c", 10.0)]:
+        durations.observe(pathlib.Path(repo), "status", seconds)
+    durations.observe(pathlib.Path("c"), "status", 20.0)
+    durations.observe(pathlib.Path("c"), "fetch", 4.0)
+
+    assert durations.estimate(pathlib.Path("c"), ["status"]) == 15.0
+    assert durations.estimate(pathlib.Path("c"), ["fetch", "status"]) == 19.0
+    # Steps that were never timed are expected to take the median time
+    assert durations.estimate(pathlib.Path("new"), ["status"]) == 3.0
+    assert durations.estimate(pathlib.Path("a"), ["fetch", "status"]) == 5.0
+    assert durations.estimate(pathlib.Path("a"), ["update"]) == (
+        schedule.DEFAULT_ESTIMATE
+    )
+
+
+def test__durations__save_and_load(tmp_path: pathlib.Path):
+    filepath = tmp_path / "durations.json"
+    first = schedule.Durations.load(filepath)
+    second = schedule.Durations.load(filepath)
+    first.observe(pathlib.Path("a"), "fetch", 1.0)
+    second.observe(pathlib.Path("b"), "fetch", 2.0)
+
+    first.save()
+    second.save()  # keeps what the first saved
+
+    loaded = schedule.Durations.load(filepath)
+    assert loaded.entries == {"a": {"fetch": 1.0}, "b": {"fetch": 2.0}}
+
+
+def test__durations__save__evicts_the_oldest(tmp_path: pathlib.Path):
+    filepath = tmp_path / "durations.json"
+    durations = schedule.Durations(filepath, max_entries=2)
+    for repo in ["a", "b", "c"]:
+        durations.observe(pathlib.Path(repo), "status", 1.0)
+    durations.observe(pathlib.Path("a"), "status", 1.0)
+
+    durations.save()
+
+    assert list(schedule.Durations.load(filepath).entries) == ["c", "a"]
+
+
+@pytest.mark.parametrize("content", ["", "[]", '{"entries": {"a": 1}}'])
+def test__durations__load__corrupt(tmp_path: pathlib.Path, content: str):
+    filepath = tmp_path / "durations.json"
+    filepath.write_text(content)
+
+    assert schedule.Durations.load(filepath).entries == {}
+
+
+def test__priority_semaphore__highest_priority_first():
+    semaphore = schedule.PrioritySemaphore(1)
+    started: list[int] = []
+
+    async def job(priority: int) -> None:
+        async with semaphore.acquiring(priority):
+            started.append(priority)
+            await asyncio.sleep(0)
+
+    async def run() -> None:
+        await asyncio.gather(*(job(priority) for priority in [1, 5, 2, 9, 5]))
+
+    asyncio.run(run())
+
+    # The first one started before the others arrived
+    assert started == [1, 9, 5, 5, 2]
+
+
+def test__priority_semaphore__cancelled_waiters_do_not_hold_slots():
+    semaphore = schedule.PrioritySemaphore(1)
+
+    async def job() -> None:
+        async with semaphore.acquiring(0):
+            await asyncio.sleep(0.01)
+
+    async def run() -> None:
+        first = asyncio.create_task(job())
+        waiting = asyncio.create_task(job())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.wait_for(asyncio.gather(first, job()), 1)
+
+    asyncio.run(run())
+
+
+def test__durations__file_format(tmp_path: pathlib.Path):
+    filepath = tmp_path / "durations.json"
+    durations = schedule.Durations(filepath)
+    durations.observe(pathlib.Path("a"), "fetch", 1.5)
+    durations.save()
+
+    assert json.loads(filepath.read_text()) == {
+        "entries": {"a": {"fetch": 1.5}}
+    }
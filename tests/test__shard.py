@@ -0,0 +1,63 @@
+import json
+import pathlib
+
+import pytest
+
+from git_meta import shard
+from git_meta.status import RepoState, RepoStatus
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("1/1", shard.Shard(1, 1)),
+        ("3/4", shard.Shard(3, 4)),
+    ],
+)
+def test__shard__parse(text: str, expected: shard.Shard):
+    assert shard.Shard.parse(text) == expected
+    assert str(expected) == text
+
+
+@pytest.mark.parametrize("text", ["0/4", "5/4", "1", "a/b", "1/0"])
+def test__shard__parse__invalid(text: str):
+    with pytest.raises(ValueError):
+        shard.Shard.parse(text)
+
+
+def test__shard_of():
+    """
+    Every repository is in exactly one shard, which only depends on its
+    path under the root.
+    """
+
+    repos = [f"group-{i % 7}/repo-{i}" for i in range(200)]
+    shards = [shard.Shard(i, 4) for i in range(1, 5)]
+    root, other_root = pathlib.Path("/work"), pathlib.Path("/mnt/agent/work")
+
+    for repo in repos:
+        containing = [s for s in shards if s.contains(root / repo, root)]
+        assert len(containing) == 1
+        assert containing[0].contains(other_root / repo, other_root)
+
+    sizes = [sum(s.contains(root / r, root) for r in repos) for s in shards]
+    assert min(sizes) > 0
+
+
+def test__load_results(tmp_path: pathlib.Path):
+    first, second = tmp_path / "1.ndjson", tmp_path / "2.ndjson"
+    with open(first, "w") as f:
+        shard.write_result(RepoState(repo_dir="/b"), f)
+        shard.write_result(RepoState(repo_dir="/c"), f)
+    with open(second, "w") as f:
+        shard.write_result(
+            RepoState(repo_dir="/a", flags=RepoStatus.CLEAN_AND_UPDATED), f
+        )
+        shard.write_result(RepoState(repo_dir="/c", error="Later"), f)
+
+    states = shard.load_results([first, second])
+
+    assert [state.repo_dir for state in states] == ["/a", "/b", "/c"]
+    assert states[0].flags == RepoStatus.CLEAN_AND_UPDATED
+    assert states[2].error == "Later"
+    assert json.loads(first.read_text().splitlines()[0])["repo_dir"] == "/b"
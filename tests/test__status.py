@@ -0,0 +1,209 @@
+import pytest
+
+from git_meta import status
+from git_meta.status import GitStatus, RepoState, RepoStatus
+
+OID = "cdd3c4f455ec0222ef4015b3b580efbdb36da3b0"
+MODES = "N... 100644 100644 100644"
+HASHES = f"{OID} {OID}"
+
+
+@pytest.mark.parametrize(
+    "output, expected",
+    [
+        # New repo without any commits
+        (
+            "# branch.oid (initial)\0# branch.head main\0",
+            GitStatus(branch="main"),
+        ),
+        # Detached HEAD
+        (
+            f"# branch.oid {OID}\0# branch.head (detached)\0",
+            GitStatus(oid=OID),
+        ),
+        # Upstream with ahead/behind counts
+        (
+            f"# branch.oid {OID}\0# branch.head main\0"
+            "# branch.upstream origin/main\0# branch.ab +1 -20\0",
+            GitStatus(
+                oid=OID,
+                branch="main",
+                upstream="origin/main",
+                ahead=1,
+                behind=20,
+            ),
+        ),
+        # Staged, unstaged, renamed, conflicted, and untracked paths
+        (
+            f"# branch.oid {OID}\0# branch.head main\0"
+            f"1 .M {MODES} {HASHES} a\0"
+            f"1 MM {MODES} {HASHES} with space\0"
+            f"2 R. {MODES} {HASHES} R100 new name\0old name\0"
+            f"u UU N... 100644 100644 100644 100644 {HASHES} {OID} conflict\0"
+            "? untracked\0",
+            GitStatus(
+                oid=OID,
+                branch="main",
+                staged=["with space", "new name"],
+                unstaged=["a", "with space"],
+                untracked=["untracked"],
+                conflicted=["conflict"],
+            ),
+        ),
+    ],
+)
+def test__parse_porcelain_v2(output: str, expected: GitStatus):
+    assert status.parse_porcelain_v2(output) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test__porcelain_v2_parser__chunks(chunk_size: int):
+    """
+    Entries (including a rename and its original path) can be split across
+    chunks anywhere.
+    """
+
+    output = (
+        f"# branch.oid {OID}\0# branch.head main\0"
+        f"1 .M {MODES} {HASHES} a\0"
+        f"2 R. {MODES} {HASHES} R100 new name\0old name\0"
+        "? untracked\0"
+    ).encode()
+    parser = status.PorcelainV2Parser()
+    for i in range(0, len(output), chunk_size):
+        parser.feed(output[i : i + chunk_size])
+
+    assert parser.close() == status.parse_porcelain_v2(output.decode())
+
+
+def test__porcelain_v2_parser__max_paths():
+    output = "".join(f"? untracked-{i}\0" for i in range(5))
+    output += f"1 .M {MODES} {HASHES} a\0"
+
+    git_status = status.parse_porcelain_v2(output, max_paths=2)
+
+    assert git_status.untracked == ["untracked-0", "untracked-1"]
+    assert git_status.untracked_count == 5
+    assert git_status.unstaged == ["a"]
+    assert git_status.has_paths(2)
+    assert not git_status.has_paths(3)
+    assert not git_status.has_paths(None)
+    assert "...and 3 more" in status.format_status(git_status)
+
+
+@pytest.mark.parametrize(
+    "git_status, expected",
+    [
+        (GitStatus(), RepoStatus.CLEAN_AND_UPDATED),
+        (GitStatus(behind=1), RepoStatus.BEHIND_REMOTE),
+        (
+            GitStatus(ahead=1, unstaged=["a"], untracked=["b"]),
+            RepoStatus.AHEAD_OF_REMOTE
+            | RepoStatus.DIRTY
+            | RepoStatus.UNTRACKED_FILES,
+        ),
+        (
+            GitStatus(staged=["a"], conflicted=["b"]),
+            RepoStatus.STAGED_CHANGES | RepoStatus.CONFLICTS,
+        ),
+    ],
+)
+def test__git_status__flags(git_status: GitStatus, expected: RepoStatus):
+    assert git_status.flags == expected
+
+
+@pytest.mark.parametrize(
+    "repo_status, expected",
+    [
+        (RepoStatus.CLEAN_AND_UPDATED, "clean_and_updated"),
+        (RepoStatus.DIRTY, "dirty"),
+        (
+            RepoStatus.UNTRACKED_FILES | RepoStatus.BEHIND_REMOTE,
+            "untracked_files, behind_remote",
+        ),
+    ],
+)
+def test__repo_status__str(repo_status: RepoStatus, expected: str):
+    assert str(repo_status) == expected
+
+
+def test__repo_state__to_record():
+    """
+    Records count the changed paths and list the flags by name.
+    """
+
+    state = RepoState(
+        repo_dir="/repo",
+        status=GitStatus(
+            branch="main",
+            untracked=["a", "b"],
+            unstaged=["c"],
+        ),
+        flags=RepoStatus.UNTRACKED_FILES | RepoStatus.DIRTY,
+    )
+
+    record = state.to_record()
+
+    assert record["path"] == "/repo"
+    assert record["remote"] is None
+    assert (record["untracked"], record["unstaged"], record["staged"]) == (
+        2,
+        1,
+        0,
+    )
+    assert record["flags"] == ["untracked_files", "dirty"]
+    assert RepoState(repo_dir="/repo").to_record()["flags"] == ["unknown"]
+
+
+def test__parse_branches():
+    output = "\n".join(
+        [
+            " \0main\0origin/main\0",
+            "*\0feature\0origin/feature\0ahead 2, behind 1",
+            " \0stale\0origin/stale\0behind 3",
+            " \0merged\0origin/merged\0gone",
+            " \0local\0\0",
+        ]
+    )
+
+    branches = status.parse_branches(output)
+
+    assert branches == [
+        status.BranchStatus(name="main", upstream="origin/main"),
+        status.BranchStatus(
+            name="feature",
+            upstream="origin/feature",
+            ahead=2,
+            behind=1,
+            current=True,
+        ),
+        status.BranchStatus(name="stale", upstream="origin/stale", behind=3),
+        status.BranchStatus(name="merged", upstream="origin/merged", gone=True),
+        status.BranchStatus(name="local"),
+    ]
+    # The current branch is already reported by the status
+    flags = [branch.flags for branch in branches]
+    assert flags == [
+        RepoStatus.CLEAN_AND_UPDATED,
+        RepoStatus.CLEAN_AND_UPDATED,
+        RepoStatus.BRANCHES_BEHIND,
+        RepoStatus.BRANCHES_BEHIND,
+        RepoStatus.CLEAN_AND_UPDATED,
+    ]
+    assert status.format_branches(branches).splitlines() == [
+        "Branches:",
+        "\t* feature: ahead 2, behind 1 of origin/feature",
+        "\t  stale: ahead 0, behind 3 of origin/stale",
+        "\t  merged: origin/merged is gone",
+        "\t  local: no upstream",
+    ]
+
+
+def test__repo_state__json__branches():
+    state = RepoState(
+        repo_dir="/repo",
+        branches=[status.BranchStatus(name="main", ahead=1)],
+    )
+
+    assert RepoState.from_json(state.to_json()) == state
+    assert RepoState(repo_dir="/repo").to_record().get("branches") is None
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import json
+import pathlib
+
+import pytest
+
+from git_meta import git, timings
+from tests.conftest import make_repo
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        (("status", "--porcelain=v2"), "git status"),
+        (("remote", "get-url", "origin"), "git remote get-url"),
+        (("fetch", "origin", "--prune"), "git fetch"),
+        (("-c", "a.b=c", "-c", "d.e=f", "status"), "git status"),
+        ((), "git"),
+    ],
+)
+def test__command_name(args: tuple[str, ...], expected: str):
+    """
+    Commands are named by their subcommand, without their arguments.
+    """
+
+    assert timings.command_name(args) == expected
+
+
+def test__git_commands_are_only_recorded_when_recording(tmp_path: pathlib.Path):
+    """
+    Git commands are recorded with their exit codes while recording, and
+    not at all otherwise.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    asyncio.run(git.run_git_cmd_async(("status",), git_dir=repo))
+
+    recorder = timings.Recorder()
+    with timings.recording(recorder):
+        asyncio.run(git.run_git_cmd_async(("status",), git_dir=repo))
+        git.run_git_cmd(("rev-parse", "--verify", "nope"), git_dir=repo)
+
+    assert [(s.name, s.repo_dir, s.rc) for s in recorder.spans] == [
+        ("git status", str(repo), 0),
+        ("git rev-parse", str(repo), 128),
+    ]
+    assert all(span.duration > 0 for span in recorder.spans)
+
+
+def test__exports_and_summary():
+    """
+    The spans can be written as NDJSON or a Chrome trace, and summarised.
+    """
+
+    recorder = timings.Recorder()
+    recorder.spans = [
+        timings.Span("report", "repo", "/a", start=100.0, duration=2.0),
+        timings.Span("git fetch", "git", "/a", start=100.5, duration=1.5),
+        timings.Span("report", "repo", "/b", start=100.0, duration=3.0),
+        timings.Span("git status", "git", "/b", start=101.0, duration=0.5),
+    ]
+
+    ndjson = io.StringIO()
+    recorder.to_ndjson(ndjson)
+    lines = [json.loads(line) for line in ndjson.getvalue().splitlines()]
+    assert [line["name"] for line in lines] == [
+        "report",
+        "git fetch",
+        "report",
+        "git status",
+    ]
+
+    trace = io.StringIO()
+    recorder.to_chrome_trace(trace)
+    events = json.loads(trace.getvalue())["traceEvents"]
+    assert events[1]["ts"] == 500_000
+    assert events[1]["dur"] == 1_500_000
+
+    summary = recorder.summary(limit=1).splitlines()
+    assert summary[1].split() == ["3.000s", "/b"]
+    assert summary[3].split()[:3] == ["1.500s", "git", "fetch"]
+
+
+def test__chrome_trace__tracks_per_process():
+    """
+    Workers with the same task name in different processes (like those of
+    ``report --processes``) get tracks of their own, named in their process.
+    """
+
+    recorder = timings.Recorder()
+    recorder.spans = [
+        timings.Span("report", "repo", "/a", 100.0, 1.0, pid=1, worker="t"),
+        timings.Span("report", "repo", "/b", 100.0, 1.0, pid=2, worker="t"),
+        timings.Span("report", "repo", "/c", 101.0, 1.0, pid=2, worker="t"),
+    ]
+
+    trace = io.StringIO()
+    recorder.to_chrome_trace(trace)
+    events = json.loads(trace.getvalue())["traceEvents"]
+
+    spans = [event for event in events if event["ph"] == "X"]
+    assert [(event["pid"], event["tid"]) for event in spans] == [
+        (1, 1),
+        (2, 2),
+        (2, 2),
+    ]
+    names = [event for event in events if event["ph"] == "M"]
+    assert [(event["pid"], event["tid"]) for event in names] == [
+        (1, 1),
+        (2, 2),
+    ]
+    assert all(event["args"]["name"] == "t" for event in names)
+
+
+def test__current_recorder():
+    recorder = timings.Recorder()
+
+    assert timings.current_recorder() is None
+    with timings.recording(recorder):
+        assert timings.current_recorder() is recorder
+    assert timings.current_recorder() is None
@@ -0,0 +1,93 @@
+import asyncio
+import pathlib
+
+import pytest
+
+import git_meta
+from git_meta import config, tune
+from tests.conftest import git, make_repo
+
+
+@pytest.fixture(autouse=True)
+def config_file(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path):
+    monkeypatch.setattr(
+        config, "DEFAULT_CONFIG_FILEPATH", tmp_path / "config.json"
+    )
+    config.load_config.cache_clear()
+    yield
+    config.load_config.cache_clear()
+
+
+def _collect(results) -> list[tune.TuneResult]:
+    async def run() -> list[tune.TuneResult]:
+        return [result async for result in results]
+
+    return asyncio.run(run())
+
+
+def test__index_entries(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    (repo / "a.txt").write_text("a\n")
+    (repo / "b.txt").write_text("b\n")
+    git("add", "a.txt", "b.txt", cwd=repo)
+
+    assert tune.index_entries(repo) == len(git("ls-files", cwd=repo).split())
+    assert tune.index_entries(tmp_path) is None
+
+
+def test__recommend(tmp_path: pathlib.Path):
+    """
+    The large worktree accelerators are only recommended for large
+    worktrees, and nothing is recommended once it's enabled.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+
+    small = asyncio.run(tune.recommend(repo))
+    large = asyncio.run(tune.recommend(repo, min_files=0))
+    git("config", "core.untrackedCache", "true", cwd=repo)
+    enabled = asyncio.run(tune.recommend(repo))
+
+    assert small.recommended == ["untracked-cache", "commit-graph"]
+    assert "many-files" in large.recommended
+    assert enabled.recommended == ["commit-graph"]
+
+
+def test__recommend__fsmonitor(tmp_path: pathlib.Path):
+    repo = make_repo(tmp_path / "repo")
+    supported = asyncio.run(tune.fsmonitor_supported())
+
+    given = asyncio.run(tune.recommend(repo, min_files=0, fsmonitor=True))
+    asked = asyncio.run(tune.recommend(repo, min_files=0))
+
+    assert "fsmonitor" in given.recommended
+    assert ("fsmonitor" in asked.recommended) is supported
+
+
+def test__tune_repos__apply_and_revert(tmp_path: pathlib.Path):
+    """
+    Applying records the previous values in the config, and reverting
+    restores them.
+    """
+
+    repo = make_repo(tmp_path / "repo")
+    git("config", "core.commitGraph", "false", cwd=repo)
+
+    (applied,) = _collect(git_meta.tune_repos([repo], apply=True, jobs=1))
+    repo_config = config.load_config().repositories[str(repo)]
+
+    assert applied.error == ""
+    assert git("config", "core.commitGraph", cwd=repo) == "true"
+    assert (repo / ".git" / "objects" / "info" / "commit-graph").exists()
+    assert repo_config.tuned == {
+        "core.untrackedCache": None,
+        "core.commitGraph": "false",
+        "fetch.writeCommitGraph": None,
+    }
+
+    (reverted,) = _collect(git_meta.revert_tuning([repo], jobs=1))
+
+    assert reverted.error == ""
+    assert git("config", "core.commitGraph", cwd=repo) == "false"
+    assert "untrackedcache" not in git("config", "--list", cwd=repo).lower()
+    assert config.load_config().repositories[str(repo)].tuned == {}